@@ -0,0 +1,40 @@
+import os
+import sys
+import threading
+from pathlib import Path
+
+# Add the project root directory to the Python path
+project_root = Path(__file__).resolve().parent.parent.parent
+if str(project_root) not in sys.path:
+    sys.path.append(str(project_root))
+
+# Set the Django settings module
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'esp32_iot.settings')
+
+# Import Django after setting up the environment
+import django
+django.setup()
+
+# ASGI application: Server-Sent Events streams are served from the event loop
+# (one task per dashboard instead of one worker thread)
+from django.core.asgi import get_asgi_application
+application = get_asgi_application()
+
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger('asgi')
+
+# Start the MQTT handler in this process so that its readings reach the event bus
+try:
+    from mqtt_handler import MQTTClient
+
+    logger.info("Initializing MQTT client...")
+    mqtt_client = MQTTClient()
+    # start() bloque (loop_forever) : thread dédié, la boucle ASGI reste libre
+    threading.Thread(target=mqtt_client.start, name='mqtt-handler', daemon=True).start()
+    logger.info("MQTT Handler started successfully!")
+except ImportError as e:
+    logger.error(f"Error importing MQTT handler: {e}", exc_info=True)
+except Exception as e:
+    logger.error(f"Error starting MQTT client: {e}", exc_info=True)
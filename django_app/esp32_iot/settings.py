@@ -49,6 +49,7 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'esp32_iot.wsgi.application'
+ASGI_APPLICATION = 'esp32_iot.asgi.application'
 
 # ------------------------------
 # MONGODB ATLAS CONFIG
@@ -77,6 +78,146 @@ MQTT_SETTINGS = {
     'USERNAME': os.getenv('MQTT_USERNAME', 'esp32_user'),
     'PASSWORD': os.getenv('MQTT_PASSWORD', 'esp32_pass'),
     'TOPIC': 'esp32/humidity_soil',
+    # Abonnements multi-appareils : l'id est pris dans le payload ou au niveau '+'
+    'TOPICS': os.getenv('MQTT_TOPICS', 'esp32/humidity_soil,esp32/+/humidity_soil').split(','),
+    'DEFAULT_DEVICE_ID': os.getenv('MQTT_DEFAULT_DEVICE_ID', 'default'),
+    'CLIENT_ID': os.getenv('MQTT_CLIENT_ID', ''),
+    # Groupe d'abonnement partagé MQTT v5 ($share/<groupe>/<topic>) pour répartir
+    # les messages entre plusieurs processus consommateurs (python -m mqtt_handler.launcher)
+    'SHARED_GROUP': os.getenv('MQTT_SHARED_GROUP', ''),
+}
+
+# ------------------------------
+# INGESTION CONFIG
+# ------------------------------
+INGESTION_SETTINGS = {
+    # Écriture groupée (write-behind) vers MongoDB
+    'BATCH_SIZE': int(os.getenv('INGESTION_BATCH_SIZE', '100')),
+    'BATCH_MAX_AGE': float(os.getenv('INGESTION_BATCH_MAX_AGE', '5.0')),
+    # File bornée entre la boucle paho et les workers
+    'WORKERS': int(os.getenv('INGESTION_WORKERS', '4')),
+    'QUEUE_SIZE': int(os.getenv('INGESTION_QUEUE_SIZE', '10000')),
+    'BACKPRESSURE': os.getenv('INGESTION_BACKPRESSURE', 'drop_oldest'),  # block | drop_oldest | spill
+    # Fenêtre d'agrégation des lectures (secondes) : un document par appareil et par fenêtre
+    'AGGREGATION_WINDOW': float(os.getenv('INGESTION_AGGREGATION_WINDOW', '3600')),
+    # Seaux fermés avant la première donnée météo : gardés jusqu'au rafraîchissement suivant
+    'WEATHER_BACKLOG': int(os.getenv('INGESTION_WEATHER_BACKLOG', '10000')),
+    'SPILL_PATH': os.getenv('INGESTION_SPILL_PATH', os.path.join(BASE_DIR, 'spool', 'queue_spill.jsonl')),
+    # Spool local (write-ahead) des lectures acceptées, rejoué vers MongoDB après une panne
+    'SPOOL_DIR': os.getenv('INGESTION_SPOOL_DIR', os.path.join(BASE_DIR, 'spool', 'wal')),
+    'SPOOL_SEGMENT_BYTES': int(os.getenv('INGESTION_SPOOL_SEGMENT_BYTES', str(16 * 1024 * 1024))),
+    'SPOOL_FSYNC_INTERVAL': float(os.getenv('INGESTION_SPOOL_FSYNC_INTERVAL', '1.0')),
+    'SPOOL_FSYNC_BATCH': int(os.getenv('INGESTION_SPOOL_FSYNC_BATCH', '100')),
+    'SPOOL_RETAIN': os.getenv('INGESTION_SPOOL_RETAIN', 'False').lower() == 'true',
+    'SPOOL_REPLAY_INTERVAL': float(os.getenv('INGESTION_SPOOL_REPLAY_INTERVAL', '60')),
+    # Reconnexion avec backoff exponentiel (moteur asyncio)
+    'RECONNECT_MIN_DELAY': float(os.getenv('INGESTION_RECONNECT_MIN_DELAY', '1')),
+    'RECONNECT_MAX_DELAY': float(os.getenv('INGESTION_RECONNECT_MAX_DELAY', '60')),
+}
+
+# ------------------------------
+# STOCKAGE DES LECTURES
+# ------------------------------
+def _timeseries_granularity(window):
+    # Granularité MongoDB adaptée à l'intervalle entre deux documents d'un même appareil
+    if window >= 3600:
+        return 'hours'
+    return 'minutes' if window >= 60 else 'seconds'
+
+
+SENSOR_STORAGE = {
+    # 'standard' : collection classique ; 'timeseries' : collection time-series MongoDB (>= 5.0),
+    # remplie par : python manage.py migrate_to_timeseries
+    'BACKEND': os.getenv('SENSOR_STORAGE_BACKEND', 'standard'),
+    'COLLECTION': os.getenv('SENSOR_COLLECTION', 'sensor_readings'),
+    'TIMESERIES_COLLECTION': os.getenv('SENSOR_TIMESERIES_COLLECTION', 'sensor_readings_ts'),
+    'TIMESERIES_GRANULARITY': os.getenv('SENSOR_TIMESERIES_GRANULARITY',
+                                        _timeseries_granularity(INGESTION_SETTINGS['AGGREGATION_WINDOW'])),
+    # Taille des lots du curseur pour les lectures brutes (API, exports)
+    'READ_BATCH_SIZE': int(os.getenv('SENSOR_READ_BATCH_SIZE', '2000')),
+    # Lectures par page des exports de features : le calcul numpy d'une page amortit son coût fixe
+    'FEATURE_BATCH_SIZE': int(os.getenv('SENSOR_FEATURE_BATCH_SIZE', '20000')),
+    # Taille de page de /api/readings/by-date/ (pagination par clé) et plafond de page_size
+    'PAGE_SIZE': int(os.getenv('SENSOR_PAGE_SIZE', '1000')),
+    'MAX_PAGE_SIZE': int(os.getenv('SENSOR_MAX_PAGE_SIZE', '10000')),
+}
+
+# Rollups minute/heure/jour (count, sum, min, max, sumsq par champ), tenus à jour à l'ingestion
+# et reconstruits par : python manage.py rebuild_rollups
+ROLLUP_SETTINGS = {
+    'ENABLED': os.getenv('ROLLUPS_ENABLED', 'True').lower() == 'true',
+    'COLLECTION_PREFIX': os.getenv('ROLLUP_COLLECTION_PREFIX', 'sensor_rollups_'),
+    'RESOLUTIONS': os.getenv('ROLLUP_RESOLUTIONS', 'minute,hour,day').split(','),
+    # Plages plus courtes (secondes) lues directement dans les lectures brutes
+    'RAW_MAX_RANGE': float(os.getenv('ROLLUP_RAW_MAX_RANGE', str(6 * 3600))),
+    # Nombre minimal de points d'un graphique servi depuis les rollups
+    'CHART_MIN_POINTS': int(os.getenv('ROLLUP_CHART_MIN_POINTS', '100')),
+}
+
+# Graphiques : séries réduites par LTTB au-delà de max_points (paramètre de /dashboard/api/chart-data/)
+CHART_SETTINGS = {
+    'DEFAULT_MAX_POINTS': int(os.getenv('CHART_DEFAULT_MAX_POINTS', '1000')),
+    # Plafond de max_points accepté, quelle que soit la demande
+    'MAX_POINTS_LIMIT': int(os.getenv('CHART_MAX_POINTS_LIMIT', '5000')),
+}
+
+# ------------------------------
+# CACHE CONFIG
+# ------------------------------
+# CACHE_BACKEND : locmem (par processus), file (partagé sur la machine), redis, memcached,
+# ou chemin complet d'un backend Django ; CACHE_LOCATION selon le backend
+_CACHE_BACKENDS = {
+    'locmem': 'django.core.cache.backends.locmem.LocMemCache',
+    'file': 'django.core.cache.backends.filebased.FileBasedCache',
+    'redis': 'django.core.cache.backends.redis.RedisCache',
+    'memcached': 'django.core.cache.backends.memcached.PyMemcacheCache',
+}
+_cache_backend = os.getenv('CACHE_BACKEND', 'locmem')
+_cache_locations = {
+    'locmem': 'esp32-iot',
+    'file': os.path.join(BASE_DIR, 'cache'),
+    'redis': 'redis://localhost:6379/1',
+    'memcached': '127.0.0.1:11211',
+}
+CACHES = {
+    'default': {
+        'BACKEND': _CACHE_BACKENDS.get(_cache_backend, _cache_backend),
+        'LOCATION': os.getenv('CACHE_LOCATION', _cache_locations.get(_cache_backend, '')),
+        'TIMEOUT': 300,
+    }
+}
+if _cache_backend in ('locmem', 'file'):
+    CACHES['default']['OPTIONS'] = {'MAX_ENTRIES': int(os.getenv('CACHE_MAX_ENTRIES', '5000'))}
+
+# Cache des réponses des API de lecture, invalidé par l'ingestion (compteur de génération)
+API_CACHE = {
+    'ENABLED': os.getenv('API_CACHE_ENABLED', 'True').lower() == 'true',
+    'ALIAS': os.getenv('API_CACHE_ALIAS', 'default'),
+    # Durée de vie d'une réponse (s) : borne aussi le retard d'une fenêtre relative ("24 dernières heures")
+    'TIMEOUT': float(os.getenv('API_CACHE_TIMEOUT', '60')),
+}
+
+# Niveau chaud : anneaux en mémoire des lectures récentes de chaque appareil, remplis par l'ingestion
+# du même processus (réchauffés depuis MongoDB au démarrage du handler)
+_hot_tier_hours = float(os.getenv('HOT_TIER_HOURS', '24'))
+HOT_TIER = {
+    'ENABLED': os.getenv('HOT_TIER_ENABLED', 'True').lower() == 'true',
+    'HOURS': _hot_tier_hours,
+    # Lectures conservées par appareil (défaut : une fenêtre d'agrégation sur HOURS, plus une marge)
+    'CAPACITY': int(os.getenv('HOT_TIER_CAPACITY',
+                              str(int(_hot_tier_hours * 3600 // INGESTION_SETTINGS['AGGREGATION_WINDOW']) + 2))),
+    'MAX_DEVICES': int(os.getenv('HOT_TIER_MAX_DEVICES', '1000')),
+}
+
+# Flux Server-Sent Events du tableau de bord (/dashboard/api/stream/), alimenté par l'ingestion du même processus
+EVENT_STREAM = {
+    'MAX_CONNECTIONS': int(os.getenv('EVENT_STREAM_MAX_CONNECTIONS', '200')),
+    # Événements en attente par connexion avant de perdre les plus anciens
+    'QUEUE_SIZE': int(os.getenv('EVENT_STREAM_QUEUE_SIZE', '100')),
+    'HEARTBEAT': float(os.getenv('EVENT_STREAM_HEARTBEAT', '15')),
+    # Durée maximale d'une connexion (s) : le navigateur se reconnecte après RETRY_MS
+    'MAX_AGE': float(os.getenv('EVENT_STREAM_MAX_AGE', '600')),
+    'RETRY_MS': int(os.getenv('EVENT_STREAM_RETRY_MS', '3000')),
 }
 
 # ------------------------------
@@ -85,7 +226,13 @@ MQTT_SETTINGS = {
 OPENWEATHER_SETTINGS = {
     'API_KEY': os.getenv('OPENWEATHER_API_KEY', '0b5d680180d9c99eecfebfd9982873fd'),
     'CITY': os.getenv('OPENWEATHER_CITY', 'Tunis'),
-    'BASE_URL': 'https://api.openweathermap.org/data/2.5'
+    'BASE_URL': 'https://api.openweathermap.org/data/2.5',
+    'TIMEOUT': float(os.getenv('OPENWEATHER_TIMEOUT', '10')),
+    # Cache météo (stale-while-revalidate) et disjoncteur
+    'CACHE_TTL': float(os.getenv('OPENWEATHER_CACHE_TTL', '900')),
+    'REFRESH_INTERVAL': float(os.getenv('OPENWEATHER_REFRESH_INTERVAL', '300')),
+    'BREAKER_FAILURES': int(os.getenv('OPENWEATHER_BREAKER_FAILURES', '3')),
+    'BREAKER_RESET_TIMEOUT': float(os.getenv('OPENWEATHER_BREAKER_RESET_TIMEOUT', '120')),
 }
 
 # ------------------------------
@@ -127,7 +274,6 @@ LOGGING = {
         },
         'console': {
             'class': 'logging.StreamHandler',
-            'encoding': 'utf-8',
         },
     },
     'loggers': {
@@ -0,0 +1,234 @@
+import time
+import logging
+import threading
+from collections import deque
+from datetime import datetime
+
+logger = logging.getLogger('mqtt_handler')
+
+
+class Bucket:
+    """Running count/sum/min/max/last of one device over one time window"""
+
+    __slots__ = ('device_id', 'start', 'count', 'total', 'minimum', 'maximum',
+                 'last', 'last_at', 'extra')
+
+    def __init__(self, device_id, start):
+        self.device_id = device_id
+        self.start = start
+        self.count = 0
+        self.total = 0.0
+        self.minimum = float('inf')
+        self.maximum = float('-inf')
+        self.last = None
+        self.last_at = 0.0
+        self.extra = None
+
+    def add(self, value, received_at, extra=None):
+        self.count += 1
+        self.total += value
+        if value < self.minimum:
+            self.minimum = value
+        if value > self.maximum:
+            self.maximum = value
+        if received_at >= self.last_at:
+            self.last = value
+            self.last_at = received_at
+            if extra:
+                self.extra = extra
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+
+def rollup_document(bucket, weather, location=None):
+    """SensorData fields for a closed bucket combined with a cached weather observation"""
+    extra = bucket.extra or {}
+    return {
+        'device_id': bucket.device_id,
+        'metadata': {'device_id': bucket.device_id, 'location': location},
+        'timestamp': datetime.utcfromtimestamp(bucket.start),
+        'temperature': weather['temperature'],
+        'humidity_air': weather['humidity_air'],
+        'rain_forecast': weather['rain_forecast'],
+        'weather_stale': weather['stale'],
+        'humidity_soil': round(bucket.mean, 2),
+        'humidity_soil_min': bucket.minimum,
+        'humidity_soil_max': bucket.maximum,
+        'humidity_soil_last': bucket.last,
+        'last_sample_at': datetime.utcfromtimestamp(bucket.last_at),
+        'sample_count': bucket.count,
+        'wifi_rssi': extra.get('wifi_rssi'),
+        'uptime_ms': extra.get('uptime_ms')
+    }
+
+
+class WeatherBacklog:
+    """Closed buckets waiting for a first weather observation
+
+    A bucket closed before any weather is cached (cold start, weather API
+    down since startup) is parked with ``park()`` instead of being dropped;
+    ``drain()`` hands the parked buckets back, oldest first, once an
+    observation arrives, and they are stored with that observation. Past
+    ``maxlen`` buckets the oldest is dropped; dropped buckets and their
+    samples are counted and logged.
+    """
+
+    def __init__(self, maxlen=10000):
+        self.maxlen = maxlen
+        self._buckets = deque()
+        self._lock = threading.Lock()
+        self._stats = {'parked': 0, 'released': 0, 'dropped_buckets': 0, 'dropped_samples': 0}
+
+    def park(self, bucket):
+        dropped = None
+        with self._lock:
+            if len(self._buckets) >= self.maxlen:
+                dropped = self._buckets.popleft()
+                self._stats['dropped_buckets'] += 1
+                self._stats['dropped_samples'] += dropped.count
+            self._buckets.append(bucket)
+            self._stats['parked'] += 1
+            pending = len(self._buckets)
+        logger.warning(f"[WARN] No weather data cached yet, holding rollup of {bucket.count} readings "
+                       f"from {bucket.device_id} ({pending} rollups waiting)")
+        if dropped is not None:
+            logger.error(f"[ERROR] Weather backlog full, dropped rollup of {dropped.count} readings "
+                         f"from {dropped.device_id}")
+
+    def drain(self):
+        """Remove and return the parked buckets, oldest first"""
+        with self._lock:
+            buckets = list(self._buckets)
+            self._buckets.clear()
+            self._stats['released'] += len(buckets)
+        return buckets
+
+    def discard(self):
+        """Drop the parked buckets (shutdown without weather), returns the number of samples lost"""
+        with self._lock:
+            buckets = list(self._buckets)
+            self._buckets.clear()
+            samples = sum(bucket.count for bucket in buckets)
+            self._stats['dropped_buckets'] += len(buckets)
+            self._stats['dropped_samples'] += samples
+        if buckets:
+            logger.error(f"[ERROR] Still no weather data, dropped {len(buckets)} rollups ({samples} readings)")
+        return samples
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['pending'] = len(self._buckets)
+            stats['pending_samples'] = sum(bucket.count for bucket in self._buckets)
+        return stats
+
+
+class HourlyAggregator:
+    """Folds every reading into a per-device, per-window bucket
+
+    ``add()`` is O(1). A bucket is closed, and passed to ``on_close(bucket)``,
+    when a reading for a later window arrives for the same device or when the
+    sweeper notices that its window has ended. ``close_all()`` emits the open
+    buckets (used on shutdown).
+
+    Each device and window is emitted once. A reading that arrives after its
+    window was emitted (messages reordered by the worker pool or read back
+    from the spill file around the window boundary) is dropped and counted
+    in ``late_readings``: a second bucket for the same window would store a
+    second document for that device and hour.
+    """
+
+    def __init__(self, on_close, window=3600.0, sweep_interval=None):
+        self.on_close = on_close
+        self.window = window
+        self.sweep_interval = sweep_interval or min(60.0, window / 4)
+
+        self._buckets = {}
+        self._current = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._stats = {'readings': 0, 'buckets_closed': 0, 'late_readings': 0}
+
+    def window_start(self, received_at):
+        return received_at - (received_at % self.window)
+
+    def add(self, device_id, value, received_at, extra=None):
+        """Fold one reading into its bucket"""
+        start = self.window_start(received_at)
+        closed = None
+        with self._lock:
+            self._stats['readings'] += 1
+            key = (device_id, start)
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                current = self._current.get(device_id)
+                if current is not None and start <= current:
+                    # Fenêtre déjà émise (ou balayée) : un second seau écrirait un second document pour l'heure
+                    self._stats['late_readings'] += 1
+                else:
+                    bucket = self._buckets[key] = Bucket(device_id, start)
+                    self._current[device_id] = start
+                    if current is not None:
+                        closed = self._buckets.pop((device_id, current), None)
+            if bucket is not None:
+                bucket.add(value, received_at, extra)
+        if bucket is None:
+            logger.warning(f"[WARN] Late reading from {device_id} dropped, its window "
+                           f"{datetime.utcfromtimestamp(start).isoformat()} was already stored")
+        if closed is not None:
+            self._emit([closed])
+
+    def close_expired(self, now=None):
+        """Emit every bucket whose window has ended"""
+        now = time.time() if now is None else now
+        with self._lock:
+            keys = [key for key in self._buckets if key[1] + self.window <= now]
+            closed = [self._buckets.pop(key) for key in keys]
+        self._emit(closed)
+        return len(closed)
+
+    def close_all(self):
+        with self._lock:
+            closed = list(self._buckets.values())
+            self._buckets.clear()
+        self._emit(closed)
+        return len(closed)
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='aggregator-sweeper', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5):
+        """Stop the sweeper and emit the buckets still open"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        self.close_all()
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['open_buckets'] = len(self._buckets)
+            stats['devices'] = len(self._current)
+        return stats
+
+    def _emit(self, buckets):
+        for bucket in sorted(buckets, key=lambda b: b.start):
+            try:
+                self.on_close(bucket)
+            except Exception as e:
+                logger.error(f"[ERROR] Failed to emit rollup for {bucket.device_id}: {e}")
+        if buckets:
+            with self._lock:
+                self._stats['buckets_closed'] += len(buckets)
+
+    def _run(self):
+        while not self._stop.wait(self.sweep_interval):
+            self.close_expired()
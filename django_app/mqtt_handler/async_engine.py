@@ -0,0 +1,340 @@
+"""
+Asyncio ingestion engine, an alternative to the paho ``loop_forever`` process
+
+The MQTT subscription, the weather refresh and the MongoDB writes run as
+cooperative tasks in a single event loop (aiomqtt, aiohttp and motor).
+Decoding, device resolution and hourly aggregation are shared with
+MQTTHandler.
+
+Run from the django_app directory:
+    python -m mqtt_handler.async_engine
+"""
+
+import time
+import random
+import signal
+import asyncio
+import logging
+from collections import Counter
+
+from django.conf import settings
+from sensor_data.models import SensorData
+from sensor_data.rollups import refresh_rollups
+from sensor_data.api_cache import bump_generation
+from mqtt_handler.weather_cache import WeatherCache, CircuitBreaker
+from mqtt_handler.devices import resolve_device_id
+from mqtt_handler.aggregator import HourlyAggregator, WeatherBacklog, rollup_document
+from mqtt_handler.payload import decode_payload
+from mqtt_handler.spool import SpoolReplayer, spool_from_settings
+from mqtt_handler.writes import ainsert_readings
+
+try:
+    import aiohttp
+    import aiomqtt
+    from motor.motor_asyncio import AsyncIOMotorClient
+except ImportError:  # pragma: no cover - dépendances du mode asyncio uniquement
+    aiohttp = aiomqtt = AsyncIOMotorClient = None
+
+logger = logging.getLogger('mqtt_handler')
+
+
+class AsyncIngestionEngine:
+    """Single event loop MQTT -> aggregation -> MongoDB pipeline"""
+
+    def __init__(self, collection=None, spool=None):
+        mqtt_settings = settings.MQTT_SETTINGS
+        ingestion = settings.INGESTION_SETTINGS
+        weather_settings = settings.OPENWEATHER_SETTINGS
+
+        self.broker_host = mqtt_settings['BROKER_HOST']
+        self.broker_port = mqtt_settings['BROKER_PORT']
+        self.username = mqtt_settings['USERNAME']
+        self.password = mqtt_settings['PASSWORD']
+        self.topics = mqtt_settings['TOPICS']
+        self.default_device_id = mqtt_settings['DEFAULT_DEVICE_ID']
+
+        self.batch_size = ingestion['BATCH_SIZE']
+        self.batch_max_age = ingestion['BATCH_MAX_AGE']
+        self.reconnect_min = ingestion['RECONNECT_MIN_DELAY']
+        self.reconnect_max = ingestion['RECONNECT_MAX_DELAY']
+
+        self.city = weather_settings['CITY']
+        self.weather_url = f"{weather_settings['BASE_URL']}/weather"
+        self.weather_api_key = weather_settings['API_KEY']
+        self.weather_timeout = weather_settings['TIMEOUT']
+        self.weather = WeatherCache(
+            None,
+            ttl=weather_settings['CACHE_TTL'],
+            refresh_interval=weather_settings['REFRESH_INTERVAL'],
+            breaker=CircuitBreaker(
+                failure_threshold=weather_settings['BREAKER_FAILURES'],
+                reset_timeout=weather_settings['BREAKER_RESET_TIMEOUT'],
+            ),
+            on_refresh=self.weather_refreshed,
+        )
+        self.weather.register(self.city)
+        # Seaux fermés sans météo en cache : émis au prochain rafraîchissement réussi
+        self.weather_backlog = WeatherBacklog(ingestion['WEATHER_BACKLOG'])
+
+        # Le balayage des seaux est fait par une tâche asyncio, pas par un thread
+        self.aggregator = HourlyAggregator(self.emit_rollup, window=ingestion['AGGREGATION_WINDOW'])
+        self.collection = collection
+        self.spool = spool
+
+        self._pending = []
+        self._pending_since = None
+        self._flush_wanted = None
+        self._stopping = None
+        self._stats = {'messages': 0, 'errors': 0, 'reconnects': 0,
+                       'flushes': 0, 'documents_written': 0, 'documents_failed': 0}
+
+    # ------------------------------------------------------------------
+    # Traitement des messages (synchrone, partagé avec le benchmark)
+    # ------------------------------------------------------------------
+    def handle(self, topic, payload, received_at):
+        """Decode one message and fold it into its device's bucket"""
+        self._stats['messages'] += 1
+        try:
+            data = decode_payload(payload)
+            device_id = resolve_device_id(topic, self.topics, data, self.default_device_id)
+            self.aggregator.add(device_id, data['humidity_soil'], received_at, data)
+        except Exception as e:
+            self._stats['errors'] += 1
+            logger.error(f"[ERROR] Error processing message: {e}")
+
+    def emit_rollup(self, bucket):
+        weather = self.weather.get(self.city)
+        if not weather:
+            self.weather_backlog.park(bucket)
+            return
+        data = rollup_document(bucket, weather, self.city)
+        # Spool local d'abord (attribue l'_id), puis file d'écriture
+        segment = self.spool.append(data) if self.spool is not None else None
+        document = SensorData(**data)
+        document.validate()
+        if not self._pending:
+            self._pending_since = time.monotonic()
+        self._pending.append((document.to_mongo().to_dict(), segment))
+        if len(self._pending) >= self.batch_size and self._flush_wanted is not None:
+            self._flush_wanted.set()
+
+    def weather_refreshed(self, location):
+        """Weather cache callback: emit the rollups closed while no weather was cached"""
+        for bucket in self.weather_backlog.drain():
+            self.emit_rollup(bucket)
+
+    async def consume(self, messages):
+        """Feed an async iterable of (topic, payload) pairs through handle()"""
+        handle = self.handle
+        count = 0
+        async for topic, payload in messages:
+            handle(topic, payload, time.time())
+            count += 1
+            # Rend la main périodiquement pour ne pas affamer les autres tâches
+            if count % 1000 == 0:
+                await asyncio.sleep(0)
+
+    # ------------------------------------------------------------------
+    # Tâches
+    # ------------------------------------------------------------------
+    async def _mqtt_task(self):
+        attempt = 0
+        while not self._stopping.is_set():
+            try:
+                logger.info(f"Connecting to MQTT broker: {self.broker_host}:{self.broker_port}")
+                async with aiomqtt.Client(self.broker_host, self.broker_port,
+                                          username=self.username or None,
+                                          password=self.password or None,
+                                          keepalive=60) as client:
+                    for topic in self.topics:
+                        await client.subscribe(topic)
+                    logger.info(f"[OK] Connected, subscribed to topics: {', '.join(self.topics)}")
+                    attempt = 0
+                    await self.consume(self._messages(client))
+            except Exception as e:
+                delay = min(self.reconnect_max, self.reconnect_min * 2 ** attempt)
+                delay = random.uniform(delay / 2, delay)
+                attempt += 1
+                self._stats['reconnects'] += 1
+                logger.error(f"MQTT connection error: {e}, reconnecting in {delay:.1f}s")
+                try:
+                    await asyncio.wait_for(self._stopping.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+
+    @staticmethod
+    async def _messages(client):
+        async for message in client.messages:
+            yield message.topic.value, message.payload
+
+    async def _weather_task(self, session):
+        cache = self.weather
+        while not self._stopping.is_set():
+            ok = True
+            for location in cache.due_locations():
+                if not cache.breaker.allow_request():
+                    ok = False
+                    continue
+                try:
+                    cache.put(location, await self._fetch_weather(session, location))
+                    cache.breaker.record_success()
+                except Exception as e:
+                    ok = False
+                    cache.breaker.record_failure()
+                    logger.error(f"Weather API error for {location}: {e}")
+            wait = cache.refresh_interval if ok else min(cache.refresh_interval, cache.retry_interval)
+            try:
+                await asyncio.wait_for(self._stopping.wait(), wait)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _fetch_weather(self, session, city):
+        params = {'q': city, 'appid': self.weather_api_key, 'units': 'metric'}
+        timeout = aiohttp.ClientTimeout(total=self.weather_timeout)
+        async with session.get(self.weather_url, params=params, timeout=timeout) as response:
+            response.raise_for_status()
+            data = await response.json()
+        return {
+            'temperature': data['main']['temp'],
+            'humidity_air': data['main']['humidity'],
+            'rain_forecast': data.get('rain', {}).get('1h', 0.0)
+        }
+
+    async def _sweeper_task(self):
+        while not self._stopping.is_set():
+            try:
+                await asyncio.wait_for(self._stopping.wait(), self.aggregator.sweep_interval)
+            except asyncio.TimeoutError:
+                self.aggregator.close_expired()
+
+    async def _writer_task(self):
+        while not self._stopping.is_set():
+            timeout = self.batch_max_age
+            if self._pending:
+                timeout = max(0.0, self.batch_max_age - (time.monotonic() - self._pending_since))
+            try:
+                await asyncio.wait_for(self._flush_wanted.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_wanted.clear()
+            await self.flush()
+
+    async def flush(self):
+        """Bulk insert the pending rollup documents"""
+        while self._pending:
+            batch = self._pending[:self.batch_size]
+            del self._pending[:self.batch_size]
+            started = time.perf_counter()
+            try:
+                # Idempotent sur les deux backends : un rejeu du spool n'écrit rien deux fois
+                await ainsert_readings(self.collection, [document for document, _ in batch])
+                if self.spool is not None:
+                    for segment, count in Counter(segment for _, segment in batch).items():
+                        self.spool.ack(segment, count)
+                # pymongo synchrone : hors de la boucle d'événements
+                await asyncio.get_running_loop().run_in_executor(
+                    None, self.documents_written, [document for document, _ in batch])
+                self._stats['flushes'] += 1
+                self._stats['documents_written'] += len(batch)
+                logger.info(f"[SAVE] Bulk inserted {len(batch)} readings in "
+                            f"{(time.perf_counter() - started) * 1000:.1f} ms")
+            except Exception as e:
+                self._stats['documents_failed'] += len(batch)
+                logger.error(f"[ERROR] Bulk insert of {len(batch)} readings failed: {e}")
+                if self.spool is not None:
+                    # Lectures restées dans le segment courant : scellé, le rejeu les reprend
+                    self.spool.rotate()
+        self._pending_since = None
+
+    def documents_written(self, documents):
+        """Refresh the rollups of written readings, then invalidate the cached API responses (blocking)"""
+        self.refresh_rollups(documents)
+        bump_generation()
+
+    def refresh_rollups(self, documents):
+        """Recompute the minute/hour/day rollups touched by written readings (blocking)"""
+        if not settings.ROLLUP_SETTINGS['ENABLED']:
+            return
+        try:
+            refresh_rollups((document.get('device_id'), document['timestamp']) for document in documents)
+        except Exception as e:
+            logger.error(f"[ERROR] Rollup refresh of {len(documents)} readings failed: {e}")
+
+    def get_stats(self):
+        return {
+            'engine': dict(self._stats, pending=len(self._pending)),
+            'aggregator': self.aggregator.get_stats(),
+            'weather_backlog': self.weather_backlog.get_stats(),
+            'weather': self.weather.get_stats(),
+            'spool': self.spool.get_stats() if self.spool is not None else None,
+        }
+
+    def stop(self):
+        if self._stopping is not None:
+            self._stopping.set()
+
+    async def run(self):
+        """Run every task until stop() is called, then flush open buckets"""
+        if aiomqtt is None:
+            raise RuntimeError("The asyncio engine requires aiomqtt, aiohttp and motor")
+        self._stopping = asyncio.Event()
+        self._flush_wanted = asyncio.Event()
+
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, self.stop)
+            except (NotImplementedError, RuntimeError):
+                pass  # Windows : Ctrl+C lève KeyboardInterrupt
+
+        mongo_client = None
+        if self.collection is None:
+            mongo = settings.MONGODB_SETTINGS
+            mongo_client = AsyncIOMotorClient(
+                mongo['host'], tls=mongo.get('tls', False),
+                tlsAllowInvalidCertificates=mongo.get('tlsAllowInvalidCertificates', False),
+            )
+            self.collection = mongo_client[mongo['db']][SensorData._get_collection_name()]
+
+        if self.spool is None:
+            self.spool = spool_from_settings()
+        self.spool.start()
+        # Le rejeu utilise pymongo (synchrone) dans son propre thread
+        replayer = SpoolReplayer(
+            self.spool,
+            SensorData._get_collection(),
+            grace=settings.INGESTION_SETTINGS['SPOOL_REPLAY_INTERVAL'],
+            interval=settings.INGESTION_SETTINGS['SPOOL_REPLAY_INTERVAL'],
+            on_documents=self.documents_written,
+        )
+        replayer.start()
+
+        async with aiohttp.ClientSession() as session:
+            tasks = [
+                asyncio.create_task(self._weather_task(session), name='weather'),
+                asyncio.create_task(self._sweeper_task(), name='sweeper'),
+                asyncio.create_task(self._writer_task(), name='writer'),
+            ]
+            mqtt_task = asyncio.create_task(self._mqtt_task(), name='mqtt')
+            try:
+                await self._stopping.wait()
+            finally:
+                self._stopping.set()
+                mqtt_task.cancel()
+                await asyncio.gather(mqtt_task, *tasks, return_exceptions=True)
+                self.aggregator.close_all()
+                self.weather_backlog.discard()
+                await self.flush()
+                replayer.stop()
+                self.spool.close()
+                logger.info(f"Ingestion stats: {self.get_stats()}")
+                if mongo_client is not None:
+                    mongo_client.close()
+
+
+if __name__ == "__main__":
+    engine = AsyncIngestionEngine()
+    try:
+        asyncio.run(engine.run())
+    except KeyboardInterrupt:
+        logger.info("[STOP] Stopping asyncio ingestion engine...")
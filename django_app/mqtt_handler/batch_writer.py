@@ -0,0 +1,177 @@
+import time
+import logging
+import threading
+
+from mqtt_handler.writes import insert_readings, merge_rollups
+
+logger = logging.getLogger('mqtt_handler')
+
+
+class BatchWriter:
+    """Write-behind buffer that bulk inserts documents into MongoDB
+
+    Readings are queued with ``add()`` and written with a single bulk insert
+    when the buffer reaches ``max_batch_size`` documents or when the oldest
+    buffered document is older than ``max_batch_age`` seconds. The insert is
+    unordered and documents whose ``id`` is already stored are skipped, so a
+    batch can safely overlap a spool replay. After a successful insert
+    ``on_written(tokens)`` receives the tokens passed to ``add()`` and
+    ``on_documents(records)`` the written records (used to refresh rollups).
+    When an insert fails, ``on_failed(tokens)`` receives the tokens of the batch.
+
+    With ``merge=True`` (several consumer processes sharing a subscription) the
+    buffered rollups are partial buckets and are merged into one document per
+    device and window with ``merge_rollups`` instead of being inserted.
+    """
+
+    def __init__(self, document_cls, max_batch_size=100, max_batch_age=5.0, on_written=None, merge=False,
+                 on_documents=None, on_failed=None):
+        self.document_cls = document_cls
+        self.max_batch_size = max_batch_size
+        self.max_batch_age = max_batch_age
+        self.on_written = on_written
+        self.on_documents = on_documents
+        self.on_failed = on_failed
+        self.merge = merge
+
+        self._buffer = []
+        self._oldest = None
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._stopping = False
+        self._thread = None
+
+        # Compteurs exposés via get_stats()
+        self._stats = {
+            'flushes': 0,
+            'failed_flushes': 0,
+            'documents_written': 0,
+            'documents_failed': 0,
+            'last_batch_size': 0,
+            'max_batch_size_seen': 0,
+            'last_flush_latency_ms': 0.0,
+            'max_flush_latency_ms': 0.0,
+            'total_flush_latency_ms': 0.0,
+        }
+
+    def start(self):
+        """Start the background flusher thread"""
+        if self._thread is not None:
+            return
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name='batch-writer', daemon=True)
+        self._thread.start()
+        logger.info(f"Batch writer started (size={self.max_batch_size}, age={self.max_batch_age}s)")
+
+    def stop(self, timeout=30):
+        """Stop the flusher thread and write everything still buffered"""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        # Le thread a déjà vidé le buffer, sauf s'il n'a jamais démarré
+        self.flush()
+        logger.info(f"Batch writer stopped: {self.get_stats()}")
+
+    def add(self, data, token=None):
+        """Queue one reading (dict of document fields) for the next bulk insert"""
+        with self._cond:
+            first = not self._buffer
+            if first:
+                self._oldest = time.monotonic()
+            self._buffer.append((data, token))
+            # Réveille le flusher pour armer le délai ou vider un lot plein
+            if first or len(self._buffer) >= self.max_batch_size:
+                self._cond.notify()
+
+    def pending(self):
+        """Number of readings waiting to be written"""
+        with self._cond:
+            return len(self._buffer)
+
+    def flush(self):
+        """Write the current buffer with one bulk insert, returns the batch size"""
+        with self._flush_lock:
+            with self._cond:
+                batch = self._buffer
+                self._buffer = []
+                self._oldest = None
+            for i in range(0, len(batch), self.max_batch_size):
+                self._write(batch[i:i + self.max_batch_size])
+            return len(batch)
+
+    def get_stats(self):
+        """Snapshot of flush latency and batch size counters"""
+        with self._cond:
+            stats = dict(self._stats)
+            stats['pending'] = len(self._buffer)
+        flushes = stats['flushes'] + stats['failed_flushes']
+        stats['avg_flush_latency_ms'] = round(stats['total_flush_latency_ms'] / flushes, 3) if flushes else 0.0
+        stats['avg_batch_size'] = round(stats['documents_written'] / stats['flushes'], 1) if stats['flushes'] else 0.0
+        return stats
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._stopping and not self._should_flush():
+                    self._cond.wait(self._time_to_deadline())
+                stopping = self._stopping
+            self.flush()
+            if stopping:
+                return
+
+    def _should_flush(self):
+        if not self._buffer:
+            return False
+        if len(self._buffer) >= self.max_batch_size:
+            return True
+        return time.monotonic() - self._oldest >= self.max_batch_age
+
+    def _time_to_deadline(self):
+        if not self._buffer:
+            return None
+        return max(0.0, self.max_batch_age - (time.monotonic() - self._oldest))
+
+    def _write(self, batch):
+        started = time.perf_counter()
+        try:
+            documents = []
+            for data, _ in batch:
+                document = self.document_cls(**data)
+                document.validate()
+                documents.append(document.to_mongo())
+            collection = self.document_cls._get_collection()
+            if self.merge:
+                merge_rollups(collection, [data for data, _ in batch])
+            else:
+                insert_readings(collection, documents)
+            ok = True
+        except Exception as e:
+            logger.error(f"[ERROR] Bulk insert of {len(batch)} readings failed: {e}")
+            ok = False
+        latency_ms = (time.perf_counter() - started) * 1000
+
+        with self._cond:
+            stats = self._stats
+            stats['last_batch_size'] = len(batch)
+            stats['max_batch_size_seen'] = max(stats['max_batch_size_seen'], len(batch))
+            stats['last_flush_latency_ms'] = round(latency_ms, 3)
+            stats['max_flush_latency_ms'] = round(max(stats['max_flush_latency_ms'], latency_ms), 3)
+            stats['total_flush_latency_ms'] += latency_ms
+            if ok:
+                stats['flushes'] += 1
+                stats['documents_written'] += len(batch)
+            else:
+                stats['failed_flushes'] += 1
+                stats['documents_failed'] += len(batch)
+
+        if ok:
+            logger.info(f"[SAVE] Bulk inserted {len(batch)} readings in {latency_ms:.1f} ms")
+            if self.on_written is not None:
+                self.on_written([token for _, token in batch])
+            if self.on_documents is not None:
+                self.on_documents([data for data, _ in batch])
+        elif self.on_failed is not None:
+            self.on_failed([token for _, token in batch])
@@ -0,0 +1,23 @@
+def topic_device_id(topic, patterns):
+    """Return the topic level matched by the first '+' of a subscription pattern
+
+    ``esp32/+/humidity_soil`` applied to ``esp32/field-3/humidity_soil`` gives
+    ``field-3``. Returns None when no pattern has a single-level wildcard
+    matching the topic.
+    """
+    levels = topic.split('/')
+    for pattern in patterns:
+        pattern_levels = pattern.split('/')
+        if len(pattern_levels) != len(levels) or '+' not in pattern_levels:
+            continue
+        if all(p == '+' or p == t for p, t in zip(pattern_levels, levels)):
+            return levels[pattern_levels.index('+')]
+    return None
+
+
+def resolve_device_id(topic, patterns, data=None, default='default'):
+    """Device id from the payload ``device_id`` field, else from the topic, else ``default``"""
+    if isinstance(data, dict) and data.get('device_id'):
+        return str(data['device_id'])
+    return topic_device_id(topic, patterns) or default
+
@@ -0,0 +1,118 @@
+"""
+Runs several MQTTHandler processes behind one MQTT v5 shared subscription
+
+Every process subscribes to ``$share/<group>/<topic>`` so the broker spreads
+the messages between them. Each process keeps its own spool directory and
+overflow file, and writes partial hourly buckets that are merged per device
+and hour in MongoDB, so the aggregated documents are the same as with a
+single consumer.
+
+Run from the django_app directory:
+    python -m mqtt_handler.launcher --processes 4 --group ingest
+"""
+
+import os
+import sys
+import time
+import signal
+import socket
+import logging
+import argparse
+import threading
+import multiprocessing
+
+logger = logging.getLogger('mqtt_handler')
+
+
+def _raise_interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+
+def configure_consumer(index, group):
+    """Point this process's settings at its own client id, spool and spill file"""
+    from django.conf import settings
+    settings.MQTT_SETTINGS['SHARED_GROUP'] = group
+    settings.MQTT_SETTINGS['CLIENT_ID'] = f"{socket.gethostname()}-{group}-{index}"
+    ingestion = settings.INGESTION_SETTINGS
+    ingestion['SPOOL_DIR'] = os.path.join(ingestion['SPOOL_DIR'], f'consumer-{index}')
+    root, ext = os.path.splitext(ingestion['SPILL_PATH'])
+    ingestion['SPILL_PATH'] = f"{root}-{index}{ext}"
+
+
+def run_consumer(index, group, progress=None):
+    """Process entry point: one MQTTHandler on the shared subscription"""
+    configure_consumer(index, group)
+    from mqtt_handler.mqtt_client import MQTTHandler
+
+    signal.signal(signal.SIGTERM, _raise_interrupt)
+    handler = MQTTHandler()
+    if progress is not None:
+        # Nombre de messages traités, lu par le bench (scripts/bench_shared_consumers.py)
+        def report():
+            while True:
+                progress.value = handler.workers.get_stats()['processed']
+                time.sleep(0.2)
+        threading.Thread(target=report, name='progress', daemon=True).start()
+    try:
+        handler.start()
+    except KeyboardInterrupt:
+        # Ctrl+C atteint aussi les enfants, puis le parent envoie SIGTERM : ne pas interrompre le flush
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        logger.info(f"[STOP] Stopping consumer {index}...")
+        handler.stop()
+
+
+def start_consumers(processes, group, progress=None):
+    """Spawn ``processes`` consumers; ``progress`` is an optional list of shared counters"""
+    context = multiprocessing.get_context('spawn')
+    consumers = []
+    for index in range(processes):
+        counter = progress[index] if progress is not None else None
+        process = context.Process(target=run_consumer, args=(index, group, counter),
+                                  name=f'mqtt-consumer-{index}')
+        process.start()
+        consumers.append(process)
+    logger.info(f"[OK] {processes} consumers started on shared group '{group}'")
+    return consumers
+
+
+def stop_consumers(consumers, timeout=60):
+    """SIGTERM every consumer and wait for them to flush and exit"""
+    for process in consumers:
+        if process.is_alive():
+            process.terminate()
+    for process in consumers:
+        process.join(timeout)
+        if process.is_alive():
+            logger.error(f"[ERROR] {process.name} did not stop in {timeout}s, killing it")
+            process.kill()
+
+
+def main():
+    from django.conf import settings
+    parser = argparse.ArgumentParser(description='Consommateurs MQTT multi-processus (abonnement partagé)')
+    parser.add_argument('--processes', type=int, default=os.cpu_count() or 2, help='Nombre de processus')
+    parser.add_argument('--group', default=settings.MQTT_SETTINGS['SHARED_GROUP'] or 'esp32-ingest',
+                        help="Groupe d'abonnement partagé")
+    args = parser.parse_args()
+
+    consumers = start_consumers(args.processes, args.group)
+    signal.signal(signal.SIGTERM, _raise_interrupt)
+    try:
+        while all(process.is_alive() for process in consumers):
+            time.sleep(1)
+        logger.error("[ERROR] A consumer exited, stopping the others")
+        return_code = 1
+    except KeyboardInterrupt:
+        return_code = 0
+    stop_consumers(consumers)
+    return return_code
+
+
+if __name__ == '__main__':
+    import django
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'esp32_iot.settings')
+    django.setup()
+    sys.exit(main())
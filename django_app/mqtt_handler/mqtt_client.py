@@ -1,10 +1,9 @@
 import os
 import sys
-import json
 import time
 import logging
+from collections import Counter
 import requests
-from datetime import datetime, timedelta
 import paho.mqtt.client as mqtt
 
 # Setup Django environment
@@ -15,51 +14,145 @@ import django
 django.setup()
 
 from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
 from sensor_data.models import SensorData
+from sensor_data.rollups import refresh_rollups
+from sensor_data.events import publish_readings
+from sensor_data.hot_tier import hot_tier
+from sensor_data.api_cache import bump_generation
+from mqtt_handler.batch_writer import BatchWriter
+from mqtt_handler.weather_cache import WeatherCache, CircuitBreaker
+from mqtt_handler.worker_pool import IngestQueue, WorkerPool
+from mqtt_handler.devices import resolve_device_id
+from mqtt_handler.aggregator import HourlyAggregator, WeatherBacklog, rollup_document
+from mqtt_handler.payload import decode_payload
+from mqtt_handler.spool import SpoolReplayer, spool_from_settings
 
 logger = logging.getLogger('mqtt_handler')
 
 class WeatherAPIClient:
-    """Client for fetching weather data from OpenWeatherMap API"""
+    """Client for fetching weather data from OpenWeatherMap API
+
+    Observations are served from a WeatherCache kept warm by a background
+    refresher, so callers never wait on the HTTP request.
+    """
     def __init__(self):
-        self.api_key = settings.OPENWEATHER_SETTINGS['API_KEY']
-        self.city = settings.OPENWEATHER_SETTINGS['CITY']
-        self.base_url = settings.OPENWEATHER_SETTINGS['BASE_URL']
+        weather_settings = settings.OPENWEATHER_SETTINGS
+        self.api_key = weather_settings['API_KEY']
+        self.city = weather_settings['CITY']
+        self.base_url = weather_settings['BASE_URL']
+        self.timeout = weather_settings['TIMEOUT']
+
+        self.cache = WeatherCache(
+            self.fetch_weather,
+            ttl=weather_settings['CACHE_TTL'],
+            refresh_interval=weather_settings['REFRESH_INTERVAL'],
+            breaker=CircuitBreaker(
+                failure_threshold=weather_settings['BREAKER_FAILURES'],
+                reset_timeout=weather_settings['BREAKER_RESET_TIMEOUT'],
+            ),
+        )
+        self.cache.register(self.city)
+
+    def fetch_weather(self, city):
+        """Blocking call to the OpenWeather API, raises on failure"""
+        url = f"{self.base_url}/weather"
+        params = {'q': city, 'appid': self.api_key, 'units': 'metric'}
+        response = requests.get(url, params=params, timeout=self.timeout)
+        response.raise_for_status()
+
+        data = response.json()
+        return {
+            'temperature': data['main']['temp'],
+            'humidity_air': data['main']['humidity'],
+            'rain_forecast': data.get('rain', {}).get('1h', 0.0)
+        }
 
     def get_current_weather(self):
-        try:
-            url = f"{self.base_url}/weather"
-            params = {'q': self.city, 'appid': self.api_key, 'units': 'metric'}
-            response = requests.get(url, params=params, timeout=10)
-            response.raise_for_status()
-
-            data = response.json()
-            weather_data = {
-                'temperature': data['main']['temp'],
-                'humidity_air': data['main']['humidity'],
-                'rain_forecast': data.get('rain', {}).get('1h', 0.0)
-            }
-            logger.info(f"Weather data fetched: {weather_data}")
-            return weather_data
-        except Exception as e:
-            logger.error(f"Weather API error: {e}")
-            return None
+        """Latest cached observation (with a 'stale' flag), None until the first fetch succeeds"""
+        return self.cache.get(self.city)
+
+    def start(self):
+        self.cache.start()
+
+    def stop(self):
+        self.cache.stop()
+
+
+def create_client(client_id='', protocol=mqtt.MQTTv311):
+    """paho client with the 1.x callback signatures, on paho-mqtt 1.x and 2.x"""
+    if hasattr(mqtt, 'CallbackAPIVersion'):
+        return mqtt.Client(mqtt.CallbackAPIVersion.VERSION1, client_id=client_id, protocol=protocol)
+    return mqtt.Client(client_id=client_id, protocol=protocol)
 
 
 class MQTTHandler:
-    """MQTT client handler for ESP32 sensor data with hourly saves"""
+    """MQTT client handler for ESP32 sensor data with hourly saves
+
+    When ``MQTT_SETTINGS['SHARED_GROUP']`` is set, the handler subscribes with
+    MQTT v5 shared subscriptions so that several processes split the traffic;
+    each process then only builds partial hourly buckets, which are merged
+    into one document per device and hour (see mqtt_handler.writes).
+    """
     
     def __init__(self):
-        self.client = mqtt.Client()
+        self.shared_group = settings.MQTT_SETTINGS['SHARED_GROUP']
+        if self.shared_group and settings.SENSOR_STORAGE['BACKEND'] == 'timeseries':
+            # La fusion des agrégats partiels repose sur des upserts, non supportés en time-series
+            raise ImproperlyConfigured("MQTT shared subscriptions require the 'standard' SENSOR_STORAGE backend")
+        self.client = create_client(
+            settings.MQTT_SETTINGS['CLIENT_ID'],
+            protocol=mqtt.MQTTv5 if self.shared_group else mqtt.MQTTv311,
+        )
         self.weather_client = WeatherAPIClient()
         self.broker_host = settings.MQTT_SETTINGS['BROKER_HOST']
         self.broker_port = settings.MQTT_SETTINGS['BROKER_PORT']
         self.username = settings.MQTT_SETTINGS['USERNAME']
         self.password = settings.MQTT_SETTINGS['PASSWORD']
         self.topic = settings.MQTT_SETTINGS['TOPIC']
+        self.topics = settings.MQTT_SETTINGS['TOPICS']
+        self.default_device_id = settings.MQTT_SETTINGS['DEFAULT_DEVICE_ID']
+        if self.shared_group:
+            self.subscriptions = [f"$share/{self.shared_group}/{topic}" for topic in self.topics]
+        else:
+            self.subscriptions = list(self.topics)
 
-        # Mémo de la dernière sauvegarde
-        self.last_saved_time = None
+        # Journal local (write-ahead) : chaque lecture acceptée y est écrite avant MongoDB
+        self.spool = spool_from_settings()
+        self.replayer = SpoolReplayer(
+            self.spool,
+            SensorData._get_collection(),
+            grace=settings.INGESTION_SETTINGS['SPOOL_REPLAY_INTERVAL'],
+            interval=settings.INGESTION_SETTINGS['SPOOL_REPLAY_INTERVAL'],
+            merge=bool(self.shared_group),
+            on_documents=self.documents_replayed,
+        )
+
+        # Écriture groupée vers MongoDB
+        self.writer = BatchWriter(
+            SensorData,
+            max_batch_size=settings.INGESTION_SETTINGS['BATCH_SIZE'],
+            max_batch_age=settings.INGESTION_SETTINGS['BATCH_MAX_AGE'],
+            on_written=self.ack_spool,
+            merge=bool(self.shared_group),
+            on_documents=self.documents_written,
+            on_failed=self.seal_spool,
+        )
+
+        # File bornée + pool de workers : on_message ne fait qu'empiler
+        ingestion = settings.INGESTION_SETTINGS
+        self.queue = IngestQueue(
+            maxsize=ingestion['QUEUE_SIZE'],
+            policy=ingestion['BACKPRESSURE'],
+            spill_path=ingestion['SPILL_PATH'],
+        )
+        self.workers = WorkerPool(self.process_message, self.queue, workers=ingestion['WORKERS'])
+
+        # Agrégation par appareil et par heure : un document par fenêtre fermée
+        self.aggregator = HourlyAggregator(self.emit_rollup, window=ingestion['AGGREGATION_WINDOW'])
+        # Seaux fermés sans météo en cache : émis au prochain rafraîchissement réussi
+        self.weather_backlog = WeatherBacklog(ingestion['WEATHER_BACKLOG'])
+        self.weather_client.cache.on_refresh = self.weather_refreshed
 
         if self.username and self.password:
             self.client.username_pw_set(self.username, self.password)
@@ -70,60 +163,120 @@ class MQTTHandler:
 
         logger.info(f"MQTT Handler initialized - Broker: {self.broker_host}:{self.broker_port}")
 
-    def on_connect(self, client, userdata, flags, rc):
+    def on_connect(self, client, userdata, flags, rc, properties=None):
         if rc == 0:
             logger.info("[OK] Connected to MQTT broker")
-            client.subscribe(self.topic)
-            logger.info(f"Subscribed to topic: {self.topic}")
+            client.subscribe([(topic, 0) for topic in self.subscriptions])
+            logger.info(f"Subscribed to topics: {', '.join(self.subscriptions)}")
         else:
             logger.error(f"[FAIL] Failed to connect, rc={rc}")
 
-    def on_disconnect(self, client, userdata, rc):
+    def on_disconnect(self, client, userdata, rc, properties=None):
         logger.warning(f"[WARN] Disconnected from MQTT broker (rc={rc})")
 
     def on_message(self, client, userdata, msg):
+        # Appelé depuis la boucle réseau paho : uniquement mettre en file
+        self.queue.put((msg.topic, msg.payload, time.time()))
+
+    def process_message(self, topic, payload, received_at):
+        """Decode one raw message and fold it into its device's hourly bucket (runs on a worker thread)"""
         try:
-            payload = msg.payload.decode()
-            logger.info(f"📩 Received message: {payload}")
+            logger.debug(f"📩 Received message on {topic}: {payload!r}")
 
-            # Lecture JSON ou valeur brute
-            try:
-                data = json.loads(payload)
-                humidity_soil = float(data.get('humidity_soil', data.get('humidity', 0)))
-            except json.JSONDecodeError:
-                humidity_soil = float(payload)
-
-            # Vérifie si 1 heure s'est écoulée depuis la dernière sauvegarde
-            now = datetime.utcnow()
-            if self.last_saved_time and now - self.last_saved_time < timedelta(hours=1):
-                logger.info("[SKIP] Ignoring message (less than 1 hour since last save)")
-                return
-
-            # Récupère les données météo
-            weather = self.weather_client.get_current_weather()
-            if not weather:
-                logger.warning("[WARN] No weather data fetched, skipping save")
-                return
-
-            combined_data = {
-                'timestamp': now,
-                'temperature': weather['temperature'],
-                'humidity_air': weather['humidity_air'],
-                'rain_forecast': weather['rain_forecast'],
-                'humidity_soil': humidity_soil
-            }
-
-            # Sauvegarde MongoDB
-            sensor = SensorData(**combined_data)
-            sensor.save()
-            self.last_saved_time = now  # update
-            logger.info(f"[SAVE] Data saved to MongoDB (hourly): {combined_data}")
-            print(f"[SAVE] Data saved (hourly): {combined_data}")
+            # JSON, valeur brute ou format binaire compact
+            data = decode_payload(payload)
+            device_id = resolve_device_id(topic, self.topics, data, self.default_device_id)
+            self.aggregator.add(device_id, data['humidity_soil'], received_at, data)
 
         except Exception as e:
             logger.error(f"[ERROR] Error processing message: {e}")
 
+    def emit_rollup(self, bucket):
+        """Queue one SensorData document summarising a closed aggregation bucket"""
+        # Récupère les données météo (cache, sans appel HTTP)
+        weather = self.weather_client.get_current_weather()
+        if not weather:
+            self.weather_backlog.park(bucket)
+            return
+        if weather['stale']:
+            logger.warning(f"[WARN] Using stale weather data ({weather['age_seconds']}s old)")
+
+        combined_data = rollup_document(bucket, weather, self.weather_client.city)
+
+        # Spool local d'abord, puis sauvegarde MongoDB (écriture groupée en arrière-plan)
+        segment = self.spool.append(combined_data)
+        self.writer.add(combined_data, token=segment)
+        logger.info(f"[SAVE] Rollup queued for MongoDB (hourly): {combined_data}")
+        print(f"[SAVE] Rollup queued (hourly): {combined_data}")
+
+    def weather_refreshed(self, location):
+        """Weather cache callback: emit the rollups closed while no weather was cached"""
+        for bucket in self.weather_backlog.drain():
+            self.emit_rollup(bucket)
+
+    def ack_spool(self, segments):
+        """Batch writer callback: readings of these spool segments are in MongoDB"""
+        for segment, count in Counter(segments).items():
+            self.spool.ack(segment, count)
+
+    def seal_spool(self, segments):
+        """Batch writer callback: the insert failed, let the replayer pick these readings up"""
+        self.spool.rotate()
+
+    def documents_written(self, records):
+        """Writer callback: refresh the rollups, then push the new readings to the hot tier and dashboards"""
+        self.refresh_rollups(records)
+        # En abonnement partagé, chaque processus n'écrit que des agrégats partiels
+        if not self.shared_group:
+            hot_tier.add(records)
+        # Après le niveau chaud : une réponse recalculée sous la nouvelle génération voit ces lectures
+        bump_generation()
+        if not self.shared_group:
+            publish_readings(records)
+
+    def documents_replayed(self, records):
+        """Replay callback: readings recovered from the spool, usually older than the newest ones"""
+        self.refresh_rollups(records)
+        if not self.shared_group:
+            hot_tier.add(records)
+        bump_generation()
+
+    def refresh_rollups(self, records):
+        """Writer/replay callback: recompute the minute/hour/day rollups touched by these readings"""
+        if not settings.ROLLUP_SETTINGS['ENABLED']:
+            return
+        try:
+            refresh_rollups((record.get('device_id'), record['timestamp']) for record in records)
+        except Exception as e:
+            # Les lectures brutes sont écrites : les rollups se reconstruisent avec rebuild_rollups
+            logger.error(f"[ERROR] Rollup refresh of {len(records)} readings failed: {e}")
+
+    def get_stats(self):
+        """Queue depth/drop, worker, writer and weather cache counters"""
+        return {
+            'workers': self.workers.get_stats(),
+            'aggregator': self.aggregator.get_stats(),
+            'weather_backlog': self.weather_backlog.get_stats(),
+            'writer': self.writer.get_stats(),
+            'spool': self.spool.get_stats(),
+            'replayer': self.replayer.get_stats(),
+            'weather': self.weather_client.cache.get_stats(),
+            'hot_tier': hot_tier.get_stats(),
+        }
+
     def start(self):
+        # Avant l'écriture des premières lectures : le niveau chaud les reçoit ensuite dans l'ordre
+        if settings.HOT_TIER['ENABLED'] and not self.shared_group:
+            try:
+                hot_tier.warm()
+            except Exception as e:
+                logger.error(f"[ERROR] Hot tier warm-up failed, reads stay on MongoDB: {e}")
+        self.spool.start()
+        self.replayer.start()
+        self.writer.start()
+        self.weather_client.start()
+        self.workers.start()
+        self.aggregator.start()
         while True:
             try:
                 logger.info(f"Connecting to MQTT broker: {self.broker_host}:{self.broker_port}")
@@ -133,6 +286,18 @@ class MQTTHandler:
                 logger.error(f"MQTT connection error: {e}")
                 time.sleep(10)
 
+    def stop(self):
+        """Disconnect from the broker and flush buffered readings"""
+        self.client.disconnect()
+        self.workers.stop()
+        self.aggregator.stop()
+        self.weather_client.stop()
+        self.weather_backlog.discard()
+        self.writer.stop()
+        self.replayer.stop()
+        self.spool.close()
+        logger.info(f"Ingestion stats: {self.get_stats()}")
+
 
 if __name__ == "__main__":
     handler = MQTTHandler()
@@ -140,4 +305,4 @@ if __name__ == "__main__":
         handler.start()
     except KeyboardInterrupt:
         logger.info("[STOP] Stopping MQTT client...")
-        handler.client.disconnect()
+        handler.stop()
@@ -0,0 +1,71 @@
+"""
+Decoding of ESP32 MQTT payloads
+
+Three encodings are accepted:
+
+* JSON object: ``{"humidity_soil": 42.5, "wifi_rssi": -61, "uptime_ms": 120000}``
+  (``humidity`` is accepted for ``humidity_soil``), parsed straight from bytes
+  with orjson when it is installed;
+* bare number: ``42.5``;
+* compact binary, opted into by the device. Every binary payload starts with
+  the magic byte 0xA5 followed by a format version; version 1 is 10 bytes,
+  little-endian::
+
+      offset  type     field
+      0       uint8    magic (0xA5)
+      1       uint8    version (1)
+      2       int16    wifi_rssi (dBm)
+      4       uint16   humidity_soil (hundredths of %)
+      6       uint32   uptime_ms
+"""
+
+import json
+import struct
+
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+
+BINARY_MAGIC = 0xA5
+BINARY_V1 = struct.Struct('<BBhHI')
+_unpack_v1 = BINARY_V1.unpack_from
+
+
+def encode_binary_v1(humidity_soil, wifi_rssi=0, uptime_ms=0):
+    """Build a version 1 binary payload (used by simulators and benchmarks)"""
+    return BINARY_V1.pack(BINARY_MAGIC, 1, wifi_rssi, int(round(humidity_soil * 100)), uptime_ms & 0xFFFFFFFF)
+
+
+def _decode_binary_v1(payload):
+    if len(payload) != BINARY_V1.size:
+        raise ValueError(f"Binary v1 payload must be {BINARY_V1.size} bytes, got {len(payload)}")
+    _, _, wifi_rssi, humidity_centi, uptime_ms = _unpack_v1(payload)
+    return {'humidity_soil': humidity_centi / 100, 'wifi_rssi': wifi_rssi, 'uptime_ms': uptime_ms}
+
+
+# Versions futures : ajouter ici leur décodeur
+_BINARY_DECODERS = {1: _decode_binary_v1}
+
+
+def decode_payload(payload):
+    """Parse a raw MQTT payload (bytes) into a dict holding at least ``humidity_soil``"""
+    if not payload:
+        raise ValueError("Empty payload")
+    first = payload[0]
+    if first == BINARY_MAGIC:
+        if len(payload) < 2 or payload[1] not in _BINARY_DECODERS:
+            raise ValueError(f"Unsupported binary payload version: {payload[1:2]!r}")
+        return _BINARY_DECODERS[payload[1]](payload)
+    if first != 0x7B:  # '{'
+        # Valeur brute : float() accepte directement les bytes
+        try:
+            return {'humidity_soil': float(payload)}
+        except ValueError:
+            pass
+    data = _json_loads(payload)
+    if isinstance(data, dict):
+        data['humidity_soil'] = float(data.get('humidity_soil', data.get('humidity', 0)))
+        return data
+    return {'humidity_soil': float(data)}
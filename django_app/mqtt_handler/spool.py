@@ -0,0 +1,386 @@
+"""
+Durable local write-ahead spool for accepted readings
+
+Every reading is appended to the current segment file before it is handed to
+the batch writer. Segments are append-only JSON lines (bson extended JSON so
+``_id`` and datetimes round-trip), fsynced in batches, and retired once every
+record they hold has been acknowledged by a successful bulk insert. Segments
+that still hold unacknowledged records are replayed to MongoDB by
+SpoolReplayer, idempotently (documents keep the ``_id`` assigned at append
+time) and in timestamp order. A failed bulk insert seals the current segment
+(``rotate()``), so that its records are replayed once MongoDB is back.
+
+Run from the django_app directory:
+    python -m mqtt_handler.spool status
+    python -m mqtt_handler.spool replay
+    python -m mqtt_handler.spool backfill   # archive + pending, e.g. into a fresh database
+"""
+
+import os
+import sys
+import time
+import heapq
+import shutil
+import logging
+import argparse
+import threading
+
+from bson import ObjectId, json_util
+
+from mqtt_handler.writes import insert_readings, merge_rollups
+
+logger = logging.getLogger('mqtt_handler')
+
+SEGMENT_PREFIX = 'segment-'
+SEGMENT_SUFFIX = '.log'
+
+
+class Spool:
+    """Segmented append-only log with fsync batching and per-segment acknowledgements"""
+
+    def __init__(self, directory, segment_max_bytes=16 * 1024 * 1024, fsync_interval=1.0,
+                 fsync_batch=100, retain=False):
+        self.directory = directory
+        self.archive_directory = os.path.join(directory, 'archive')
+        self.segment_max_bytes = segment_max_bytes
+        self.fsync_interval = fsync_interval
+        self.fsync_batch = fsync_batch
+        self.retain = retain
+        os.makedirs(self.directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        # seq -> [records appended, records acknowledged, sealed_at]
+        self._segments = {}
+        existing = self.segment_numbers()
+        self._seq = existing[-1] if existing else 0
+        # Segments d'une exécution précédente : rien n'est en vol, tout est à rejouer
+        self.recovered = set(existing)
+
+        self._file = None
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+        self._stop = threading.Event()
+        self._thread = None
+        self._stats = {'appended': 0, 'acked': 0, 'fsyncs': 0, 'segments_retired': 0}
+        self._open_next_segment()
+
+    # ------------------------------------------------------------------
+    # Écriture
+    # ------------------------------------------------------------------
+    def append(self, record):
+        """Persist one reading, assigning ``id`` if missing; returns its segment number"""
+        if record.get('id') is None:
+            record['id'] = ObjectId()
+        line = json_util.dumps(record).encode('utf-8') + b'\n'
+        with self._lock:
+            if self._file.tell() + len(line) > self.segment_max_bytes and self._segments[self._seq][0]:
+                self._seal_current()
+                self._open_next_segment()
+            self._file.write(line)
+            self._segments[self._seq][0] += 1
+            self._stats['appended'] += 1
+            self._unsynced += 1
+            if self._unsynced >= self.fsync_batch:
+                self._sync()
+            return self._seq
+
+    def ack(self, seq, count=1):
+        """Mark ``count`` records of segment ``seq`` as durably stored in MongoDB"""
+        with self._lock:
+            state = self._segments.get(seq)
+            if state is None:
+                return
+            state[1] += count
+            self._stats['acked'] += count
+            if state[2] is not None and state[1] >= state[0]:
+                self._retire(seq)
+
+    def rotate(self):
+        """Seal the current segment, so that its unacknowledged records can be replayed
+
+        Called when a bulk insert fails: a segment is otherwise only sealed once full,
+        and the failed records would wait in it for a restart.
+        """
+        with self._lock:
+            if self._segments[self._seq][0]:
+                self._seal_current()
+                self._open_next_segment()
+
+    def sync_if_due(self):
+        with self._lock:
+            if self._unsynced and time.monotonic() - self._last_sync >= self.fsync_interval:
+                self._sync()
+
+    def start(self):
+        """Start the periodic fsync thread"""
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='spool-fsync', daemon=True)
+        self._thread.start()
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(5)
+            self._thread = None
+        with self._lock:
+            self._sync()
+            self._seal_current()
+            self._file.close()
+            self._retire_acknowledged()
+
+    # ------------------------------------------------------------------
+    # Lecture
+    # ------------------------------------------------------------------
+    def segment_numbers(self, directory=None):
+        directory = directory or self.directory
+        numbers = []
+        for name in os.listdir(directory):
+            if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX):
+                numbers.append(int(name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)]))
+        return sorted(numbers)
+
+    def segment_path(self, seq, directory=None):
+        return os.path.join(directory or self.directory, f"{SEGMENT_PREFIX}{seq:08d}{SEGMENT_SUFFIX}")
+
+    def replayable_segments(self, grace=60.0):
+        """Sealed segments with unacknowledged records, idle for at least ``grace`` seconds
+
+        Segments recovered from a previous run are always replayable.
+        """
+        now = time.monotonic()
+        with self._lock:
+            pending = [seq for seq, (appended, acked, sealed_at) in self._segments.items()
+                       if sealed_at is not None and acked < appended and now - sealed_at >= grace]
+            return sorted(set(pending) | self.recovered)
+
+    @staticmethod
+    def read_segment(path):
+        """Records of one segment file sorted by timestamp (a torn last line is skipped)"""
+        records = []
+        with open(path, 'rb', buffering=1024 * 1024) as f:
+            for line in f:
+                try:
+                    records.append(json_util.loads(line))
+                except ValueError:
+                    logger.warning(f"[WARN] Skipping truncated spool record in {path}")
+        records.sort(key=lambda record: record['timestamp'])
+        return records
+
+    def mark_replayed(self, seqs):
+        """Retire segments whose records have all been written by a replay"""
+        with self._lock:
+            for seq in seqs:
+                self.recovered.discard(seq)
+                if seq in self._segments:
+                    state = self._segments[seq]
+                    state[1] = state[0]
+                self._retire(seq)
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['open_segments'] = len(self._segments) + len(self.recovered)
+            stats['current_segment'] = self._seq
+            stats['unsynced'] = self._unsynced
+        return stats
+
+    # ------------------------------------------------------------------
+    # Interne (appelé avec self._lock)
+    # ------------------------------------------------------------------
+    def _open_next_segment(self):
+        self._seq += 1
+        self._file = open(self.segment_path(self._seq), 'ab')
+        self._segments[self._seq] = [0, 0, None]
+
+    def _seal_current(self):
+        self._sync()
+        state = self._segments.get(self._seq)
+        if state is not None and state[2] is None:
+            state[2] = time.monotonic()
+            if state[1] >= state[0]:
+                self._file.close()
+                self._retire(self._seq)
+                return
+        self._file.close()
+
+    def _sync(self):
+        if self._file.closed:
+            return
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+        self._stats['fsyncs'] += 1
+
+    def _retire(self, seq):
+        path = self.segment_path(seq)
+        self._segments.pop(seq, None)
+        if not os.path.exists(path):
+            return
+        if self.retain:
+            os.makedirs(self.archive_directory, exist_ok=True)
+            shutil.move(path, self.segment_path(seq, self.archive_directory))
+        else:
+            os.remove(path)
+        self._stats['segments_retired'] += 1
+
+    def _retire_acknowledged(self):
+        for seq, (appended, acked, sealed_at) in list(self._segments.items()):
+            if sealed_at is not None and acked >= appended:
+                self._retire(seq)
+
+    def _run(self):
+        while not self._stop.wait(min(self.fsync_interval, 1.0)):
+            self.sync_if_due()
+
+
+class SpoolReplayer:
+    """Drains unacknowledged spool segments into a pymongo collection
+
+    With ``merge=True`` records are partial rollups from one of several
+    consumer processes and are merged with ``merge_rollups`` instead of inserted.
+    ``on_documents(records)`` is called after each written batch.
+    """
+
+    def __init__(self, spool, collection, batch_size=1000, grace=60.0, interval=60.0, merge=False,
+                 on_documents=None):
+        self.spool = spool
+        self.collection = collection
+        self.merge = merge
+        self.on_documents = on_documents
+        self.batch_size = batch_size
+        self.grace = grace
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+        self._stats = {'replays': 0, 'records_replayed': 0, 'records_inserted': 0, 'failures': 0}
+
+    def replay(self):
+        """Replay every eligible segment; returns the number of records sent"""
+        seqs = self.spool.replayable_segments(self.grace)
+        if not seqs:
+            return 0
+        paths = [self.spool.segment_path(seq) for seq in seqs]
+        try:
+            sent, inserted = self.write_sorted(paths)
+        except Exception as e:
+            self._stats['failures'] += 1
+            logger.error(f"[ERROR] Spool replay failed, will retry: {e}")
+            return 0
+        self.spool.mark_replayed(seqs)
+        self._stats['replays'] += 1
+        self._stats['records_replayed'] += sent
+        self._stats['records_inserted'] += inserted
+        logger.info(f"[REPLAY] {len(seqs)} spool segments replayed: {sent} records, {inserted} new")
+        return sent
+
+    def write_sorted(self, paths):
+        """Merge segments by timestamp and bulk write them, duplicates ignored"""
+        sent = inserted = 0
+        batch = []
+        merged = heapq.merge(*(Spool.read_segment(path) for path in paths if os.path.exists(path)),
+                             key=lambda record: record['timestamp'])
+        for record in merged:
+            batch.append(record)
+            if len(batch) >= self.batch_size:
+                inserted += self._write(batch)
+                sent += len(batch)
+                batch = []
+        if batch:
+            inserted += self._write(batch)
+            sent += len(batch)
+        return sent, inserted
+
+    def _write(self, batch):
+        if self.merge:
+            # L'id du record sert de clé de partiel : rejouer ne double rien
+            written = merge_rollups(self.collection, batch)
+        else:
+            for record in batch:
+                record['_id'] = record.pop('id')
+            written = insert_readings(self.collection, batch)
+        if self.on_documents is not None:
+            self.on_documents(batch)
+        return written
+
+    def backfill(self):
+        """Write archived and pending segments, e.g. to rebuild a fresh database"""
+        spool = self.spool
+        paths = []
+        if os.path.isdir(spool.archive_directory):
+            paths += [spool.segment_path(seq, spool.archive_directory)
+                      for seq in spool.segment_numbers(spool.archive_directory)]
+        paths += [spool.segment_path(seq) for seq in spool.segment_numbers()]
+        started = time.perf_counter()
+        sent, inserted = self.write_sorted(paths)
+        elapsed = time.perf_counter() - started
+        logger.info(f"[BACKFILL] {sent} records from {len(paths)} segments ({inserted} new) "
+                    f"in {elapsed:.1f}s ({sent / elapsed if elapsed else 0:,.0f} records/s)")
+        return sent, inserted
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='spool-replayer', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=30):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def get_stats(self):
+        return dict(self._stats)
+
+    def _run(self):
+        # Rejoue d'abord ce qu'une exécution précédente a laissé
+        self.replay()
+        while not self._stop.wait(self.interval):
+            self.replay()
+
+
+def spool_from_settings():
+    from django.conf import settings
+    ingestion = settings.INGESTION_SETTINGS
+    return Spool(
+        ingestion['SPOOL_DIR'],
+        segment_max_bytes=ingestion['SPOOL_SEGMENT_BYTES'],
+        fsync_interval=ingestion['SPOOL_FSYNC_INTERVAL'],
+        fsync_batch=ingestion['SPOOL_FSYNC_BATCH'],
+        retain=ingestion['SPOOL_RETAIN'],
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Spool local des lectures MQTT')
+    parser.add_argument('command', choices=['status', 'replay', 'backfill'])
+    parser.add_argument('--dir', help='Répertoire du spool (défaut : INGESTION_SETTINGS SPOOL_DIR)')
+    parser.add_argument('--batch-size', type=int, default=5000, help='Taille des insertions groupées')
+    args = parser.parse_args()
+
+    from sensor_data.models import SensorData
+    if args.dir:
+        from django.conf import settings
+        settings.INGESTION_SETTINGS['SPOOL_DIR'] = args.dir
+    spool = spool_from_settings()
+    replayer = SpoolReplayer(spool, SensorData._get_collection(), batch_size=args.batch_size, grace=0)
+
+    if args.command == 'status':
+        archived = spool.segment_numbers(spool.archive_directory) if os.path.isdir(spool.archive_directory) else []
+        print(f"Pending segments: {sorted(spool.recovered)}")
+        print(f"Archived segments: {len(archived)}")
+    elif args.command == 'replay':
+        print(f"Replayed {replayer.replay()} records")
+    else:
+        sent, inserted = replayer.backfill()
+        print(f"Backfilled {sent} records ({inserted} new)")
+    spool.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,655 @@
+"""
+Tests of the MQTT ingestion pipeline (aggregation, write-behind, spool, decoding)
+
+MongoDB is replaced by mongomock and no broker is contacted: run from the
+django_app directory with ``python manage.py test``.
+"""
+
+import io
+import os
+import sys
+import asyncio
+import time
+import shutil
+import logging
+import tempfile
+import threading
+from contextlib import redirect_stdout
+from datetime import datetime
+from unittest import mock
+
+import mongoengine
+import mongomock
+from bson import ObjectId
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.test import SimpleTestCase
+from pymongo.errors import AutoReconnect, BulkWriteError
+
+from sensor_data.models import SensorData
+from mqtt_handler.aggregator import Bucket, HourlyAggregator, WeatherBacklog, rollup_document
+from mqtt_handler.batch_writer import BatchWriter
+from mqtt_handler.devices import resolve_device_id, topic_device_id
+from mqtt_handler.launcher import configure_consumer
+from mqtt_handler.payload import BINARY_MAGIC, decode_payload, encode_binary_v1
+from mqtt_handler.weather_cache import CircuitBreaker, WeatherCache
+from mqtt_handler.worker_pool import BLOCK, DROP_OLDEST, SPILL, IngestQueue, WorkerPool
+from mqtt_handler.writes import DUPLICATE_KEY, insert_readings, merge_rollups, rollup_object_id
+
+sys.path.append(os.path.join(settings.BASE_DIR.parent, 'scripts'))
+
+WEATHER = {'temperature': 21.5, 'humidity_air': 64.0, 'rain_forecast': 0.0, 'stale': False, 'age_seconds': 0}
+
+
+def setUpModule():
+    mongoengine.disconnect()
+    mongoengine.connect('mqtt_handler_tests', host='mongodb://localhost', mongo_client_class=mongomock.MongoClient)
+    logging.disable(logging.CRITICAL)
+
+
+def tearDownModule():
+    logging.disable(logging.NOTSET)
+    mongoengine.disconnect()
+
+
+def closed_bucket(device_id='field-1', start=datetime(2024, 5, 1, 10).timestamp(), values=(41.0, 43.0)):
+    bucket = Bucket(device_id, start)
+    for offset, value in enumerate(values):
+        bucket.add(value, start + 60 * (offset + 1))
+    return bucket
+
+
+class MongoTestCase(SimpleTestCase):
+    """Empty readings collection and a private spool directory for each test"""
+
+    def setUp(self):
+        self.collection = SensorData._get_collection()
+        self.collection.delete_many({})
+        # mongomock n'a pas Collection.options() : backend standard
+        for patcher in (mock.patch('mqtt_handler.writes.is_timeseries', return_value=False),
+                        mock.patch('mqtt_handler.writes.ais_timeseries', return_value=False,
+                                   new_callable=mock.AsyncMock)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.spool_dir = tempfile.mkdtemp(prefix='spool_')
+        self.addCleanup(shutil.rmtree, self.spool_dir, ignore_errors=True)
+
+
+class SpoolRecoveryTests(MongoTestCase):
+    """A reading whose bulk insert failed is replayed once MongoDB is back"""
+
+    def handler(self):
+        from mqtt_handler.mqtt_client import MQTTHandler
+        ingestion = dict(settings.INGESTION_SETTINGS, SPOOL_DIR=self.spool_dir)
+        with mock.patch.dict(settings.INGESTION_SETTINGS, ingestion):
+            handler = MQTTHandler()
+        handler.weather_client.get_current_weather = lambda: WEATHER
+        self.addCleanup(handler.spool.close)
+        return handler
+
+    def emit(self, handler, bucket):
+        with redirect_stdout(io.StringIO()):
+            handler.emit_rollup(bucket)
+
+    def test_failed_flush_is_replayed_without_restart(self):
+        handler = self.handler()
+        self.emit(handler, closed_bucket())
+        with mock.patch('mqtt_handler.batch_writer.insert_readings', side_effect=AutoReconnect('down')):
+            handler.writer.flush()
+        self.assertEqual(handler.writer.get_stats()['failed_flushes'], 1)
+        self.assertEqual(self.collection.count_documents({}), 0)
+
+        # MongoDB revenu : le prochain passage du rejeu (délai de grâce écoulé) écrit la lecture
+        handler.replayer.grace = 0
+        self.assertEqual(handler.replayer.replay(), 1)
+        document = self.collection.find_one()
+        self.assertEqual(document['device_id'], 'field-1')
+        self.assertEqual(document['humidity_soil'], 42.0)
+        self.assertEqual(document['sample_count'], 2)
+        self.assertEqual(handler.spool.replayable_segments(0), [])
+
+    def test_replay_waits_for_the_grace_period(self):
+        handler = self.handler()
+        self.emit(handler, closed_bucket())
+        with mock.patch('mqtt_handler.batch_writer.insert_readings', side_effect=AutoReconnect('down')):
+            handler.writer.flush()
+        handler.replayer.grace = 3600
+        self.assertEqual(handler.replayer.replay(), 0)
+
+    def test_successful_flush_leaves_nothing_to_replay(self):
+        handler = self.handler()
+        self.emit(handler, closed_bucket())
+        handler.writer.flush()
+        self.assertEqual(self.collection.count_documents({}), 1)
+        handler.spool.rotate()
+        self.assertEqual(handler.spool.replayable_segments(0), [])
+
+
+class BatchWriterTests(MongoTestCase):
+    """Readings are bulk inserted by batch and the tokens acknowledged once written"""
+
+    def records(self, count):
+        start = datetime(2024, 5, 1).timestamp()
+        return [rollup_document(closed_bucket(start=start + 3600 * hour), WEATHER) for hour in range(count)]
+
+    def test_flush_writes_one_bulk_insert_per_full_batch(self):
+        written = []
+        writer = BatchWriter(SensorData, max_batch_size=3, max_batch_age=60, on_written=written.extend)
+        for token, record in enumerate(self.records(7)):
+            writer.add(record, token=token)
+        self.assertEqual(writer.pending(), 7)
+
+        with mock.patch('mqtt_handler.batch_writer.insert_readings', wraps=insert_readings) as insert:
+            self.assertEqual(writer.flush(), 7)
+        self.assertEqual([len(call.args[1]) for call in insert.call_args_list], [3, 3, 1])
+        self.assertEqual(self.collection.count_documents({}), 7)
+        self.assertEqual(sorted(written), list(range(7)))
+        stats = writer.get_stats()
+        self.assertEqual((stats['flushes'], stats['documents_written'], stats['pending']), (3, 7, 0))
+        self.assertEqual(stats['max_batch_size_seen'], 3)
+
+    def test_replayed_reading_is_not_inserted_twice(self):
+        writer = BatchWriter(SensorData, max_batch_size=10)
+        record = dict(self.records(1)[0], id=ObjectId())
+        writer.add(record)
+        writer.flush()
+        writer.add(record)
+        writer.add(dict(self.records(2)[1], id=ObjectId()))
+        writer.flush()
+        self.assertEqual(self.collection.count_documents({}), 2)
+        self.assertEqual(writer.get_stats()['failed_flushes'], 0)
+
+    def test_failed_insert_hands_the_tokens_back(self):
+        failed, written = [], []
+        writer = BatchWriter(SensorData, on_written=written.extend, on_failed=failed.extend)
+        writer.add(self.records(1)[0], token='segment-1')
+        with mock.patch('mqtt_handler.batch_writer.insert_readings', side_effect=AutoReconnect('down')):
+            writer.flush()
+        self.assertEqual((failed, written), (['segment-1'], []))
+        self.assertEqual(writer.get_stats()['documents_failed'], 1)
+
+    def test_flusher_thread_writes_aged_batch_and_drains_on_stop(self):
+        writer = BatchWriter(SensorData, max_batch_size=100, max_batch_age=0.05)
+        writer.start()
+        self.addCleanup(writer.stop)
+        records = self.records(2)
+        writer.add(records[0])
+        deadline = time.monotonic() + 5
+        while writer.pending() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(writer.pending(), 0)
+
+        # Lot partiel encore jeune : stop() l'écrit avant de rendre la main
+        writer.max_batch_age = 3600
+        writer.add(records[1])
+        writer.stop()
+        self.assertEqual(self.collection.count_documents({}), 2)
+
+
+class WeatherCacheTests(SimpleTestCase):
+    """Cached weather is served without HTTP, kept when a refresh fails, and the breaker sheds failing calls"""
+
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch('mqtt_handler.weather_cache.time')
+        patcher.start().monotonic = lambda: self.now
+        self.addCleanup(patcher.stop)
+
+    def test_failed_refresh_keeps_serving_the_last_value_as_stale(self):
+        fetcher = mock.Mock(return_value={'temperature': 20.0})
+        cache = WeatherCache(fetcher, ttl=900, breaker=CircuitBreaker(failure_threshold=5))
+        self.assertIsNone(cache.get('Paris'))
+        self.assertTrue(cache.refresh('Paris'))
+
+        fetcher.side_effect = OSError('timeout')
+        self.now += 1000
+        self.assertFalse(cache.refresh('Paris'))
+        weather = cache.get('Paris')
+        self.assertEqual(weather['temperature'], 20.0)
+        self.assertTrue(weather['stale'])
+        self.assertEqual(weather['age_seconds'], 1000.0)
+        stats = cache.get_stats()
+        self.assertEqual((stats['misses'], stats['stale_hits'], stats['refresh_failures']), (1, 1, 1))
+
+    def test_open_breaker_short_circuits_until_the_trial_call(self):
+        fetcher = mock.Mock(side_effect=OSError('down'))
+        cache = WeatherCache(fetcher, breaker=CircuitBreaker(failure_threshold=2, reset_timeout=60))
+        cache.refresh('Paris')
+        cache.refresh('Paris')
+        self.assertEqual(cache.breaker.state, CircuitBreaker.OPEN)
+        self.assertFalse(cache.refresh('Paris'))
+        self.assertEqual(fetcher.call_count, 2)
+        self.assertEqual(cache.get_stats()['short_circuited'], 1)
+
+        # Délai écoulé : un appel d'essai, qui referme le circuit s'il réussit
+        self.now += 60
+        self.assertEqual(cache.breaker.state, CircuitBreaker.HALF_OPEN)
+        fetcher.side_effect = None
+        fetcher.return_value = {'temperature': 18.0}
+        self.assertTrue(cache.refresh('Paris'))
+        self.assertEqual(cache.breaker.state, CircuitBreaker.CLOSED)
+
+    def test_failed_trial_call_reopens_the_breaker(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=60)
+        breaker.record_failure()
+        self.now += 60
+        self.assertTrue(breaker.allow_request())
+        self.assertFalse(breaker.allow_request())
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+
+    def test_only_due_locations_are_refreshed(self):
+        fetcher = mock.Mock(return_value={'temperature': 20.0})
+        cache = WeatherCache(fetcher, refresh_interval=300)
+        cache.register('Paris')
+        cache.register('Lyon')
+        self.assertTrue(cache.refresh_due())
+        self.now += 100
+        cache.put('Lyon', {'temperature': 22.0})
+        self.now += 200
+        self.assertEqual(cache.due_locations(), ['Paris'])
+
+
+class WeatherBacklogTests(MongoTestCase):
+    """Rollups closed before the first weather observation are written once it arrives"""
+
+    def handler(self):
+        from mqtt_handler.mqtt_client import MQTTHandler
+        ingestion = dict(settings.INGESTION_SETTINGS, SPOOL_DIR=self.spool_dir, WEATHER_BACKLOG=2)
+        with mock.patch.dict(settings.INGESTION_SETTINGS, ingestion):
+            handler = MQTTHandler()
+        self.addCleanup(handler.spool.close)
+        return handler
+
+    def test_parked_rollups_are_emitted_on_the_first_refresh(self):
+        handler = self.handler()
+        fetch = mock.patch.object(handler.weather_client.cache, 'fetcher', side_effect=OSError('down'))
+        with fetch as fetcher, redirect_stdout(io.StringIO()):
+            handler.weather_client.cache.refresh(handler.weather_client.city)
+            start = datetime(2024, 5, 1, 10).timestamp()
+            for device_id in ('field-1', 'field-2'):
+                handler.emit_rollup(closed_bucket(device_id, start, values=(40.0, 42.0, 44.0)))
+            self.assertEqual(handler.writer.pending(), 0)
+            self.assertEqual(handler.weather_backlog.get_stats()['pending_samples'], 6)
+
+            fetcher.side_effect = None
+            fetcher.return_value = {key: WEATHER[key] for key in ('temperature', 'humidity_air', 'rain_forecast')}
+            self.assertTrue(handler.weather_client.cache.refresh(handler.weather_client.city))
+        handler.writer.flush()
+        documents = list(self.collection.find(sort=[('device_id', 1)]))
+        self.assertEqual([(document['device_id'], document['sample_count']) for document in documents],
+                         [('field-1', 3), ('field-2', 3)])
+        self.assertEqual(documents[0]['temperature'], WEATHER['temperature'])
+        stats = handler.get_stats()['weather_backlog']
+        self.assertEqual((stats['parked'], stats['released'], stats['pending']), (2, 2, 0))
+
+    def test_full_backlog_and_shutdown_count_the_lost_samples(self):
+        backlog = WeatherBacklog(maxlen=2)
+        for device_id in ('field-1', 'field-2', 'field-3'):
+            backlog.park(closed_bucket(device_id, values=(40.0,) * 4))
+        self.assertEqual([bucket.device_id for bucket in backlog.drain()], ['field-2', 'field-3'])
+        backlog.park(closed_bucket('field-4'))
+        self.assertEqual(backlog.discard(), 2)
+        stats = backlog.get_stats()
+        self.assertEqual((stats['dropped_buckets'], stats['dropped_samples'], stats['pending']), (2, 6, 0))
+
+
+class IngestQueueTests(SimpleTestCase):
+    """The bounded queue applies its backpressure policy and the pool drains it"""
+
+    def messages(self, count):
+        return [(f'sensors/field-{i}/data', f'{{"humidity_soil": {i}}}'.encode(), float(i)) for i in range(count)]
+
+    def test_drop_oldest_keeps_the_newest_messages(self):
+        queue = IngestQueue(maxsize=2, policy=DROP_OLDEST)
+        for message in self.messages(3):
+            queue.put(message)
+        self.assertEqual([queue.get(timeout=0)[2] for _ in range(2)], [1.0, 2.0])
+        self.assertEqual(queue.get_stats()['dropped'], 1)
+
+    def test_spilled_messages_are_read_back_in_order(self):
+        spill_dir = tempfile.mkdtemp(prefix='spill_')
+        self.addCleanup(shutil.rmtree, spill_dir, ignore_errors=True)
+        queue = IngestQueue(maxsize=2, policy=SPILL, spill_path=f'{spill_dir}/overflow.jsonl')
+        self.addCleanup(queue._spill.close)
+        messages = self.messages(5)
+        for message in messages:
+            queue.put(message)
+        self.assertEqual(queue.get_stats()['spilled'], 3)
+        self.assertEqual([queue.get(timeout=0) for _ in range(5)], messages)
+        self.assertIsNone(queue.get(timeout=0))
+        self.assertEqual(queue.get_stats()['spill_pending'], 0)
+
+    def test_unknown_policy_is_rejected(self):
+        with self.assertRaises(ValueError):
+            IngestQueue(policy='discard')
+        with self.assertRaises(ValueError):
+            IngestQueue(policy=SPILL)
+
+    def test_pool_processes_every_message_before_stopping(self):
+        seen = []
+        lock = threading.Lock()
+
+        def handler(topic, payload, received_at):
+            if received_at == 3.0:
+                raise ValueError('bad payload')
+            with lock:
+                seen.append(received_at)
+
+        queue = IngestQueue(maxsize=4, policy=BLOCK)
+        pool = WorkerPool(handler, queue, workers=3)
+        pool.start()
+        for message in self.messages(20):
+            queue.put(message)
+        pool.stop()
+        self.assertEqual(sorted(seen), [float(i) for i in range(20) if i != 3])
+        stats = pool.get_stats()
+        self.assertEqual((stats['processed'], stats['errors'], stats['queue_depth']), (19, 1, 0))
+
+
+class DeviceRoutingTests(MongoTestCase):
+    """Each message is attributed to a device and aggregated separately"""
+
+    TOPICS = ['esp32/humidity_soil', 'esp32/+/humidity_soil']
+
+    def test_device_id_from_payload_then_topic_then_default(self):
+        self.assertEqual(topic_device_id('esp32/field-3/humidity_soil', self.TOPICS), 'field-3')
+        self.assertIsNone(topic_device_id('esp32/field-3/temperature', self.TOPICS))
+        self.assertEqual(resolve_device_id('esp32/field-3/humidity_soil', self.TOPICS, {'device_id': 7}), '7')
+        self.assertEqual(resolve_device_id('esp32/field-3/humidity_soil', self.TOPICS, {'humidity_soil': 1}),
+                         'field-3')
+        self.assertEqual(resolve_device_id('esp32/humidity_soil', self.TOPICS, 42.0, default='garden'), 'garden')
+
+    def test_devices_are_aggregated_into_their_own_buckets(self):
+        from mqtt_handler.mqtt_client import MQTTHandler
+        ingestion = dict(settings.INGESTION_SETTINGS, SPOOL_DIR=self.spool_dir)
+        with mock.patch.dict(settings.INGESTION_SETTINGS, ingestion):
+            handler = MQTTHandler()
+        self.addCleanup(handler.spool.close)
+        handler.topics = self.TOPICS
+        closed = []
+        handler.aggregator.on_close = closed.append
+
+        received_at = datetime(2024, 5, 1, 10, 5).timestamp()
+        handler.process_message('esp32/field-1/humidity_soil', b'{"humidity_soil": 40.0}', received_at)
+        handler.process_message('esp32/field-2/humidity_soil', b'{"humidity_soil": 60.0}', received_at)
+        handler.process_message('esp32/humidity_soil', b'{"humidity_soil": 50.0, "device_id": "field-1"}',
+                                received_at + 60)
+        handler.aggregator.close_all()
+        self.assertEqual(sorted((bucket.device_id, bucket.count, bucket.mean) for bucket in closed),
+                         [('field-1', 2, 45.0), ('field-2', 1, 60.0)])
+
+
+class HourlyAggregatorTests(SimpleTestCase):
+    """Every reading is folded into its device's window, none is dropped"""
+
+    START = datetime(2024, 5, 1, 10).timestamp()
+
+    def setUp(self):
+        self.closed = []
+        self.aggregator = HourlyAggregator(self.closed.append, window=3600)
+
+    def test_next_window_closes_the_previous_bucket(self):
+        for minute, value in ((1, 40.0), (20, 44.0), (50, 42.0)):
+            self.aggregator.add('field-1', value, self.START + 60 * minute, {'wifi_rssi': -60 - minute})
+        self.assertEqual(self.closed, [])
+        self.aggregator.add('field-1', 30.0, self.START + 3600)
+
+        bucket, = self.closed
+        self.assertEqual((bucket.start, bucket.count, bucket.mean), (self.START, 3, 42.0))
+        self.assertEqual((bucket.minimum, bucket.maximum, bucket.last), (40.0, 44.0, 42.0))
+        document = rollup_document(bucket, WEATHER, 'Paris')
+        self.assertEqual(document['timestamp'], datetime(2024, 5, 1, 10))
+        self.assertEqual((document['humidity_soil'], document['sample_count'], document['wifi_rssi']), (42.0, 3, -110))
+        self.assertEqual(document['metadata'], {'device_id': 'field-1', 'location': 'Paris'})
+        self.assertEqual(self.aggregator.get_stats()['open_buckets'], 1)
+
+    def test_late_readings_never_store_a_second_document_for_the_hour(self):
+        self.aggregator.add('field-1', 40.0, self.START + 100)
+        self.aggregator.add('field-1', 42.0, self.START + 3000)
+        self.aggregator.add('field-1', 30.0, self.START + 3700)
+        # Réordonnée par le pool de workers : sa fenêtre est déjà émise
+        self.aggregator.add('field-1', 50.0, self.START + 3590)
+        self.assertEqual(self.aggregator.close_expired(now=self.START + 7200), 1)
+        # Fenêtre balayée, puis une lecture de cette fenêtre
+        self.aggregator.add('field-1', 31.0, self.START + 7100)
+        self.aggregator.close_all()
+
+        self.assertEqual([(bucket.start, bucket.count, bucket.last) for bucket in self.closed],
+                         [(self.START, 2, 42.0), (self.START + 3600, 1, 30.0)])
+        self.assertEqual(self.aggregator.get_stats()['late_readings'], 2)
+
+        # Un seul document par appareil et par heure
+        documents = [rollup_document(bucket, WEATHER) for bucket in self.closed]
+        keys = [(document['device_id'], document['timestamp']) for document in documents]
+        self.assertEqual(len(keys), len(set(keys)))
+
+    def test_close_all_emits_every_device_oldest_first(self):
+        self.aggregator.add('field-2', 60.0, self.START + 3700)
+        self.aggregator.add('field-1', 40.0, self.START + 10)
+        self.assertEqual(self.aggregator.close_all(), 2)
+        self.assertEqual([bucket.device_id for bucket in self.closed], ['field-1', 'field-2'])
+        stats = self.aggregator.get_stats()
+        self.assertEqual((stats['readings'], stats['buckets_closed'], stats['open_buckets']), (2, 2, 0))
+
+
+class AsyncCursor:
+    """Awaitable to_list over a mongomock cursor"""
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    async def to_list(self, length):
+        return list(self.cursor)[:length]
+
+
+class AsyncCollection:
+    """Awaitable insert_many and find over a mongomock collection (stands in for motor)"""
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    async def insert_many(self, documents, ordered=True):
+        return self.collection.insert_many(documents, ordered=ordered)
+
+    def find(self, *args, **kwargs):
+        return AsyncCursor(self.collection.find(*args, **kwargs))
+
+
+class AsyncEngineTests(MongoTestCase):
+    """The asyncio engine aggregates, writes by batch and backs off between reconnects"""
+
+    def engine(self):
+        from mqtt_handler.async_engine import AsyncIngestionEngine
+        engine = AsyncIngestionEngine(collection=AsyncCollection(self.collection))
+        engine.weather.put(engine.city, {key: WEATHER[key] for key in ('temperature', 'humidity_air', 'rain_forecast')})
+        engine.batch_size = 2
+        return engine
+
+    def test_consumed_messages_are_written_as_rollups(self):
+        engine = self.engine()
+        start = datetime(2024, 5, 1, 10).timestamp()
+
+        async def messages():
+            for device, value in (('field-1', 40), ('field-2', 60), ('field-1', 44), ('field-3', 'broken')):
+                yield f'esp32/{device}/humidity_soil', f'{{"humidity_soil": {value}}}'.encode()
+
+        async def ingest():
+            with mock.patch('mqtt_handler.async_engine.time.time', return_value=start):
+                await engine.consume(messages())
+            engine.aggregator.close_all()
+            await engine.flush()
+
+        asyncio.run(ingest())
+        stored = {document['device_id']: document for document in self.collection.find()}
+        self.assertEqual(sorted(stored), ['field-1', 'field-2'])
+        self.assertEqual((stored['field-1']['humidity_soil'], stored['field-1']['sample_count']), (42.0, 2))
+        self.assertEqual(stored['field-2']['temperature'], WEATHER['temperature'])
+        stats = engine.get_stats()['engine']
+        self.assertEqual((stats['messages'], stats['errors'], stats['flushes'], stats['pending']), (4, 1, 1, 0))
+
+    def test_replayed_batch_is_written_once_on_either_backend(self):
+        engine = self.engine()
+        documents = [dict(rollup_document(closed_bucket(device_id), WEATHER), _id=ObjectId())
+                     for device_id in ('field-1', 'field-2')]
+
+        async def write_twice():
+            for _ in range(2):
+                engine._pending = [(dict(document), None) for document in documents]
+                await engine.flush()
+
+        for timeseries in (False, True):
+            self.collection.delete_many({})
+            with mock.patch('mqtt_handler.writes.ais_timeseries', return_value=timeseries,
+                            new_callable=mock.AsyncMock):
+                asyncio.run(write_twice())
+            self.assertEqual(self.collection.count_documents({}), 2)
+        self.assertEqual(engine.get_stats()['engine']['documents_failed'], 0)
+
+    def test_reconnect_delay_doubles_up_to_the_maximum(self):
+        engine = self.engine()
+        engine.reconnect_min, engine.reconnect_max = 1, 8
+        delays = []
+
+        def jitter(low, high):
+            delays.append(high)
+            if len(delays) == 5:
+                engine.stop()
+            return 0
+
+        async def run():
+            engine._stopping = asyncio.Event()
+            await engine._mqtt_task()
+
+        with mock.patch('mqtt_handler.async_engine.aiomqtt') as aiomqtt, \
+                mock.patch('mqtt_handler.async_engine.random.uniform', side_effect=jitter):
+            aiomqtt.Client.side_effect = OSError('connection refused')
+            asyncio.run(run())
+        self.assertEqual(delays, [1, 2, 4, 8, 8])
+        self.assertEqual(engine.get_stats()['engine']['reconnects'], 5)
+
+
+class PayloadDecodingTests(SimpleTestCase):
+    """JSON, bare number and binary v1 payloads decode to the same fields"""
+
+    def test_binary_round_trip(self):
+        payload = encode_binary_v1(42.37, wifi_rssi=-67, uptime_ms=123456)
+        self.assertEqual(len(payload), 10)
+        self.assertEqual(decode_payload(payload), {'humidity_soil': 42.37, 'wifi_rssi': -67, 'uptime_ms': 123456})
+
+    def test_text_payloads(self):
+        self.assertEqual(decode_payload(b'42.5'), {'humidity_soil': 42.5})
+        self.assertEqual(decode_payload(b'{"humidity": 40, "wifi_rssi": -61}'),
+                         {'humidity': 40, 'humidity_soil': 40.0, 'wifi_rssi': -61})
+        self.assertEqual(decode_payload(b'{"humidity_soil": "41.5"}')['humidity_soil'], 41.5)
+
+    def test_malformed_payloads_are_rejected(self):
+        for payload in (b'', bytes([BINARY_MAGIC, 9, 0, 0]), encode_binary_v1(40.0)[:8], b'not a number'):
+            with self.subTest(payload=payload), self.assertRaises(ValueError):
+                decode_payload(payload)
+
+
+class SharedSubscriptionTests(MongoTestCase):
+    """Consumers on a shared subscription merge their partial buckets into one document"""
+
+    def partial(self, device_id='field-1', values=(41.0, 43.0)):
+        return dict(rollup_document(closed_bucket(device_id, values=values), WEATHER), id=ObjectId())
+
+    def test_rollup_id_is_derived_from_device_and_window(self):
+        window = datetime(2024, 5, 1, 10)
+        self.assertEqual(rollup_object_id('field-1', window), rollup_object_id('field-1', window))
+        self.assertNotEqual(rollup_object_id('field-1', window), rollup_object_id('field-2', window))
+        self.assertEqual(rollup_object_id('field-1', window).generation_time.replace(tzinfo=None), window)
+
+    def test_each_partial_is_stored_under_its_own_id(self):
+        first, second = self.partial(), self.partial(values=(50.0,))
+        collection = mock.Mock()
+        self.assertEqual(merge_rollups(collection, [first, second]), 2)
+        operations = collection.bulk_write.call_args.args[0]
+        self.assertEqual({operation._filter['_id'] for operation in operations},
+                         {rollup_object_id('field-1', first['timestamp'])})
+        self.assertTrue(all(operation._upsert for operation in operations))
+        partials = operations[0]._doc[0]['$set']['partials']['$mergeObjects'][1]['$literal']
+        self.assertEqual(list(partials), [str(first['id'])])
+        self.assertEqual((partials[str(first['id'])]['count'], partials[str(first['id'])]['total']), (2, 84.0))
+
+    def test_concurrent_upsert_losers_are_replayed(self):
+        collection = mock.Mock()
+        collection.bulk_write.side_effect = [
+            BulkWriteError({'writeErrors': [{'index': 1, 'code': DUPLICATE_KEY}], 'nInserted': 0}), None]
+        records = [self.partial('field-1'), self.partial('field-2')]
+        merge_rollups(collection, records)
+        retried, = collection.bulk_write.call_args.args[0]
+        self.assertEqual(retried._filter['_id'], rollup_object_id('field-2', records[1]['timestamp']))
+
+    def test_merge_writer_sends_partials_to_merge_rollups(self):
+        writer = BatchWriter(SensorData, merge=True)
+        writer.add(self.partial())
+        with mock.patch('mqtt_handler.batch_writer.merge_rollups') as merge, \
+                mock.patch('mqtt_handler.batch_writer.insert_readings') as insert:
+            writer.flush()
+        self.assertEqual(merge.call_count, 1)
+        self.assertFalse(insert.called)
+
+    def test_handler_subscribes_through_the_shared_group(self):
+        from mqtt_handler.mqtt_client import MQTTHandler
+        ingestion = dict(settings.INGESTION_SETTINGS, SPOOL_DIR=self.spool_dir)
+        with mock.patch.dict(settings.INGESTION_SETTINGS, ingestion), \
+                mock.patch.dict(settings.MQTT_SETTINGS, SHARED_GROUP='ingest', TOPICS=['esp32/+/humidity_soil']):
+            handler = MQTTHandler()
+            self.addCleanup(handler.spool.close)
+            with mock.patch.dict(settings.SENSOR_STORAGE, BACKEND='timeseries'), \
+                    self.assertRaises(ImproperlyConfigured):
+                MQTTHandler()
+        self.assertEqual(handler.subscriptions, ['$share/ingest/esp32/+/humidity_soil'])
+        self.assertTrue(handler.writer.merge)
+
+    def test_consumers_get_their_own_spool_and_spill_file(self):
+        ingestion = dict(settings.INGESTION_SETTINGS, SPOOL_DIR='spool', SPILL_PATH='spill/overflow.jsonl')
+        with mock.patch.dict(settings.INGESTION_SETTINGS, ingestion), mock.patch.dict(settings.MQTT_SETTINGS):
+            configure_consumer(2, 'ingest')
+            self.assertEqual(settings.INGESTION_SETTINGS['SPOOL_DIR'], os.path.join('spool', 'consumer-2'))
+            self.assertEqual(settings.INGESTION_SETTINGS['SPILL_PATH'], 'spill/overflow-2.jsonl')
+            self.assertTrue(settings.MQTT_SETTINGS['CLIENT_ID'].endswith('-ingest-2'))
+
+
+class FleetSimulatorTests(MongoTestCase):
+    """scripts/data_simulator.py --mode fleet"""
+
+    def fleet(self, **kwargs):
+        from data_simulator import FleetSimulator, IoTDataSimulator
+        with redirect_stdout(io.StringIO()):
+            fleet = FleetSimulator(IoTDataSimulator(), **kwargs)
+        fleet.weather = {key: WEATHER[key] for key in ('temperature', 'humidity_air', 'rain_forecast')}
+        return fleet
+
+    def test_payloads_are_understood_by_the_handler(self):
+        device_id = 'fleet-test-00001'
+        topic = f'esp32/{device_id}/humidity_soil'
+        for payload in ('json', 'binary'):
+            fleet = self.fleet(payload=payload)
+            message = fleet.make_payload(device_id, -60, time.time() - 5)
+            # aiomqtt publie les str en UTF-8
+            data = decode_payload(message.encode() if isinstance(message, str) else message)
+            self.assertEqual(resolve_device_id(topic, settings.MQTT_SETTINGS['TOPICS'], data), device_id)
+            self.assertEqual(data['wifi_rssi'], -60)
+            self.assertGreaterEqual(data['uptime_ms'], 5000)
+            self.assertTrue(0 <= data['humidity_soil'] <= 100)
+
+    def test_latency_counts_only_ingested_readings(self):
+        fleet = self.fleet()
+        now = time.time()
+        device_id = f'{fleet.prefix}00000'
+        fleet.published[device_id] = [now - 30, now - 20, now - 10]
+        self.collection.insert_many([
+            rollup_document(closed_bucket(device_id, values=(40.0, 41.0)), WEATHER),
+            rollup_document(closed_bucket('other-device', values=(40.0,) * 5), WEATHER),
+        ])
+        asyncio.run(fleet.poll_ingested())
+        self.assertEqual(fleet.ingested(), 2)
+        self.assertEqual([round(latency) for latency in sorted(fleet.latencies)], [20, 30])
+
+        # Un nouveau passage ne recompte pas les lectures déjà rapprochées
+        asyncio.run(fleet.poll_ingested())
+        self.assertEqual(len(fleet.latencies), 2)
+        self.assertEqual(fleet.percentile([1.0, 2.0, 3.0, 4.0], 50), 3.0)
@@ -0,0 +1,179 @@
+import time
+import logging
+import threading
+
+logger = logging.getLogger('mqtt_handler')
+
+
+class CircuitBreaker:
+    """Stops calling a failing endpoint until a cool-down period has elapsed
+
+    After ``failure_threshold`` consecutive failures the breaker opens and
+    ``allow_request()`` returns False for ``reset_timeout`` seconds. The next
+    call is then let through as a trial (half-open): success closes the
+    breaker, failure opens it again.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=3, reset_timeout=60.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                return self.HALF_OPEN
+            return self._state
+
+    def allow_request(self):
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                # Une seule requête d'essai jusqu'au prochain résultat
+                self._state = self.HALF_OPEN
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self._state != self.CLOSED:
+                logger.info("[OK] Weather API circuit closed")
+            self._state = self.CLOSED
+            self._failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != self.OPEN:
+                    logger.warning(f"[WARN] Weather API circuit opened for {self.reset_timeout}s")
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+
+
+class WeatherCache:
+    """Stale-while-revalidate cache of weather observations keyed by location
+
+    ``get()`` only reads memory and never waits on HTTP. A background thread
+    refreshes every registered location through ``fetcher(location)``; when
+    the fetch fails the last good value keeps being served and is flagged as
+    stale once it is older than ``ttl`` seconds. ``on_refresh(location)`` is
+    called after every successful refresh.
+    """
+
+    def __init__(self, fetcher, ttl=900.0, refresh_interval=300.0, retry_interval=30.0, breaker=None,
+                 on_refresh=None):
+        self.fetcher = fetcher
+        self.on_refresh = on_refresh
+        self.ttl = ttl
+        self.refresh_interval = refresh_interval
+        self.retry_interval = retry_interval
+        self.breaker = breaker or CircuitBreaker()
+
+        self._entries = {}
+        self._locations = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._stats = {'hits': 0, 'stale_hits': 0, 'misses': 0,
+                       'refreshes': 0, 'refresh_failures': 0, 'short_circuited': 0}
+
+    def register(self, location):
+        """Add a location to the set kept warm by the refresher"""
+        with self._lock:
+            self._locations.add(location)
+
+    def get(self, location):
+        """Return the cached observation for ``location`` or None if never fetched"""
+        with self._lock:
+            entry = self._entries.get(location)
+            if entry is None:
+                self._stats['misses'] += 1
+                return None
+            data, fetched_at = entry
+            age = time.monotonic() - fetched_at
+            stale = age > self.ttl
+            self._stats['stale_hits' if stale else 'hits'] += 1
+        result = dict(data)
+        result['stale'] = stale
+        result['age_seconds'] = round(age, 1)
+        return result
+
+    def refresh(self, location):
+        """Fetch ``location`` now unless the circuit is open, returns True on success"""
+        if not self.breaker.allow_request():
+            with self._lock:
+                self._stats['short_circuited'] += 1
+            return False
+        try:
+            data = self.fetcher(location)
+        except Exception as e:
+            self.breaker.record_failure()
+            with self._lock:
+                self._stats['refresh_failures'] += 1
+            logger.error(f"Weather API error for {location}: {e}")
+            return False
+        self.breaker.record_success()
+        self.put(location, data)
+        return True
+
+    def put(self, location, data):
+        """Store a fresh observation (used by refresh() and by async refreshers)"""
+        with self._lock:
+            self._entries[location] = (data, time.monotonic())
+            self._stats['refreshes'] += 1
+        logger.info(f"Weather data refreshed for {location}: {data}")
+        if self.on_refresh is not None:
+            try:
+                self.on_refresh(location)
+            except Exception as e:
+                # Ne doit pas arrêter le thread de rafraîchissement
+                logger.error(f"Weather refresh callback failed for {location}: {e}")
+
+    def due_locations(self):
+        """Locations whose entry is missing or older than refresh_interval"""
+        now = time.monotonic()
+        with self._lock:
+            return [loc for loc in self._locations
+                    if loc not in self._entries or now - self._entries[loc][1] >= self.refresh_interval]
+
+    def refresh_due(self):
+        """Refresh every location whose entry is missing or older than refresh_interval"""
+        return all([self.refresh(loc) for loc in self.due_locations()])
+
+    def start(self):
+        """Start the background refresher thread"""
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='weather-refresher', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['locations'] = len(self._locations)
+        stats['breaker_state'] = self.breaker.state
+        return stats
+
+    def _run(self):
+        while not self._stop.is_set():
+            ok = self.refresh_due()
+            # Réessaie plus tôt tant qu'une localisation n'a pas de valeur fraîche
+            wait = min(self.refresh_interval, self.retry_interval) if not ok else self.refresh_interval
+            self._stop.wait(wait)
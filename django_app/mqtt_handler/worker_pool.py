@@ -0,0 +1,187 @@
+import os
+import json
+import base64
+import logging
+import threading
+from collections import deque
+
+logger = logging.getLogger('mqtt_handler')
+
+BLOCK = 'block'
+DROP_OLDEST = 'drop_oldest'
+SPILL = 'spill'
+BACKPRESSURE_POLICIES = (BLOCK, DROP_OLDEST, SPILL)
+
+
+class _SpillFile:
+    """Append-only overflow file for queued messages, read back in FIFO order"""
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._writer = open(path, 'ab')
+        self._reader = open(path, 'rb')
+        # Messages laissés par une exécution précédente
+        self.pending = sum(1 for _ in self._reader)
+        self._reader.seek(0)
+
+    def append(self, item):
+        topic, payload, received_at = item
+        line = json.dumps({'t': topic, 'p': base64.b64encode(payload).decode('ascii'), 'r': received_at})
+        self._writer.write(line.encode('ascii') + b'\n')
+        self._writer.flush()
+        self.pending += 1
+
+    def read(self, count):
+        items = []
+        while len(items) < count and self.pending:
+            line = self._reader.readline()
+            if not line:
+                break
+            record = json.loads(line)
+            items.append((record['t'], base64.b64decode(record['p']), record['r']))
+            self.pending -= 1
+        if not self.pending:
+            # Tout a été relu : on repart d'un fichier vide
+            self._writer.truncate(0)
+            self._reader.seek(0)
+        return items
+
+    def close(self):
+        self._writer.close()
+        self._reader.close()
+
+
+class IngestQueue:
+    """Bounded FIFO of raw MQTT messages with an explicit backpressure policy
+
+    When the queue holds ``maxsize`` messages, ``put()`` either blocks the
+    caller (``block``), discards the oldest queued message (``drop_oldest``)
+    or appends the message to an overflow file on disk (``spill``) that is
+    read back once the in-memory queue drains.
+    """
+
+    def __init__(self, maxsize=1000, policy=BLOCK, spill_path=None):
+        if policy not in BACKPRESSURE_POLICIES:
+            raise ValueError(f"Unknown backpressure policy: {policy}")
+        if policy == SPILL and not spill_path:
+            raise ValueError("The spill policy requires a spill_path")
+        self.maxsize = maxsize
+        self.policy = policy
+        self._items = deque()
+        self._cond = threading.Condition()
+        self._closed = False
+        self._spill = _SpillFile(spill_path) if policy == SPILL else None
+        self._stats = {'enqueued': 0, 'dequeued': 0, 'dropped': 0, 'spilled': 0,
+                       'blocked_puts': 0, 'max_depth': 0}
+
+    def put(self, item):
+        """Enqueue one (topic, payload, received_at) tuple according to the policy"""
+        with self._cond:
+            stats = self._stats
+            stats['enqueued'] += 1
+            # Préserve l'ordre FIFO tant que le fichier de débordement n'est pas vidé
+            if self._spill is not None and self._spill.pending:
+                self._spill.append(item)
+                stats['spilled'] += 1
+                return
+            if len(self._items) >= self.maxsize:
+                if self.policy == BLOCK:
+                    stats['blocked_puts'] += 1
+                    while len(self._items) >= self.maxsize and not self._closed:
+                        self._cond.wait()
+                elif self.policy == DROP_OLDEST:
+                    self._items.popleft()
+                    stats['dropped'] += 1
+                else:
+                    self._spill.append(item)
+                    stats['spilled'] += 1
+                    return
+            self._items.append(item)
+            stats['max_depth'] = max(stats['max_depth'], len(self._items))
+            self._cond.notify_all()
+
+    def get(self, timeout=None):
+        """Dequeue the next message, None on timeout or once closed and empty"""
+        with self._cond:
+            if not self._items and self._spill is not None and self._spill.pending:
+                self._items.extend(self._spill.read(self.maxsize))
+            if not self._items and not self._closed:
+                self._cond.wait(timeout)
+            if not self._items:
+                return None
+            item = self._items.popleft()
+            self._stats['dequeued'] += 1
+            self._cond.notify_all()
+            return item
+
+    def close(self):
+        """Wake up blocked producers and consumers; queued messages can still be read"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def depth(self):
+        with self._cond:
+            return len(self._items)
+
+    def get_stats(self):
+        with self._cond:
+            stats = dict(self._stats)
+            stats['depth'] = len(self._items)
+            stats['spill_pending'] = self._spill.pending if self._spill is not None else 0
+            stats['policy'] = self.policy
+        return stats
+
+
+class WorkerPool:
+    """Pool of threads draining an IngestQueue into ``handler(topic, payload, received_at)``"""
+
+    def __init__(self, handler, queue, workers=4):
+        self.handler = handler
+        self.queue = queue
+        self.workers = workers
+        self._threads = []
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+        self._stats = {'processed': 0, 'errors': 0}
+
+    def start(self):
+        self._stopping.clear()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f'ingest-worker-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"Worker pool started ({self.workers} workers, queue={self.queue.maxsize}, "
+                    f"policy={self.queue.policy})")
+
+    def stop(self, timeout=30):
+        """Let the workers drain the in-memory queue, then join them"""
+        self._stopping.set()
+        self.queue.close()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats['workers'] = self.workers
+        stats.update({f'queue_{key}': value for key, value in self.queue.get_stats().items()})
+        return stats
+
+    def _run(self):
+        while True:
+            item = self.queue.get(timeout=0.5)
+            if item is None:
+                if self._stopping.is_set():
+                    return
+                continue
+            try:
+                self.handler(*item)
+                ok = True
+            except Exception as e:
+                logger.error(f"[ERROR] Worker failed to process message: {e}")
+                ok = False
+            with self._lock:
+                self._stats['processed' if ok else 'errors'] += 1
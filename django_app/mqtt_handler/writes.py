@@ -0,0 +1,188 @@
+"""
+MongoDB write paths shared by the batch writer, the asyncio engine and the spool replay
+
+* ``insert_readings``: unordered bulk insert, documents whose ``_id`` is already
+  stored count as written (makes replays idempotent). Time-series collections
+  have no unique ``_id`` index, so there the already-stored ``_id``s are looked
+  up (within the batch's time range) and skipped before inserting.
+* ``merge_rollups``: used when several consumer processes share the same
+  subscription. Each process only sees part of a device's readings, so every
+  closed bucket is merged into a single document per device and window:
+  the document ``_id`` is derived from (device_id, window start) and each
+  partial bucket is stored under ``partials.<record id>``, from which the
+  totals are recomputed server side. Writing the same partial twice is a
+  no-op, and partials from different processes commute.
+
+The asyncio engine writes through motor: ``ainsert_readings`` and its helpers
+are the awaitable counterparts of the functions above, with the same
+idempotence on both storage backends.
+"""
+
+import struct
+import hashlib
+import calendar
+
+from bson import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+DUPLICATE_KEY = 11000
+
+
+def insert_ignoring_duplicates(collection, documents):
+    """Unordered insert_many where already-present ``_id``s count as written
+
+    Returns the number of newly inserted documents; raises if any error other
+    than a duplicate key occurred.
+    """
+    try:
+        return len(collection.insert_many(documents, ordered=False).inserted_ids)
+    except BulkWriteError as e:
+        errors = e.details.get('writeErrors', [])
+        if any(error.get('code') != DUPLICATE_KEY for error in errors):
+            raise
+        return e.details.get('nInserted', 0)
+
+
+def insert_skipping_existing(collection, documents):
+    """insert_many for collections without a unique ``_id`` index, skipping stored ``_id``s"""
+    timestamps = [document['timestamp'] for document in documents]
+    existing = {
+        document['_id'] for document in collection.find(
+            {'timestamp': {'$gte': min(timestamps), '$lte': max(timestamps)},
+             '_id': {'$in': [document['_id'] for document in documents]}},
+            {'_id': 1},
+        )
+    }
+    new = [document for document in documents if document['_id'] not in existing]
+    if new:
+        collection.insert_many(new, ordered=False)
+    return len(new)
+
+
+_timeseries_collections = {}
+
+
+def is_timeseries(collection):
+    """Whether ``collection`` is a MongoDB time-series collection (cached per collection)"""
+    name = collection.full_name
+    if name not in _timeseries_collections:
+        _timeseries_collections[name] = 'timeseries' in collection.options()
+    return _timeseries_collections[name]
+
+
+def insert_readings(collection, documents):
+    """Idempotent bulk insert of SensorData documents on either storage backend"""
+    if is_timeseries(collection):
+        return insert_skipping_existing(collection, documents)
+    return insert_ignoring_duplicates(collection, documents)
+
+
+async def ainsert_ignoring_duplicates(collection, documents):
+    """Awaitable insert_ignoring_duplicates() for a motor collection"""
+    try:
+        return len((await collection.insert_many(documents, ordered=False)).inserted_ids)
+    except BulkWriteError as e:
+        errors = e.details.get('writeErrors', [])
+        if any(error.get('code') != DUPLICATE_KEY for error in errors):
+            raise
+        return e.details.get('nInserted', 0)
+
+
+async def ainsert_skipping_existing(collection, documents):
+    """Awaitable insert_skipping_existing() for a motor collection"""
+    timestamps = [document['timestamp'] for document in documents]
+    stored = await collection.find(
+        {'timestamp': {'$gte': min(timestamps), '$lte': max(timestamps)},
+         '_id': {'$in': [document['_id'] for document in documents]}},
+        {'_id': 1},
+    ).to_list(None)
+    existing = {document['_id'] for document in stored}
+    new = [document for document in documents if document['_id'] not in existing]
+    if new:
+        await collection.insert_many(new, ordered=False)
+    return len(new)
+
+
+async def ais_timeseries(collection):
+    """Awaitable is_timeseries() for a motor collection (same per-collection cache)"""
+    name = collection.full_name
+    if name not in _timeseries_collections:
+        _timeseries_collections[name] = 'timeseries' in await collection.options()
+    return _timeseries_collections[name]
+
+
+async def ainsert_readings(collection, documents):
+    """Awaitable insert_readings() for a motor collection"""
+    if await ais_timeseries(collection):
+        return await ainsert_skipping_existing(collection, documents)
+    return await ainsert_ignoring_duplicates(collection, documents)
+
+
+def rollup_object_id(device_id, timestamp):
+    """Deterministic ObjectId for a device's window: window start + hash of the device id"""
+    seconds = calendar.timegm(timestamp.utctimetuple())
+    digest = hashlib.blake2b(device_id.encode('utf-8'), digest_size=8).digest()
+    return ObjectId(struct.pack('>I', seconds) + digest)
+
+
+def _merge_pipeline(record):
+    count = record['sample_count']
+    partial = {
+        'count': count,
+        'total': record['humidity_soil'] * count,
+        'min': record['humidity_soil_min'],
+        'max': record['humidity_soil_max'],
+        'last': record['humidity_soil_last'],
+        'last_at': record.get('last_sample_at') or record['timestamp'],
+        'wifi_rssi': record.get('wifi_rssi'),
+        'uptime_ms': record.get('uptime_ms'),
+    }
+    parts = '$_parts'
+    return [
+        {'$set': {
+            'device_id': {'$literal': record['device_id']},
+            'metadata': {'$literal': record.get('metadata')},
+            'timestamp': {'$literal': record['timestamp']},
+            'temperature': {'$literal': record['temperature']},
+            'humidity_air': {'$literal': record['humidity_air']},
+            'rain_forecast': {'$literal': record['rain_forecast']},
+            'weather_stale': {'$literal': record.get('weather_stale', False)},
+            'partials': {'$mergeObjects': [{'$ifNull': ['$partials', {}]},
+                                           {'$literal': {str(record['id']): partial}}]},
+        }},
+        {'$set': {'_parts': {'$map': {'input': {'$objectToArray': '$partials'}, 'in': '$$this.v'}}}},
+        {'$set': {
+            'sample_count': {'$sum': f'{parts}.count'},
+            'humidity_soil': {'$round': [{'$divide': [{'$sum': f'{parts}.total'},
+                                                      {'$sum': f'{parts}.count'}]}, 2]},
+            'humidity_soil_min': {'$min': f'{parts}.min'},
+            'humidity_soil_max': {'$max': f'{parts}.max'},
+            'last_sample_at': {'$max': f'{parts}.last_at'},
+            '_last': {'$indexOfArray': [f'{parts}.last_at', {'$max': f'{parts}.last_at'}]},
+        }},
+        {'$set': {
+            'humidity_soil_last': {'$arrayElemAt': [f'{parts}.last', '$_last']},
+            'wifi_rssi': {'$arrayElemAt': [f'{parts}.wifi_rssi', '$_last']},
+            'uptime_ms': {'$arrayElemAt': [f'{parts}.uptime_ms', '$_last']},
+        }},
+        {'$unset': ['_parts', '_last']},
+    ]
+
+
+def merge_rollups(collection, records):
+    """Upsert partial rollups (rollup_document() dicts carrying their spool ``id``)"""
+    operations = [
+        UpdateOne({'_id': rollup_object_id(record['device_id'], record['timestamp'])},
+                  _merge_pipeline(record), upsert=True)
+        for record in records
+    ]
+    try:
+        collection.bulk_write(operations, ordered=False)
+    except BulkWriteError as e:
+        errors = e.details.get('writeErrors', [])
+        if any(error.get('code') != DUPLICATE_KEY for error in errors):
+            raise
+        # Deux processus ont créé le même document en même temps : on rejoue les perdants
+        collection.bulk_write([operations[error['index']] for error in errors], ordered=False)
+    return len(operations)
@@ -0,0 +1,193 @@
+"""
+Response cache of the read APIs, invalidated by ingestion
+
+Entries live in the Django cache selected by ``API_CACHE['ALIAS']`` (local
+memory, file or any shared backend such as Redis or Memcached, see
+``CACHES``). Their key holds the endpoint, its normalized parameters and the
+current *generation*: a counter stored in the same cache that ingestion
+increments (``bump_generation``) whenever readings are written. A new
+generation makes every older entry unreachable, so N dashboards asking for
+the same view cost one MongoDB query per ingest instead of N; stale entries
+simply expire after ``API_CACHE['TIMEOUT']`` seconds, which also bounds how
+long a relative window ("last 24 h") can lag behind the clock.
+
+Parameters are normalized before the lookup (defaults applied, integers
+parsed, ``max_points`` rounded down to a bucket) and the view receives the
+normalized values, so equivalent requests share one entry and a cached
+response is exactly what the view would have returned. Responses must not
+depend on the clock: values such as the age of the latest reading are added
+after the lookup (``cached_value``). The cache is best
+effort: if the backend fails, requests are served by the view directly.
+"""
+
+import json
+import time
+import hashlib
+import logging
+import threading
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse, QueryDict
+
+logger = logging.getLogger(__name__)
+
+GENERATION_KEY = 'sensor_api:generation'
+
+_stats = {'hits': 0, 'misses': 0, 'errors': 0, 'bumps': 0, 'endpoints': {}}
+_stats_lock = threading.Lock()
+
+
+def _cache():
+    return caches[settings.API_CACHE['ALIAS']]
+
+
+def _count(event, endpoint=None):
+    with _stats_lock:
+        _stats[event] += 1
+        if endpoint is not None:
+            counters = _stats['endpoints'].setdefault(endpoint, {'hits': 0, 'misses': 0})
+            counters[event] += 1
+
+
+def get_stats():
+    """Per-process hit/miss counters and the current generation"""
+    with _stats_lock:
+        stats = dict(_stats, endpoints={name: dict(counters) for name, counters in _stats['endpoints'].items()})
+    lookups = stats['hits'] + stats['misses']
+    stats['hit_ratio'] = round(stats['hits'] / lookups, 3) if lookups else None
+    stats['enabled'] = settings.API_CACHE['ENABLED']
+    try:
+        stats['generation'] = _cache().get(GENERATION_KEY)
+    except Exception:
+        stats['generation'] = None
+    return stats
+
+
+def bump_generation():
+    """Invalidate every cached response (called by ingestion after each write)"""
+    if not settings.API_CACHE['ENABLED']:
+        return
+    cache = _cache()
+    try:
+        try:
+            cache.incr(GENERATION_KEY)
+        except ValueError:
+            # Clé absente (premier démarrage, éviction) : repartir d'une valeur jamais utilisée
+            cache.add(GENERATION_KEY, int(time.time() * 1000), timeout=None)
+            cache.incr(GENERATION_KEY)
+        _count('bumps')
+    except Exception as e:
+        _count('errors')
+        logger.warning(f"API cache generation bump failed: {e}")
+
+
+def _generation(cache):
+    generation = cache.get(GENERATION_KEY)
+    if generation is None:
+        cache.add(GENERATION_KEY, int(time.time() * 1000), timeout=None)
+        generation = cache.get(GENERATION_KEY)
+    return generation
+
+
+def make_key(endpoint, params, generation):
+    digest = hashlib.blake2b(json.dumps(sorted(params.items())).encode(), digest_size=12).hexdigest()
+    return f"sensor_api:{endpoint}:{generation}:{digest}"
+
+
+def cached_value(endpoint, params, compute):
+    """compute() memoized for the current generation (used for small values such as validators)"""
+    if not settings.API_CACHE['ENABLED']:
+        return compute()
+    try:
+        cache = _cache()
+        key = make_key(endpoint, params, _generation(cache))
+        value = cache.get(key)
+    except Exception:
+        _count('errors')
+        return compute()
+    if value is not None:
+        _count('hits', endpoint)
+        return value
+    _count('misses', endpoint)
+    value = compute()
+    if value is not None:
+        try:
+            cache.set(key, value, settings.API_CACHE['TIMEOUT'])
+        except Exception:
+            _count('errors')
+    return value
+
+
+# Normalisation des paramètres : valeur brute (ou None) -> valeur canonique (ou None si absent)
+
+def int_param(default=None, minimum=None, step=None):
+    def normalize(value):
+        if value in (None, ''):
+            return default
+        number = int(float(value))
+        if minimum is not None:
+            number = max(minimum, number)
+        if step and number > step:
+            # Arrondi au bucket inférieur (jamais plus de points que demandé) : les largeurs d'écran voisines
+            # partagent une entrée ; en dessous d'un bucket, la valeur demandée est gardée
+            number = number // step * step
+        return number
+    return normalize
+
+
+def text_param(value):
+    if value is None:
+        return None
+    return value.strip() or None
+
+
+def cache_response(endpoint, skip=None, **params):
+    """Cache the successful JSON responses of a GET view
+
+    ``params`` maps each query parameter the view reads to its normalizer;
+    other parameters (cache busters) are dropped. ``skip(request)`` bypasses
+    the cache, e.g. for streamed responses.
+    """
+    def decorator(view):
+        @wraps(view)
+        def inner(request, *args, **kwargs):
+            if not settings.API_CACHE['ENABLED'] or request.method != 'GET' or (skip and skip(request)):
+                return view(request, *args, **kwargs)
+            try:
+                normalized = {name: normalize(request.GET.get(name)) for name, normalize in params.items()}
+            except (TypeError, ValueError):
+                # Paramètre invalide : la vue produit elle-même l'erreur
+                return view(request, *args, **kwargs)
+
+            query = QueryDict(mutable=True)
+            for name, value in normalized.items():
+                if value is not None:
+                    query[name] = str(value)
+            request.GET = query
+
+            try:
+                cache = _cache()
+                key = make_key(endpoint, normalized, _generation(cache))
+                cached = cache.get(key)
+            except Exception as e:
+                _count('errors')
+                logger.warning(f"API cache lookup failed: {e}")
+                return view(request, *args, **kwargs)
+            if cached is not None:
+                _count('hits', endpoint)
+                content, content_type = cached
+                return HttpResponse(content, content_type=content_type)
+
+            _count('misses', endpoint)
+            response = view(request, *args, **kwargs)
+            if response.status_code == 200 and not response.streaming:
+                try:
+                    cache.set(key, (response.content, response['Content-Type']), settings.API_CACHE['TIMEOUT'])
+                except Exception as e:
+                    _count('errors')
+                    logger.warning(f"API cache store failed: {e}")
+            return response
+        return inner
+    return decorator
@@ -0,0 +1,92 @@
+"""
+Conditional GET for the dashboard read APIs
+
+``window_condition`` wraps Django's ``condition`` decorator with validators
+computed from two indexed queries: the newest reading of the window
+(``find_one`` on the timestamp index) and the number of readings in it.
+Both only change when a reading is ingested or leaves the window, so a
+dashboard refetching unchanged data gets a 304 without the full query and
+serialization running. The ETag also covers the request parameters.
+"""
+
+import hashlib
+from datetime import datetime, timedelta, timezone
+from functools import wraps
+
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import condition
+
+from .models import SensorData
+from .hot_tier import hot_tier
+from .api_cache import cached_value
+
+
+def hours_window(request):
+    """(start, end, device_id) of the ``?hours=`` window (24 h by default)"""
+    end = datetime.utcnow()
+    return end - timedelta(hours=int(request.GET.get('hours', 24))), end, request.GET.get('device_id')
+
+
+def latest_window(request):
+    """Every reading, optionally of one device"""
+    return None, None, request.GET.get('device_id')
+
+
+def window_state(start, end, device_id, count=True):
+    """(newest timestamp, count or _id of the newest reading), (None, 0) for an empty window"""
+    # Fenêtre couverte par le niveau chaud : validateurs calculés en mémoire
+    state = hot_tier.state(start, end, device_id)
+    if state is not None:
+        return state
+    collection = SensorData._get_collection()
+    query = SensorData._range_query(start, end, device_id)
+    newest = collection.find_one(query, {'timestamp': 1}, sort=[('timestamp', -1)])
+    if newest is None:
+        return None, 0
+    return newest['timestamp'], collection.count_documents(query) if count else newest['_id']
+
+
+def window_condition(window, count=True):
+    """Answer If-None-Match / If-Modified-Since from the state of ``window(request)``
+
+    ``count=False`` uses the _id of the newest reading instead of the count, for
+    responses that only depend on that reading.
+    """
+    def state(request):
+        # Calculé une fois par requête pour l'ETag et pour Last-Modified, et une fois par ingestion
+        # pour tous les clients qui envoient les mêmes paramètres
+        if not hasattr(request, '_window_state'):
+            try:
+                params = {'path': request.path, 'query': sorted(request.GET.lists()), 'count': count}
+                request._window_state = cached_value('window_state', params,
+                                                     lambda: window_state(*window(request), count=count))
+            except Exception:
+                # Paramètres invalides, base indisponible : la vue répond elle-même
+                request._window_state = None
+        return request._window_state
+
+    def etag(request, *args, **kwargs):
+        current = state(request)
+        if current is None:
+            return None
+        newest, tag = current
+        key = f"{request.path}?{sorted(request.GET.lists())}|{newest.isoformat() if newest else '-'}|{tag}"
+        return hashlib.blake2b(key.encode(), digest_size=12).hexdigest()
+
+    def last_modified(request, *args, **kwargs):
+        current = state(request)
+        if current is None or current[0] is None:
+            return None
+        return current[0].replace(tzinfo=timezone.utc)
+
+    def decorator(view):
+        conditional_view = condition(etag_func=etag, last_modified_func=last_modified)(view)
+
+        @wraps(view)
+        def inner(request, *args, **kwargs):
+            response = conditional_view(request, *args, **kwargs)
+            # Revalider à chaque fois : la réponse change dès qu'une lecture arrive
+            patch_cache_control(response, no_cache=True)
+            return response
+        return inner
+    return decorator
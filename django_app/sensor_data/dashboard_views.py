@@ -1,10 +1,26 @@
 from django.shortcuts import render
-from django.http import JsonResponse
+from django.http import JsonResponse, StreamingHttpResponse
+from django.core.handlers.asgi import ASGIRequest
 from django.views.decorators.http import require_http_methods
 from datetime import datetime, timedelta
+import time
 from .models import SensorData
+from .rollups import FIELDS, pick_resolution, rollup_series, field_mean
+from .downsampling import downsample_columns
+from .statistics import window_statistics
+from .events import bus, SubscriberLimitReached
+from .conditional import window_condition, hours_window, latest_window
+from .hot_tier import hot_tier
+from . import api_cache
+from .api_cache import cache_response, int_param, text_param
+from django.conf import settings
 import json
 
+CHART_FIELDS = ('temperature', 'humidity_air', 'humidity_soil', 'rain_forecast')
+
+# Format des libellés de graphique selon la résolution des rollups
+LABEL_FORMATS = {'minute': '%d/%m %H:%M', 'hour': '%d/%m %H:%M', 'day': '%d/%m/%Y'}
+
 def dashboard_home(request):
     """Page d'accueil du tableau de bord"""
     try:
@@ -53,40 +69,73 @@ def dashboard_analytics(request):
 
 # API Endpoints pour les graphiques
 @require_http_methods(["GET"])
+@window_condition(hours_window)
+@cache_response('chart_data', hours=int_param(24), device_id=text_param,
+                max_points=int_param(settings.CHART_SETTINGS['DEFAULT_MAX_POINTS'], step=100))
 def api_chart_data(request):
-    """API pour récupérer les données des graphiques"""
+    """API pour récupérer les données des graphiques (au plus max_points points, communs aux séries)"""
     try:
         # Paramètres
         hours = int(request.GET.get('hours', 24))
         end_date = datetime.utcnow()
         start_date = end_date - timedelta(hours=hours)
+        device_id = request.GET.get('device_id')
+        chart_settings = settings.CHART_SETTINGS
+        max_points = int(request.GET.get('max_points', chart_settings['DEFAULT_MAX_POINTS']))
+        max_points = max(3, min(max_points, chart_settings['MAX_POINTS_LIMIT']))
+        
+        # Fenêtre couverte par le niveau chaud : lectures en mémoire, sans MongoDB
+        columns = hot_tier.columns(start_date, end_date, device_id, ('timestamp',) + CHART_FIELDS)
+        # Longues périodes : un point par bucket du rollup le plus grossier qui suffit
+        min_points = min(settings.ROLLUP_SETTINGS['CHART_MIN_POINTS'], max_points)
+        resolution = pick_resolution(start_date, end_date, min_points) if columns is None else None
+        buckets = rollup_series(start_date, end_date, resolution, device_id) if resolution else None
+        if buckets:
+            # Plus récent d'abord, comme les lectures brutes (home.html lit les premiers points)
+            buckets.reverse()
+            timestamps = [bucket['start'] for bucket in buckets]
+            datasets = {field: [field_mean(bucket[field]) for bucket in buckets] for field in FIELDS}
+            label_format = LABEL_FORMATS[resolution]
+            source = f'rollup_{resolution}'
+        else:
+            source = 'hot_tier' if columns is not None else 'raw'
+            if columns is None:
+                # Lecture colonne par colonne (dicts bruts projetés, sans Document mongoengine)
+                columns = SensorData.raw_columns(('timestamp',) + CHART_FIELDS, start_date=start_date,
+                                                 end_date=end_date, device_id=device_id)
+            timestamps = columns['timestamp']
+            datasets = {field: [float(value) for value in columns[field]] for field in CHART_FIELDS}
+            label_format = '%H:%M'
+            resolution = None
         
-        readings = SensorData.get_readings_by_date_range(start_date, end_date)
+        # Réduction LTTB par série : la taille de la réponse ne dépend plus de la période
+        source_points = len(timestamps)
+        kept = None
+        if source_points > max_points:
+            kept = downsample_columns([timestamp.timestamp() for timestamp in timestamps], datasets, max_points)
+        if kept is not None:
+            timestamps = [timestamps[index] for index in kept]
+            datasets = {field: [values[index] for index in kept] for field, values in datasets.items()}
         
         # Format pour Chart.js
         chart_data = {
-            'labels': [],
-            'datasets': {
-                'temperature': [],
-                'humidity_air': [],
-                'humidity_soil': [],
-                'rain_forecast': []
-            }
+            'labels': [timestamp.strftime(label_format) for timestamp in timestamps],
+            'datasets': datasets
         }
         
-        for reading in readings:
-            chart_data['labels'].append(reading.timestamp.strftime('%H:%M'))
-            chart_data['datasets']['temperature'].append(float(reading.temperature))
-            chart_data['datasets']['humidity_air'].append(float(reading.humidity_air))
-            chart_data['datasets']['humidity_soil'].append(float(reading.humidity_soil))
-            chart_data['datasets']['rain_forecast'].append(float(reading.rain_forecast))
-        
-        return JsonResponse({
+        response = {
             'status': 'success',
             'data': chart_data,
-            'count': len(readings),
-            'period_hours': hours
-        })
+            'count': len(timestamps),
+            'period_hours': hours,
+            'max_points': max_points,
+            'source_points': source_points,
+            'downsampled': kept is not None,
+            'source': source
+        }
+        if resolution:
+            response['resolution'] = resolution
+        return JsonResponse(response)
         
     except Exception as e:
         return JsonResponse({
@@ -94,11 +143,24 @@ def api_chart_data(request):
             'message': str(e)
         }, status=500)
 
+def latest_reading_of(device_id):
+    """Dernière lecture brute (niveau chaud, sinon MongoDB), None si aucune"""
+    latest_reading = hot_tier.latest(device_id)
+    if latest_reading is None:
+        latest_reading = next(iter(SensorData.raw_readings(device_id=device_id, limit=1)), None)
+    return latest_reading
+
 @require_http_methods(["GET"])
+@window_condition(latest_window, count=False)
 def api_realtime_data(request):
-    """API pour données en temps réel (dernière lecture)"""
+    """API pour données en temps réel (dernière lecture)
+
+    Seule la lecture passe par le cache des API : ``time_ago`` est recalculé à chaque réponse.
+    """
     try:
-        latest_reading = SensorData.objects.order_by('-timestamp').first()
+        device_id = text_param(request.GET.get('device_id'))
+        latest_reading = api_cache.cached_value('realtime_reading', {'device_id': device_id},
+                                                lambda: latest_reading_of(device_id))
         
         if not latest_reading:
             return JsonResponse({
@@ -107,18 +169,9 @@ def api_realtime_data(request):
                 'message': 'Aucune donnée disponible'
             })
         
-        data = {
-            'timestamp': latest_reading.timestamp.strftime('%Y-%m-%d %H:%M:%S'),
-            'temperature': float(latest_reading.temperature),
-            'humidity_air': float(latest_reading.humidity_air),
-            'humidity_soil': float(latest_reading.humidity_soil),
-            'rain_forecast': float(latest_reading.rain_forecast),
-            'time_ago': get_time_ago(latest_reading.timestamp)
-        }
-        
         return JsonResponse({
             'status': 'success',
-            'data': data
+            'data': realtime_payload(latest_reading)
         })
         
     except Exception as e:
@@ -127,59 +180,135 @@ def api_realtime_data(request):
             'message': str(e)
         }, status=500)
 
+def realtime_payload(document):
+    """Données temps réel d'une lecture brute (API realtime et événements du flux SSE)"""
+    return {
+        'device_id': document.get('device_id', 'default'),
+        'timestamp': document['timestamp'].strftime('%Y-%m-%d %H:%M:%S'),
+        'temperature': float(document['temperature']),
+        'humidity_air': float(document['humidity_air']),
+        'humidity_soil': float(document['humidity_soil']),
+        'rain_forecast': float(document['rain_forecast']),
+        'time_ago': get_time_ago(document['timestamp'])
+    }
+
+def sse_message(event):
+    """Trame Server-Sent Events d'un événement du bus"""
+    sequence, name, document = event
+    return f"id: {sequence}\nevent: {name}\ndata: {json.dumps(realtime_payload(document))}\n\n"
+
+def event_stream(subscription):
+    """Flux SSE bloquant (WSGI) : un thread par connexion"""
+    stream = settings.EVENT_STREAM
+    deadline = time.monotonic() + stream['MAX_AGE']
+    try:
+        yield f"retry: {stream['RETRY_MS']}\n\n"
+        while time.monotonic() < deadline:
+            event = subscription.get(stream['HEARTBEAT'])
+            # Commentaire SSE : garde la connexion ouverte et détecte les clients partis
+            yield sse_message(event) if event else ': heartbeat\n\n'
+    finally:
+        bus.unsubscribe(subscription)
+
+async def async_event_stream(subscription):
+    """Flux SSE asyncio (ASGI) : une tâche par connexion"""
+    stream = settings.EVENT_STREAM
+    deadline = time.monotonic() + stream['MAX_AGE']
+    try:
+        yield f"retry: {stream['RETRY_MS']}\n\n"
+        while time.monotonic() < deadline:
+            event = await subscription.aget(stream['HEARTBEAT'])
+            yield sse_message(event) if event else ': heartbeat\n\n'
+    finally:
+        bus.unsubscribe(subscription)
+
+@require_http_methods(["GET"])
+def api_stream(request):
+    """Flux Server-Sent Events des nouvelles lectures (remplace l'interrogation périodique de realtime)"""
+    try:
+        subscription = bus.subscribe()
+    except SubscriberLimitReached as e:
+        response = JsonResponse({
+            'status': 'error',
+            'message': str(e)
+        }, status=503)
+        response['Retry-After'] = str(settings.EVENT_STREAM['RETRY_MS'] // 1000)
+        return response
+    
+    stream = async_event_stream(subscription) if isinstance(request, ASGIRequest) else event_stream(subscription)
+    response = StreamingHttpResponse(stream, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Pas de mise en tampon par un proxy nginx
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+@require_http_methods(["GET"])
+def api_stream_stats(request):
+    """Connexions SSE ouvertes et événements publiés par ce processus"""
+    return JsonResponse({
+        'status': 'success',
+        'data': bus.get_stats()
+    })
+
+@require_http_methods(["GET"])
+def api_cache_stats(request):
+    """Succès / échecs du cache des API (ce processus) et génération courante"""
+    return JsonResponse({
+        'status': 'success',
+        'data': api_cache.get_stats()
+    })
+
+@require_http_methods(["GET"])
+def api_hot_tier_stats(request):
+    """Occupation mémoire et taux de service du niveau chaud de ce processus"""
+    return JsonResponse({
+        'status': 'success',
+        'data': hot_tier.get_stats()
+    })
+
 @require_http_methods(["GET"])
+@window_condition(hours_window)
+@cache_response('statistics_summary', hours=int_param(24), device_id=text_param)
 def api_statistics_summary(request):
-    """API pour résumé statistique"""
+    """API pour résumé statistique (fenêtre en heures, 24 par défaut)"""
     try:
-        # Données des dernières 24h
+        hours = int(request.GET.get('hours', 24))
         end_date = datetime.utcnow()
-        start_date = end_date - timedelta(days=1)
-        readings = list(SensorData.get_readings_by_date_range(start_date, end_date))
+        start_date = end_date - timedelta(hours=hours)
+        device_id = request.GET.get('device_id')
         
-        if not readings:
+        # Calculs statistiques côté MongoDB : un seul document en retour
+        summary = window_statistics(start_date, end_date, device_id)
+        
+        if not summary:
             return JsonResponse({
                 'status': 'success',
                 'data': None,
                 'message': 'Aucune donnée disponible'
             })
         
-        # Calculs statistiques
-        temperatures = [float(r.temperature) for r in readings]
-        humidity_air = [float(r.humidity_air) for r in readings]
-        humidity_soil = [float(r.humidity_soil) for r in readings]
-        rain_forecasts = [float(r.rain_forecast) for r in readings]
-        
+        latest = summary['latest']
         stats = {
-            'total_readings': len(readings),
-            'last_update': readings[0].timestamp.strftime('%Y-%m-%d %H:%M:%S'),
-            'temperature': {
-                'current': temperatures[0],
-                'avg': round(sum(temperatures) / len(temperatures), 1),
-                'min': min(temperatures),
-                'max': max(temperatures)
-            },
-            'humidity_air': {
-                'current': humidity_air[0],
-                'avg': round(sum(humidity_air) / len(humidity_air), 1),
-                'min': min(humidity_air),
-                'max': max(humidity_air)
-            },
-            'humidity_soil': {
-                'current': humidity_soil[0],
-                'avg': round(sum(humidity_soil) / len(humidity_soil), 1),
-                'min': min(humidity_soil),
-                'max': max(humidity_soil)
-            },
-            'rain_forecast': {
-                'current': rain_forecasts[0],
-                'avg': round(sum(rain_forecasts) / len(rain_forecasts), 1),
-                'total_predicted': sum(rain_forecasts)
-            }
+            'total_readings': summary['count'],
+            'last_update': latest['timestamp'].strftime('%Y-%m-%d %H:%M:%S'),
+            'period_hours': hours
         }
+        for field in FIELDS:
+            field_stats = summary[field]
+            stats[field] = {
+                'current': float(latest[field]),
+                'avg': round(field_stats['avg'], 1) if field_stats['avg'] is not None else None
+            }
+            if field == 'rain_forecast':
+                stats[field]['total_predicted'] = field_stats['sum']
+            else:
+                stats[field]['min'] = field_stats['min']
+                stats[field]['max'] = field_stats['max']
         
         return JsonResponse({
             'status': 'success',
-            'data': stats
+            'data': stats,
+            'source': summary['source']
         })
         
     except Exception as e:
@@ -0,0 +1,71 @@
+"""
+Largest-Triangle-Three-Buckets downsampling of chart series
+
+``lttb_indices`` keeps the first and last points and, for each of the
+``threshold - 2`` buckets in between, the point forming the largest triangle
+with the previously kept point and the mean of the next bucket: peaks, dips
+and slope changes survive while flat stretches collapse. It works on plain
+columns (lists of x and y) in one pass, without building a point object.
+
+``downsample_columns`` runs it on every series of a columnar chart with an
+equal share of ``max_points`` and keeps the union of the selected indices, so
+all series still share one label array of at most ``max_points`` points.
+"""
+
+
+def lttb_indices(x, y, threshold):
+    """Indices of the ``threshold`` points kept from the series (x monotonic)"""
+    length = len(x)
+    if threshold >= length or threshold < 3:
+        return list(range(length))
+
+    every = (length - 2) / (threshold - 2)
+    selected = [0]
+    a = 0
+    for bucket in range(threshold - 2):
+        # Moyenne du bucket suivant : troisième sommet du triangle
+        next_start = int((bucket + 1) * every) + 1
+        next_end = min(int((bucket + 2) * every) + 1, length)
+        span = next_end - next_start
+        avg_x = sum(x[next_start:next_end]) / span
+        avg_y = sum(y[next_start:next_end]) / span
+
+        ax, ay = x[a], y[a]
+        dx, dy = ax - avg_x, avg_y - ay
+        best, best_area = next_start - 1, -1.0
+        for index in range(int(bucket * every) + 1, next_start):
+            # Double de l'aire du triangle (a, point, moyenne du bucket suivant)
+            area = abs(dx * (y[index] - ay) - (ax - x[index]) * dy)
+            if area > best_area:
+                best, best_area = index, area
+        selected.append(best)
+        a = best
+    selected.append(length - 1)
+    return selected
+
+
+def _series_indices(x, values, max_points):
+    present = [index for index, value in enumerate(values) if value is not None]
+    if len(present) == len(values):
+        return lttb_indices(x, values, max_points)
+    # Buckets de rollup sans valeur : LTTB sur les seuls points présents
+    kept = lttb_indices([x[index] for index in present], [values[index] for index in present], max_points)
+    return [present[index] for index in kept]
+
+
+def downsample_columns(x, columns, max_points):
+    """Downsample ``{field: values}`` sharing the ``x`` axis, returns at most ``max_points`` kept indices
+
+    Returns None when the series already fit in ``max_points``.
+    """
+    if len(x) <= max_points:
+        return None
+    series = list(columns.values())
+    budget = max_points // max(len(series), 1)
+    if budget < 3:
+        # Trop de séries pour le budget : la première choisit les points de toutes
+        series, budget = series[:1], max_points
+    kept = set()
+    for values in series:
+        kept.update(_series_indices(x, values, budget))
+    return sorted(kept)
@@ -0,0 +1,130 @@
+"""
+In-process event bus between ingestion and the dashboard push channel
+
+Ingestion publishes every reading written to MongoDB; each Server-Sent Events
+connection holds one ``Subscription`` and receives every event exactly once.
+``publish`` never blocks the ingestion path: a subscriber whose queue is full
+loses its oldest events, and the number of subscribers is capped.
+
+Subscriptions are consumed either from a WSGI thread (``get``) or from an
+asyncio event loop under ASGI (``aget``); publishing is thread-safe in both
+cases.
+"""
+
+import asyncio
+import itertools
+import threading
+from collections import deque
+
+from django.conf import settings
+
+
+class SubscriberLimitReached(Exception):
+    """The bus already serves its maximum number of subscribers"""
+
+
+class Subscription:
+    """Bounded queue of the events published since subscribing"""
+
+    def __init__(self, maxsize):
+        self._events = deque(maxlen=maxsize)
+        self._ready = threading.Condition()
+        self._loop = None
+        self._wakeup = None
+        self.dropped = 0
+
+    def push(self, event):
+        with self._ready:
+            if len(self._events) == self._events.maxlen:
+                self.dropped += 1
+            self._events.append(event)
+            self._ready.notify()
+            loop = self._loop
+        if loop is not None:
+            try:
+                loop.call_soon_threadsafe(self._wakeup.set)
+            except RuntimeError:
+                # Boucle fermée : la connexion est déjà terminée
+                pass
+
+    def _pop(self):
+        with self._ready:
+            return self._events.popleft() if self._events else None
+
+    def get(self, timeout):
+        """Next event, or None after ``timeout`` seconds without one (blocking)"""
+        with self._ready:
+            if not self._events:
+                self._ready.wait(timeout)
+            return self._events.popleft() if self._events else None
+
+    async def aget(self, timeout):
+        """Next event, or None after ``timeout`` seconds without one (asyncio)"""
+        if self._loop is None:
+            self._wakeup = asyncio.Event()
+            with self._ready:
+                self._loop = asyncio.get_running_loop()
+        event = self._pop()
+        if event is None:
+            self._wakeup.clear()
+            # Un push entre _pop() et clear() a planifié set() après ce clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            event = self._pop()
+        return event
+
+
+class EventBus:
+    """Fan-out of ``(sequence, name, data)`` events to every subscriber"""
+
+    def __init__(self, max_subscribers, queue_size):
+        self.max_subscribers = max_subscribers
+        self.queue_size = queue_size
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._sequence = itertools.count(1)
+        self.published = 0
+        self.rejected = 0
+
+    def subscribe(self):
+        """New subscription, raises SubscriberLimitReached at the limit"""
+        with self._lock:
+            if len(self._subscribers) >= self.max_subscribers:
+                self.rejected += 1
+                raise SubscriberLimitReached(f"{self.max_subscribers} subscribers already connected")
+            subscription = Subscription(self.queue_size)
+            self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def publish(self, name, data):
+        """Deliver one event to all current subscribers (never blocks)"""
+        with self._lock:
+            event = (next(self._sequence), name, data)
+            subscribers = list(self._subscribers)
+            self.published += 1
+        for subscription in subscribers:
+            subscription.push(event)
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                'subscribers': len(self._subscribers),
+                'published': self.published,
+                'rejected': self.rejected,
+                'dropped': sum(subscription.dropped for subscription in self._subscribers),
+            }
+
+
+bus = EventBus(settings.EVENT_STREAM['MAX_CONNECTIONS'], settings.EVENT_STREAM['QUEUE_SIZE'])
+
+
+def publish_readings(documents):
+    """Ingestion callback: push each reading written to MongoDB to the dashboards"""
+    for document in documents:
+        bus.publish('reading', document)
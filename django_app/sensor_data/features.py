@@ -0,0 +1,288 @@
+"""
+Vectorized feature engineering for the training exports
+
+``FeaturePipeline.compute`` turns one columnar page of raw readings
+(chronological, any mix of devices) into feature columns with numpy instead of
+a Python loop per reading. A columnar page holds epoch milliseconds, one
+float64 array per field and the device of each reading as an integer code: the
+export decodes it straight from the BSON batches with ``bson_arrays`` when
+pymongoarrow is installed, ``page_arrays`` builds it from cursor dicts
+otherwise (``FeaturePipeline.columns``). Calendar features and ratios are array
+expressions; temporal features come from a single pass over the page grouped
+by device, with prefix sums and binary searches:
+
+- ``humidity_soil_mean_{h}h``: mean soil humidity over (t - h, t]
+- ``humidity_soil_lag_{k}`` / ``humidity_soil_delta_{k}``: soil humidity k
+  readings earlier, and the change since then
+- ``rain_sum_{h}h``: cumulative rain forecast over (t - h, t]
+- ``hours_since_rain``: hours since the last reading with a rain forecast
+
+No feature looks back further than ``LOOKBACK_HOURS``: older lags and rains
+are left empty (NaN). Between pages the pipeline keeps, for each device, only
+what the next readings can still use: the longest window, the last
+``max(LAGS)`` readings and the last rainy reading. ``prime()`` feeds the
+horizon that precedes an export range: a range exported on its own gets the
+same features as inside a longer export.
+"""
+
+import itertools
+from datetime import datetime, timedelta
+from operator import itemgetter
+
+import numpy as np
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    from pymongoarrow.api import Schema
+    from pymongoarrow.context import PyMongoArrowContext
+except ImportError:  # décodage en colonnes des lots BSON optionnel (repli sur page_arrays)
+    pa = pc = Schema = PyMongoArrowContext = None
+
+ROLLING_HOURS = (3, 6, 24)
+LAGS = (1, 3, 24)
+RAIN_HOURS = (6, 24)
+LOOKBACK_HOURS = 168
+
+FLOAT_FIELDS = ('temperature', 'humidity_air', 'rain_forecast', 'humidity_soil')
+
+HOUR_MS = 3600 * 1000
+DAY_MS = 24 * HOUR_MS
+LOOKBACK_MS = LOOKBACK_HOURS * HOUR_MS
+WINDOW_MS = max(ROLLING_HOURS + RAIN_HOURS) * HOUR_MS
+# Sommes glissantes en millionièmes entiers : exactes, donc identiques quel que soit le découpage en pages
+MICRO = 1_000_000
+EPOCH = datetime(1970, 1, 1)
+
+# Saison (hémisphère nord) de chaque mois, indexée par mois - 1
+SEASON_OF_MONTH = np.array(['winter', 'winter', 'spring', 'spring', 'spring', 'summer', 'summer', 'summer',
+                            'autumn', 'autumn', 'autumn', 'winter'], dtype=object)
+
+BASE_COLUMNS = [
+    'timestamp',
+    'temperature',
+    'humidity_air',
+    'rain_forecast',
+    'humidity_soil',
+    'hour_of_day',
+    'day_of_week',
+    'month',
+    'temperature_humidity_air_ratio',
+    'soil_air_humidity_diff',
+    'is_rain_predicted',
+    'season'
+]
+
+TEMPORAL_COLUMNS = ([f'humidity_soil_mean_{hours}h' for hours in ROLLING_HOURS]
+                    + [f'humidity_soil_lag_{lag}' for lag in LAGS]
+                    + [f'humidity_soil_delta_{lag}' for lag in LAGS]
+                    + [f'rain_sum_{hours}h' for hours in RAIN_HOURS]
+                    + ['hours_since_rain'])
+
+# device_id en dernier : les colonnes des CSV existants gardent leur position
+FEATURE_COLUMNS = BASE_COLUMNS + TEMPORAL_COLUMNS + ['device_id']
+
+# Champs des lots BSON décodés en colonnes (horodatages BSON : millisecondes UTC)
+BSON_SCHEMA = Schema(dict({'timestamp': pa.timestamp('ms'), 'device_id': pa.string()},
+                          **dict.fromkeys(FLOAT_FIELDS, pa.float64()))) if Schema is not None else None
+
+
+def epoch_ms(timestamps):
+    """int64 epoch milliseconds of naive UTC datetimes"""
+    # datetime64 depuis des objets datetime est très lent : passage par les timedelta
+    deltas = np.array(timestamps, dtype=object) - EPOCH
+    seconds = np.fromiter(map(timedelta.total_seconds, deltas), dtype=np.float64, count=len(timestamps))
+    return np.rint(seconds * 1000).astype(np.int64)
+
+
+def float_column(page, field):
+    return np.fromiter(map(itemgetter(field), page), dtype=np.float64, count=len(page))
+
+
+def device_codes(devices):
+    """(device names in order of appearance, code of each reading's device in that list)"""
+    names = list(dict.fromkeys(devices))
+    if len(names) == 1:
+        return names, np.zeros(len(devices), dtype=np.int64)
+    codes = {device: code for code, device in enumerate(names)}
+    return names, np.fromiter(map(codes.__getitem__, devices), dtype=np.int64, count=len(devices))
+
+
+def page_arrays(page):
+    """Columnar page of a list of raw readings: epoch ms, float64 arrays, device names and codes"""
+    arrays = {field: float_column(page, field) for field in FLOAT_FIELDS}
+    names, codes = device_codes([record.get('device_id') or 'default' for record in page])
+    arrays.update(ms=epoch_ms([record['timestamp'] for record in page]), devices=names, device_codes=codes)
+    return arrays
+
+
+def bson_arrays(batch):
+    """Columnar page of a raw BSON batch (see page_arrays()), decoded field by field by pymongoarrow"""
+    context = PyMongoArrowContext(BSON_SCHEMA)
+    context.process_bson_stream(batch)
+    table = context.finish()
+    # Appareils codés dans l'ordre d'apparition, comme page_arrays()
+    devices = pc.fill_null(table['device_id'], 'default').combine_chunks().dictionary_encode()
+    arrays = {field: table[field].to_numpy() for field in FLOAT_FIELDS}
+    arrays.update(ms=table['timestamp'].cast(pa.int64()).to_numpy(), devices=devices.dictionary.to_pylist(),
+                  device_codes=devices.indices.to_numpy())
+    return arrays
+
+
+class FeaturePipeline:
+    """Feature columns of successive chronological pages, with per-device history between pages"""
+
+    def __init__(self):
+        # Appareil -> (ms, humidité du sol, pluie) des lectures de l'horizon
+        self._history = {}
+
+    def _by_device(self, names, codes, ms, soil, rain):
+        """Page readings behind each device's history, grouped by device
+
+        Returns (ms, soil, rain, readings per device, sorted position of each
+        page reading): one contiguous chronological segment per device (in
+        code order), its history first.
+        """
+        count = len(ms)
+        # Horizon des appareils de la page placé devant leurs lectures : calculé avec elles, puis écarté
+        history = [(code, self._history[name]) for code, name in enumerate(names) if name in self._history]
+        if history:
+            codes = np.concatenate([np.full(len(past[0]), code) for code, past in history] + [codes])
+            ms = np.concatenate([past[0] for _, past in history] + [ms])
+            soil = np.concatenate([past[1] for _, past in history] + [soil])
+            rain = np.concatenate([past[2] for _, past in history] + [rain])
+        offset = len(ms) - count
+        counts = np.bincount(codes, minlength=len(names))
+        if len(names) == 1:
+            return ms, soil, rain, counts, np.arange(offset, len(ms))
+
+        # Horizon et page chronologiques : un tri stable sur le seul code (tri par base sur 16 bits)
+        # donne un segment contigu et chronologique par appareil, l'horizon devant la page
+        small = np.int16 if len(names) <= np.iinfo(np.int16).max else np.int64
+        order = np.argsort(codes.astype(small), kind='stable')
+        sorted_position = np.empty_like(order)
+        sorted_position[order] = np.arange(len(order))
+        return ms[order], soil[order], rain[order], counts, sorted_position[offset:]
+
+    def _temporal(self, names, codes, ms, soil, rain):
+        """TEMPORAL_COLUMNS rows of the page (page order), every device at once, then keep their horizon"""
+        page_soil = soil
+        ms, soil, rain, counts, sorted_position = self._by_device(names, codes, ms, soil, rain)
+        ends = np.cumsum(counts)
+        begins = ends - counts
+        segments = list(zip(begins, ends))
+
+        # Sommes par préfixes cumulés ; lectures jusqu'à chacune (incluse) dans l'ordre trié
+        soil_sums = np.zeros(len(ms) + 1, dtype=np.int64)
+        rain_sums = np.zeros(len(ms) + 1, dtype=np.int64)
+        np.cumsum(np.rint(soil * MICRO).astype(np.int64), out=soil_sums[1:])
+        np.cumsum(np.rint(rain * MICRO).astype(np.int64), out=rain_sums[1:])
+        upto = np.arange(1, len(ms) + 1)
+
+        # Lignes calculées une à une dans l'ordre trié (une seule ligne de travail, peu de mémoire fraîche
+        # par page), chacune remise aussitôt dans l'ordre de la page ; deltas ensuite
+        temporal = np.empty((len(TEMPORAL_COLUMNS), len(page_soil)))
+        row = np.empty(len(ms))
+        lengths = np.empty(len(ms), dtype=np.int64)
+
+        def place(name):
+            np.take(row, sorted_position, out=temporal[TEMPORAL_COLUMNS.index(name)])
+
+        for hours in sorted(set(ROLLING_HOURS + RAIN_HOURS)):
+            # Fenêtre (t - h, t] de chaque lecture : [first, position], recherche binaire dans le segment
+            # de son appareil (petit tableau, reste en cache)
+            first = np.empty(len(ms), dtype=np.intp)
+            for begin, end in segments:
+                times = ms[begin:end]
+                first[begin:end] = begin + np.searchsorted(times, times - hours * HOUR_MS, side='right')
+            if hours in ROLLING_HOURS:
+                np.subtract(upto, first, out=lengths)
+                lengths *= MICRO
+                np.subtract(soil_sums[1:], soil_sums[first], out=row)
+                np.divide(row, lengths, out=row)
+                place(f'humidity_soil_mean_{hours}h')
+            if hours in RAIN_HOURS:
+                np.subtract(rain_sums[1:], rain_sums[first], out=row)
+                row /= MICRO
+                place(f'rain_sum_{hours}h')
+        for lag in LAGS:
+            row[:lag] = np.nan
+            row[lag:] = soil[:-lag]
+            # Lecture décalée hors de l'horizon (valeur inconnue pour un export partiel) ou d'un autre appareil : vide
+            np.copyto(row[lag:], np.nan, where=ms[lag:] - ms[:-lag] > LOOKBACK_MS)
+            for begin in begins:
+                row[begin:begin + lag] = np.nan
+            place(f'humidity_soil_lag_{lag}')
+        # Position de la dernière lecture avec pluie (-1 : aucune)
+        last_rain = np.maximum.accumulate((rain > 0) * upto) - 1
+        np.divide(ms - ms[np.maximum(last_rain, 0)], HOUR_MS, out=row)
+        np.copyto(row, np.nan, where=(last_rain < np.repeat(begins, counts)) | (row > LOOKBACK_HOURS))
+        place('hours_since_rain')
+
+        # Historique de chaque appareil pour les pages suivantes : lectures de la plus longue fenêtre,
+        # max(LAGS) dernières lectures et dernière pluie de l'horizon (indices : copie des valeurs)
+        for code, (begin, end) in enumerate(segments):
+            keep = begin + np.searchsorted(ms[begin:end], ms[end - 1] - WINDOW_MS, side='right')
+            kept = np.arange(max(begin, min(keep, end - max(LAGS))), end)
+            rained = last_rain[end - 1]
+            if begin <= rained < kept[0] and ms[end - 1] - ms[rained] <= LOOKBACK_MS:
+                kept = np.insert(kept, 0, rained)
+            self._history[names[code]] = (ms[kept], soil[kept], rain[kept])
+
+        windows = len(ROLLING_HOURS) + len(LAGS)
+        np.subtract(page_soil, temporal[len(ROLLING_HOURS):windows], out=temporal[windows:windows + len(LAGS)])
+        # Arrondi au centième, sauf les décalages : humidités du sol telles que mesurées
+        for block in (temporal[:len(ROLLING_HOURS)], temporal[windows:]):
+            np.round(block, 2, out=block)
+        return temporal
+
+    def columns(self, page):
+        """Columns of FEATURE_COLUMNS for a list of raw readings in chronological order"""
+        return self.compute(page_arrays(page))
+
+    def compute(self, arrays):
+        """Columns of FEATURE_COLUMNS from a columnar page (see page_arrays())
+
+        Every column is a numpy array: datetime64[ms] timestamps, device names
+        (object), and NaN where a temporal feature is unknown.
+        """
+        ms = arrays['ms']
+        temperature = arrays['temperature']
+        humidity_air = arrays['humidity_air']
+        rain_forecast = arrays['rain_forecast']
+        humidity_soil = arrays['humidity_soil']
+        names, codes = arrays['devices'], arrays['device_codes']
+
+        temporal = self._temporal(names, codes, ms, humidity_soil, rain_forecast)
+
+        days = ms // DAY_MS
+        hour_of_day = ((ms - days * DAY_MS) // HOUR_MS).astype(np.int8)
+        # 1970-01-01 était un jeudi
+        day_of_week = ((days + 3) % 7).astype(np.int8)
+        # Mois (0 à 11) de chaque jour couvert par la page : conversion calendaire sur les seuls jours distincts
+        first_day = days.min()
+        day_months = np.arange(first_day, days.max() + 1).astype('datetime64[D]').astype('datetime64[M]')
+        month_index = (day_months.astype(np.int64) % 12).astype(np.int8)[days - first_day]
+
+        return [
+            ms.view('datetime64[ms]'),
+            temperature,
+            humidity_air,
+            rain_forecast,
+            humidity_soil,
+            hour_of_day,
+            day_of_week,
+            month_index + 1,
+            np.round(temperature / np.maximum(humidity_air, 1), 2),
+            np.round(humidity_soil - humidity_air, 2),
+            (rain_forecast > 0).astype(np.int8),
+            SEASON_OF_MONTH[month_index],
+        ] + list(temporal) + [np.array(names, dtype=object)[codes]]
+
+    def prime(self, records, batch_size):
+        """Feed the readings preceding the export range: they only fill the device histories"""
+        while True:
+            page = list(itertools.islice(records, batch_size))
+            if not page:
+                break
+            self.columns(page)
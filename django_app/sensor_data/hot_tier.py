@@ -0,0 +1,303 @@
+"""
+In-process hot tier: the most recent readings of each device in memory
+
+One ``DeviceRing`` per device stores the readings of the last
+``HOT_TIER['HOURS']`` hours in fixed-size typed arrays (``array``: 8 bytes
+per float column, no Python object per reading), oldest evicted first. The
+ingestion running in this process appends every reading it writes to
+MongoDB, and ``warm()`` loads the recent readings from MongoDB when the
+handler starts. Until then, or when ingestion runs in other processes, the
+hot tier stays inactive and every read goes to MongoDB.
+
+A window is served from memory only when it is fully covered: it must start
+after the warm-up horizon, after the newest reading evicted for lack of
+room and after any late reading that arrived out of order (a spool replay),
+since those are not stored. Otherwise the caller falls back to MongoDB.
+"""
+
+import logging
+import threading
+from array import array
+from datetime import datetime, timedelta, timezone
+
+from django.conf import settings
+
+from .models import SensorData
+
+logger = logging.getLogger(__name__)
+
+FLOAT_FIELDS = ('temperature', 'humidity_air', 'rain_forecast', 'humidity_soil')
+# Octets par lecture : horodatage et champs en float64, sample_count, weather_stale
+SLOT_BYTES = 8 * (1 + len(FLOAT_FIELDS)) + array('l').itemsize + 1
+
+
+def to_epoch(timestamp):
+    return timestamp.replace(tzinfo=timezone.utc).timestamp()
+
+
+def from_epoch(seconds):
+    return datetime.utcfromtimestamp(seconds)
+
+
+class DeviceRing:
+    """Fixed-capacity ring of one device's readings, in timestamp order"""
+
+    __slots__ = ('capacity', 'timestamps', 'values', 'sample_counts', 'stale', 'start', 'size',
+                 'evicted_until', 'late_until')
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.timestamps = array('d', bytes(8 * capacity))
+        self.values = {field: array('d', bytes(8 * capacity)) for field in FLOAT_FIELDS}
+        self.sample_counts = array('l', bytes(array('l').itemsize * capacity))
+        self.stale = array('b', bytes(capacity))
+        self.start = 0
+        self.size = 0
+        # Horodatage de la lecture évincée / arrivée en retard la plus récente : non couvert jusque-là
+        self.evicted_until = None
+        self.late_until = None
+
+    def _slot(self, index):
+        return (self.start + index) % self.capacity
+
+    def _store(self, slot, seconds, document):
+        self.timestamps[slot] = seconds
+        for field, column in self.values.items():
+            column[slot] = document[field]
+        self.sample_counts[slot] = document.get('sample_count') or 1
+        self.stale[slot] = bool(document.get('weather_stale'))
+
+    def _find(self, seconds):
+        """Logical index of the reading at ``seconds``, or None"""
+        low, high = 0, self.size
+        while low < high:
+            middle = (low + high) // 2
+            if self.timestamps[self._slot(middle)] < seconds:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.size and self.timestamps[self._slot(low)] == seconds:
+            return low
+        return None
+
+    def add(self, document):
+        seconds = to_epoch(document['timestamp'])
+        newest = self.newest()
+        if newest is not None and seconds <= newest:
+            index = self._find(seconds)
+            if index is not None:
+                # Même lecture réécrite (rejeu du spool) : remplacement, pas de doublon
+                self._store(self._slot(index), seconds, document)
+            else:
+                self.late_until = max(self.late_until or seconds, seconds)
+            return
+        if self.size == self.capacity:
+            self.evicted_until = self.timestamps[self.start]
+            self.start = (self.start + 1) % self.capacity
+            self.size -= 1
+        self._store(self._slot(self.size), seconds, document)
+        self.size += 1
+
+    def newest(self):
+        return self.timestamps[self._slot(self.size - 1)] if self.size else None
+
+    def covers(self, seconds):
+        """Whether every reading of the device from ``seconds`` on is in the ring"""
+        return ((self.evicted_until is None or seconds > self.evicted_until)
+                and (self.late_until is None or seconds > self.late_until))
+
+    def slots(self, since, until):
+        """Slots of the readings in [since, until], newest first"""
+        for index in range(self.size - 1, -1, -1):
+            slot = self._slot(index)
+            seconds = self.timestamps[slot]
+            if seconds < since:
+                break
+            if seconds <= until:
+                yield slot
+
+    def document(self, slot, device_id):
+        document = {field: column[slot] for field, column in self.values.items()}
+        document.update(device_id=device_id, timestamp=from_epoch(self.timestamps[slot]),
+                        sample_count=self.sample_counts[slot], weather_stale=bool(self.stale[slot]))
+        return document
+
+    def nbytes(self):
+        return self.capacity * SLOT_BYTES
+
+
+class HotTier:
+    """Per-device rings of the last ``hours`` hours, shared by the request threads"""
+
+    def __init__(self, hours, capacity, max_devices):
+        self.hours = hours
+        self.capacity = capacity
+        self.max_devices = max_devices
+        self._rings = {}
+        self._lock = threading.Lock()
+        self.active = False
+        self.horizon = None
+        # Appareils refusés (MAX_DEVICES atteint) : plus aucune requête multi-appareils en mémoire
+        self.saturated = False
+        self._stats = {'served': 0, 'fallbacks': 0, 'readings_added': 0, 'late_readings': 0}
+
+    def warm(self):
+        """Load the readings of the last ``hours`` hours from MongoDB, then accept reads"""
+        since = datetime.utcnow() - timedelta(hours=self.hours)
+        fields = ('device_id', 'timestamp', 'sample_count', 'weather_stale') + FLOAT_FIELDS
+        projection = dict.fromkeys(fields, 1)
+        projection['_id'] = 0
+        cursor = SensorData._get_collection().find(SensorData._range_query(since, None, None), projection,
+                                                   sort=[('timestamp', 1)],
+                                                   batch_size=settings.SENSOR_STORAGE['READ_BATCH_SIZE'])
+        with self._lock:
+            self._rings = {}
+            self.saturated = False
+            self.horizon = to_epoch(since)
+            for document in cursor:
+                self._add(document)
+            self.active = True
+            devices, readings = len(self._rings), sum(ring.size for ring in self._rings.values())
+        logger.info(f"Hot tier warmed with {readings} readings of {devices} devices")
+
+    def _add(self, document):
+        device_id = document.get('device_id') or 'default'
+        ring = self._rings.get(device_id)
+        if ring is None:
+            if len(self._rings) >= self.max_devices:
+                self.saturated = True
+                return
+            ring = self._rings[device_id] = DeviceRing(self.capacity)
+        late = ring.late_until
+        ring.add(document)
+        if ring.late_until != late:
+            self._stats['late_readings'] += 1
+        self._stats['readings_added'] += 1
+
+    def add(self, documents):
+        """Ingestion callback: readings just written to MongoDB"""
+        with self._lock:
+            if not self.active:
+                return
+            for document in documents:
+                self._add(document)
+
+    def _rings_for(self, device_id):
+        """[(device_id, ring)] answering for ``device_id`` (all devices if None), or None if not servable"""
+        if not self.active:
+            return None
+        if device_id:
+            ring = self._rings.get(device_id)
+            if ring is None:
+                # Appareil sans lecture récente, sauf s'il a été refusé faute de place
+                return None if self.saturated else []
+            return [(device_id, ring)]
+        return None if self.saturated else list(self._rings.items())
+
+    def _covered(self, rings, start):
+        if rings is None:
+            return False
+        seconds = to_epoch(start)
+        return seconds >= self.horizon and all(ring.covers(seconds) for _, ring in rings)
+
+    def latest(self, device_id=None):
+        """Newest reading as a raw-like document, None when it must be read from MongoDB"""
+        with self._lock:
+            rings = self._rings_for(device_id)
+            if not rings:
+                return None
+            device, ring = max((item for item in rings if item[1].size), key=lambda item: item[1].newest(),
+                               default=(None, None))
+            if ring is None:
+                return None
+            self._stats['served'] += 1
+            return ring.document(ring._slot(ring.size - 1), device)
+
+    def _documents(self, rings, start, end):
+        """Documents of the window, newest first, all rings merged"""
+        since, until = to_epoch(start), to_epoch(end)
+        merged = [(ring.timestamps[slot], device, ring, slot)
+                  for device, ring in rings for slot in ring.slots(since, until)]
+        if len(rings) > 1:
+            merged.sort(key=lambda item: item[0], reverse=True)
+        return merged
+
+    def columns(self, start, end, device_id=None, fields=('timestamp',) + FLOAT_FIELDS):
+        """raw_columns() of the window from memory, None when the window is not covered"""
+        with self._lock:
+            rings = self._rings_for(device_id)
+            if not self._covered(rings, start):
+                self._stats['fallbacks'] += 1
+                return None
+            self._stats['served'] += 1
+            merged = self._documents(rings, start, end)
+            columns = {}
+            for field in fields:
+                if field == 'timestamp':
+                    columns[field] = [from_epoch(seconds) for seconds, _, _, _ in merged]
+                elif field == 'device_id':
+                    columns[field] = [device for _, device, _, _ in merged]
+                else:
+                    columns[field] = [ring.values[field][slot] for _, _, ring, slot in merged]
+            return columns
+
+    def statistics(self, start, end, device_id=None):
+        """window_statistics() computed from memory, None when not covered or empty"""
+        with self._lock:
+            rings = self._rings_for(device_id)
+            if not self._covered(rings, start):
+                self._stats['fallbacks'] += 1
+                return None
+            self._stats['served'] += 1
+            merged = self._documents(rings, start, end)
+            if not merged:
+                return None
+            _, device, ring, slot = merged[0]
+            result = {'count': len(merged), 'latest': ring.document(slot, device), 'source': 'hot_tier'}
+            for field in FLOAT_FIELDS:
+                values = [ring.values[field][slot] for _, _, ring, slot in merged]
+                total = sum(values)
+                result[field] = {'avg': total / len(values), 'min': min(values), 'max': max(values), 'sum': total}
+            return result
+
+    def state(self, start, end, device_id=None):
+        """(newest timestamp, count) of the window for the HTTP validators, None when not covered"""
+        with self._lock:
+            rings = self._rings_for(device_id)
+            if start is None:
+                # Fenêtre ouverte (realtime) : seule la lecture la plus récente compte
+                if not rings or not any(ring.size for _, ring in rings):
+                    return None
+                newest = max(ring.newest() for _, ring in rings if ring.size)
+                return from_epoch(newest), sum(ring.size for _, ring in rings)
+            if not self._covered(rings, start):
+                return None
+            since, until = to_epoch(start), to_epoch(end)
+            newest, count = None, 0
+            for _, ring in rings:
+                for slot in ring.slots(since, until):
+                    seconds = ring.timestamps[slot]
+                    newest = seconds if newest is None else max(newest, seconds)
+                    count += 1
+            return (from_epoch(newest) if newest is not None else None), count
+
+    def get_stats(self):
+        with self._lock:
+            rings = self._rings.values()
+            return dict(
+                self._stats,
+                active=self.active,
+                saturated=self.saturated,
+                hours=self.hours,
+                devices=len(self._rings),
+                max_devices=self.max_devices,
+                readings=sum(ring.size for ring in rings),
+                capacity_per_device=self.capacity,
+                memory_bytes=sum(ring.nbytes() for ring in rings),
+                # Empreinte maximale : MAX_DEVICES anneaux pleins
+                memory_limit_bytes=self.max_devices * self.capacity * SLOT_BYTES,
+            )
+
+
+_settings = settings.HOT_TIER
+hot_tier = HotTier(_settings['HOURS'], _settings['CAPACITY'], _settings['MAX_DEVICES'])
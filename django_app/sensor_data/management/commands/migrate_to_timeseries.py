@@ -0,0 +1,79 @@
+"""
+Copie la collection classique des lectures vers la collection time-series
+
+    python manage.py migrate_to_timeseries --batch-size 5000
+
+La copie se fait par lots (tri timestamp, _id) et reprend après le dernier
+timestamp déjà présent dans la cible : la commande peut être relancée après
+une interruption sans dupliquer ni perdre de lectures. Une fois la copie
+terminée, activer le backend avec SENSOR_STORAGE_BACKEND=timeseries.
+"""
+
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from mongoengine.connection import get_db
+
+from sensor_data.models import ensure_timeseries_collection
+from mqtt_handler.writes import insert_skipping_existing, is_timeseries
+
+
+class Command(BaseCommand):
+    help = "Migre les lectures vers une collection time-series MongoDB, par lots"
+
+    def add_arguments(self, parser):
+        storage = settings.SENSOR_STORAGE
+        parser.add_argument('--source', default=storage['COLLECTION'], help='Collection classique à copier')
+        parser.add_argument('--target', default=storage['TIMESERIES_COLLECTION'], help='Collection time-series cible')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Documents par insertion groupée')
+        parser.add_argument('--location', default=settings.OPENWEATHER_SETTINGS['CITY'],
+                            help="Localisation des lectures qui n'en ont pas")
+
+    def handle(self, *args, **options):
+        db = get_db()
+        source = db[options['source']]
+        target = db[options['target']]
+        batch_size = options['batch_size']
+
+        if ensure_timeseries_collection(db, options['target']):
+            self.stdout.write(f"Collection time-series '{options['target']}' créée "
+                              f"(granularité {settings.SENSOR_STORAGE['TIMESERIES_GRANULARITY']})")
+        elif not is_timeseries(target):
+            raise CommandError(f"'{options['target']}' existe déjà et n'est pas une collection time-series")
+
+        # Reprise : le dernier timestamp copié peut n'avoir été que partiellement écrit,
+        # on repart de lui et les _id déjà présents sont ignorés
+        query = {'timestamp': {'$ne': None}}
+        last = target.find_one({}, {'timestamp': 1}, sort=[('timestamp', -1)])
+        if last is not None:
+            query = {'timestamp': {'$gte': last['timestamp']}}
+            self.stdout.write(f"Reprise à partir de {last['timestamp'].isoformat()}")
+
+        total = source.count_documents(query)
+        self.stdout.write(f"{total} documents à copier de '{options['source']}' vers '{options['target']}'")
+
+        started = time.perf_counter()
+        copied = inserted = 0
+        batch = []
+        cursor = source.find(query).sort([('timestamp', 1), ('_id', 1)]).batch_size(batch_size)
+        for document in cursor:
+            if not document.get('metadata'):
+                document['metadata'] = {'device_id': document.get('device_id', 'default'),
+                                        'location': options['location']}
+            batch.append(document)
+            if len(batch) >= batch_size:
+                inserted += insert_skipping_existing(target, batch)
+                copied += len(batch)
+                batch = []
+                elapsed = time.perf_counter() - started
+                self.stdout.write(f"  {copied}/{total} ({copied / elapsed:,.0f} docs/s)")
+        if batch:
+            inserted += insert_skipping_existing(target, batch)
+            copied += len(batch)
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"{copied} documents lus, {inserted} insérés en {elapsed:.1f}s. "
+            f"Activer le backend : SENSOR_STORAGE_BACKEND=timeseries"
+        ))
@@ -0,0 +1,67 @@
+"""
+Reconstruit les rollups minute/heure/jour depuis les lectures brutes
+
+    python manage.py rebuild_rollups                                  # toute la période
+    python manage.py rebuild_rollups --start 2024-01-01 --end 2024-02-01 --resolution hour
+
+À lancer après la première activation des rollups, un backfill du spool ou
+toute modification des lectures brutes hors ingestion.
+"""
+
+import time
+from datetime import datetime, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+
+from sensor_data.models import SensorData
+from sensor_data.rollups import RESOLUTIONS, bucket_start, enabled_resolutions, rebuild_rollups
+from sensor_data.api_cache import bump_generation
+
+
+def parse_date(value):
+    try:
+        return datetime.fromisoformat(value.replace('Z', '+00:00')).replace(tzinfo=None)
+    except ValueError:
+        raise CommandError(f"Date invalide : {value}")
+
+
+class Command(BaseCommand):
+    help = "Reconstruit les rollups des lectures pour une plage de temps"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', help='Début (ISO 8601, défaut : première lecture)')
+        parser.add_argument('--end', help='Fin exclue (ISO 8601, défaut : après la dernière lecture)')
+        parser.add_argument('--device', help='Limiter à un appareil')
+        parser.add_argument('--resolution', action='append', choices=list(RESOLUTIONS),
+                            help='Résolution à reconstruire (répétable, défaut : toutes celles configurées)')
+        parser.add_argument('--chunk-days', type=int, default=30, help='Taille des tranches traitées (jours)')
+
+    def handle(self, *args, **options):
+        raw = SensorData._get_collection()
+        first = raw.find_one({}, {'timestamp': 1}, sort=[('timestamp', 1)])
+        last = raw.find_one({}, {'timestamp': 1}, sort=[('timestamp', -1)])
+        if first is None:
+            self.stdout.write("Aucune lecture : rien à reconstruire")
+            return
+
+        # Tranches alignées sur le jour : chaque bucket n'est recalculé qu'une fois
+        start = bucket_start(parse_date(options['start']) if options['start'] else first['timestamp'], 'day')
+        end = parse_date(options['end']) if options['end'] else last['timestamp'] + timedelta(seconds=1)
+        resolutions = options['resolution'] or enabled_resolutions()
+        chunk = timedelta(days=options['chunk_days'])
+
+        started = time.perf_counter()
+        totals = dict.fromkeys(resolutions, 0)
+        cursor = start
+        while cursor < end:
+            upper = min(cursor + chunk, end)
+            for resolution, count in rebuild_rollups(cursor, upper, options['device'], resolutions).items():
+                totals[resolution] += count
+            self.stdout.write(f"  {cursor.isoformat()} -> {upper.isoformat()}")
+            cursor = upper
+
+        # Les graphiques et statistiques en cache lisaient les anciens buckets
+        bump_generation()
+        elapsed = time.perf_counter() - started
+        summary = ', '.join(f"{resolution}: {count}" for resolution, count in totals.items())
+        self.stdout.write(self.style.SUCCESS(f"Rollups reconstruits en {elapsed:.1f}s ({summary} buckets)"))
@@ -1,42 +1,233 @@
-from mongoengine import Document, FloatField, DateTimeField, StringField
+from mongoengine import Document, FloatField, DateTimeField, StringField, BooleanField, IntField, DictField
+from pymongo.errors import CollectionInvalid
 from datetime import datetime
+from django.conf import settings
+
+STORAGE = settings.SENSOR_STORAGE
+TIMESERIES = STORAGE['BACKEND'] == 'timeseries'
+
+# Champ appareil des lectures brutes (metaField en time-series)
+DEVICE_FIELD = 'metadata.device_id' if TIMESERIES else 'device_id'
+
+# Champs renvoyés par les API de lecture (ceux de to_dict)
+API_FIELDS = ('device_id', 'timestamp', 'temperature', 'humidity_air', 'rain_forecast', 'humidity_soil',
+              'weather_stale', 'sample_count')
+
+
+def ensure_timeseries_collection(db, name):
+    """Create ``name`` as a time-series collection unless it already exists, returns True if created"""
+    if db.list_collection_names(filter={'name': name}):
+        return False
+    try:
+        db.create_collection(name, timeseries={
+            'timeField': 'timestamp',
+            'metaField': 'metadata',
+            'granularity': STORAGE['TIMESERIES_GRANULARITY'],
+        })
+    except CollectionInvalid:
+        # Créée entre-temps par un autre processus
+        return False
+    return True
+
 
 class SensorData(Document):
     """
     MongoDB document for storing ESP32 and weather sensor data
     """
+    device_id = StringField(default='default', max_length=64, help_text="ESP32 device identifier")
     timestamp = DateTimeField(default=datetime.utcnow, required=True)
     temperature = FloatField(required=True, help_text="Temperature in Celsius from OpenWeather API")
     humidity_air = FloatField(required=True, help_text="Air humidity percentage from OpenWeather API")
     rain_forecast = FloatField(required=True, help_text="Rain forecast in mm from OpenWeather API")
-    humidity_soil = FloatField(required=True, help_text="Soil humidity percentage from ESP32 sensor")
+    humidity_soil = FloatField(required=True, help_text="Soil humidity percentage from ESP32 sensor (hourly mean)")
+    humidity_soil_min = FloatField(help_text="Minimum soil humidity received during the hour")
+    humidity_soil_max = FloatField(help_text="Maximum soil humidity received during the hour")
+    humidity_soil_last = FloatField(help_text="Last soil humidity received during the hour")
+    last_sample_at = DateTimeField(help_text="Reception time of the last ESP32 reading of the hour")
+    sample_count = IntField(default=1, help_text="Number of ESP32 readings folded into this document")
+    wifi_rssi = IntField(help_text="WiFi signal strength (dBm) reported by the ESP32 in its last reading")
+    uptime_ms = IntField(help_text="ESP32 uptime in milliseconds at its last reading")
+    weather_stale = BooleanField(default=False, help_text="Weather values served from an expired cache entry")
+    partials = DictField(help_text="Per-consumer partial buckets merged into this hour (shared subscriptions)")
+    metadata = DictField(help_text="device_id and location, the metaField of the time-series backend")
     
     meta = {
-        'collection': 'sensor_readings',
-        'indexes': ['timestamp'],
+        'collection': STORAGE['TIMESERIES_COLLECTION'] if TIMESERIES else STORAGE['COLLECTION'],
+        # (timestamp, _id) : ordre total de la pagination par clé (keyset_readings). En time-series, déclaré
+        # explicitement (index secondaire sur les buckets, MongoDB >= 6.0) : il borne les buckets lus par page
+        'indexes': ['timestamp', ('metadata.device_id', '-timestamp'), ('-timestamp', '-id'),
+                    ('metadata.device_id', '-timestamp', '-id')] if TIMESERIES else
+                   ['timestamp', ('-timestamp', '-id'), ('device_id', '-timestamp', '-id')],
         'ordering': ['-timestamp']
     }
     
+    def clean(self):
+        """Fill the time-series metaField when the document was built without it"""
+        if not self.metadata:
+            self.metadata = {'device_id': self.device_id, 'location': settings.OPENWEATHER_SETTINGS['CITY']}
+    
     def __str__(self):
         return f"SensorData({self.timestamp.strftime('%Y-%m-%d %H:%M:%S')} - Soil: {self.humidity_soil}%, Air: {self.humidity_air}%, Temp: {self.temperature}°C)"
     
     def to_dict(self):
         """Convert document to dictionary for JSON serialization"""
         return {
+            'device_id': self.device_id,
             'timestamp': self.timestamp.isoformat(),
             'temperature': float(self.temperature),
             'humidity_air': float(self.humidity_air),
             'rain_forecast': float(self.rain_forecast),
-            'humidity_soil': float(self.humidity_soil)
+            'humidity_soil': float(self.humidity_soil),
+            'weather_stale': bool(self.weather_stale),
+            'sample_count': self.sample_count
         }
     
+    @staticmethod
+    def raw_to_dict(document):
+        """to_dict() for a raw document returned by raw_readings()"""
+        return {
+            'device_id': document.get('device_id', 'default'),
+            'timestamp': document['timestamp'].isoformat(),
+            'temperature': float(document['temperature']),
+            'humidity_air': float(document['humidity_air']),
+            'rain_forecast': float(document['rain_forecast']),
+            'humidity_soil': float(document['humidity_soil']),
+            'weather_stale': bool(document.get('weather_stale', False)),
+            'sample_count': document.get('sample_count', 1)
+        }
+    
+    @classmethod
+    def _get_collection(cls):
+        # Une insertion dans une collection inexistante créerait une collection classique
+        if TIMESERIES and cls._collection is None:
+            ensure_timeseries_collection(cls._get_db(), cls._get_collection_name())
+        return super()._get_collection()
+    
+    @classmethod
+    def for_device(cls, device_id=None):
+        """Queryset restricted to one device (uses the (device_id, timestamp) index)"""
+        if device_id:
+            # En time-series, filtrer sur le metaField permet d'écarter des buckets entiers
+            if TIMESERIES:
+                return cls.objects.filter(metadata__device_id=device_id)
+            return cls.objects.filter(device_id=device_id)
+        return cls.objects
+    
     @classmethod
-    def get_latest_readings(cls, limit=10):
-        """Get the latest sensor readings"""
-        return cls.objects.order_by('-timestamp')[:limit]
+    def get_latest_readings(cls, limit=10, device_id=None):
+        """Get the latest sensor readings, optionally for a single device"""
+        return cls.for_device(device_id).order_by('-timestamp')[:limit]
+    
+    @classmethod
+    def get_readings_by_date_range(cls, start_date, end_date, device_id=None):
+        """Get readings within a date range, optionally for a single device"""
+        return cls.for_device(device_id).filter(timestamp__gte=start_date, timestamp__lte=end_date).order_by('-timestamp')
+    
+    @classmethod
+    def raw_readings(cls, start_date=None, end_date=None, device_id=None, fields=API_FIELDS, limit=None,
+                     batch_size=None, oldest_first=False, stable=False):
+        """Newest-first pymongo cursor of plain dicts holding only ``fields``
+        
+        Fast path for read APIs and exports: no Document is constructed.
+        ``oldest_first`` walks the same index in chronological order; ``stable`` also
+        orders equal timestamps by _id (the (timestamp, _id) index of the standard
+        backend) so that repeated exports produce identical files.
+        """
+        return cls._raw_find(cls._get_collection().find, start_date, end_date, device_id, fields, limit,
+                             batch_size, oldest_first, stable)
+    
+    @classmethod
+    def raw_batches(cls, start_date=None, end_date=None, device_id=None, fields=API_FIELDS, limit=None,
+                    batch_size=None, oldest_first=False, stable=False):
+        """Same readings as raw_readings(), as undecoded BSON batches (one per server reply)
+        
+        For columnar decoders such as pymongoarrow, which read the fields of a whole
+        batch straight into arrays instead of building a dict per document.
+        """
+        return cls._raw_find(cls._get_collection().find_raw_batches, start_date, end_date, device_id, fields,
+                             limit, batch_size, oldest_first, stable)
+    
+    @classmethod
+    def _raw_find(cls, find, start_date, end_date, device_id, fields, limit, batch_size, oldest_first, stable):
+        projection = dict.fromkeys(fields, 1)
+        projection.setdefault('_id', 0)
+        direction = 1 if oldest_first else -1
+        sort = [('timestamp', direction)]
+        if stable and not TIMESERIES:
+            # Time-series : index sur les buckets, ce tri serait fait en mémoire sur toute la plage
+            sort.append(('_id', direction))
+        cursor = find(cls._range_query(start_date, end_date, device_id), projection, sort=sort,
+                      batch_size=batch_size or STORAGE['READ_BATCH_SIZE'])
+        if limit:
+            cursor = cursor.limit(limit)
+        return cursor
+    
+    @classmethod
+    def keyset_readings(cls, start_date=None, end_date=None, device_id=None, after=None, fields=API_FIELDS,
+                        limit=None, batch_size=None, oldest_first=False):
+        """Like raw_readings(), ordered by (timestamp, _id) descending and resuming after a key
+        
+        ``after`` is the (timestamp, _id) of the last document already served; documents keep
+        their ``_id`` so the last one of a page gives the next key. Unlike skip(), the cost of a
+        page does not grow with its position in the range. ``oldest_first`` walks forward from
+        ``after`` instead (incremental exports).
+        
+        Limitation of the time-series backend: MongoDB indexes its buckets, not the readings, so
+        no index returns them in (timestamp, _id) order. The explicit (timestamp, _id) index only
+        bounds the buckets read from the key onward; the order itself comes from a sort in memory,
+        kept to ``limit`` readings (top-k). Without ``limit``, the walk is therefore split into
+        queries of ``batch_size`` readings, each resuming after the last key (a generator instead
+        of a cursor): memory stays bounded, but every query scans the buckets of its key range.
+        """
+        if TIMESERIES and not limit:
+            return cls._keyset_pages(start_date, end_date, device_id, after, fields, batch_size, oldest_first)
+        query = cls._range_query(start_date, end_date, device_id)
+        operator, direction = ('$gt', 1) if oldest_first else ('$lt', -1)
+        if after is not None:
+            timestamp, object_id = after
+            query['$or'] = [{'timestamp': {operator: timestamp}},
+                            {'timestamp': timestamp, '_id': {operator: object_id}}]
+        cursor = cls._get_collection().find(query, dict.fromkeys(fields, 1),
+                                            sort=[('timestamp', direction), ('_id', direction)],
+                                            batch_size=batch_size or STORAGE['READ_BATCH_SIZE'])
+        if limit:
+            cursor = cursor.limit(limit)
+        return cursor
+    
+    @classmethod
+    def _keyset_pages(cls, start_date, end_date, device_id, after, fields, batch_size, oldest_first):
+        """keyset_readings() without limit, as successive limited queries (time-series backend)"""
+        page_size = batch_size or STORAGE['READ_BATCH_SIZE']
+        while True:
+            count = 0
+            for document in cls.keyset_readings(start_date, end_date, device_id, after, fields, page_size,
+                                                batch_size, oldest_first):
+                count += 1
+                yield document
+            if count < page_size:
+                return
+            after = (document['timestamp'], document['_id'])
+    
+    @staticmethod
+    def _range_query(start_date, end_date, device_id):
+        query = {}
+        if start_date is not None or end_date is not None:
+            query['timestamp'] = {}
+            if start_date is not None:
+                query['timestamp']['$gte'] = start_date
+            if end_date is not None:
+                query['timestamp']['$lte'] = end_date
+        if device_id:
+            query[DEVICE_FIELD] = device_id
+        return query
     
     @classmethod
-    def get_readings_by_date_range(cls, start_date, end_date):
-        """Get readings within a date range"""
-        return cls.objects.filter(timestamp__gte=start_date, timestamp__lte=end_date).order_by('-timestamp')
+    def raw_columns(cls, fields, **kwargs):
+        """Same readings as raw_readings(), as one list per field (columnar)"""
+        columns = {field: [] for field in fields}
+        appends = [(field, columns[field].append) for field in fields]
+        for document in cls.raw_readings(fields=fields, **kwargs):
+            for field, append in appends:
+                append(document.get(field))
+        return columns
     
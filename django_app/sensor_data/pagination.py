@@ -0,0 +1,33 @@
+"""
+Opaque continuation tokens for keyset pagination
+
+A token is the (timestamp, _id) key of the last reading of a page, base64url
+encoded. The client only passes it back; the next page is read with
+``SensorData.keyset_readings(after=decode_cursor(token))``.
+"""
+
+import base64
+from datetime import datetime
+
+from bson import ObjectId
+from bson.errors import InvalidId
+
+
+class InvalidCursor(ValueError):
+    """Continuation token that was not produced by encode_cursor()"""
+
+
+def encode_cursor(document):
+    """Token resuming right after ``document`` (a raw reading with its _id)"""
+    key = f"{document['timestamp'].isoformat()}|{document['_id']}"
+    return base64.urlsafe_b64encode(key.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """(timestamp, ObjectId) key of a token, raises InvalidCursor"""
+    try:
+        key = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)).decode()
+        timestamp, object_id = key.split('|')
+        return datetime.fromisoformat(timestamp), ObjectId(object_id)
+    except (ValueError, InvalidId, UnicodeDecodeError) as e:
+        raise InvalidCursor(f"Invalid cursor: {token}") from e
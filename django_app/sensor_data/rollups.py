@@ -0,0 +1,222 @@
+"""
+Minute, hour and day rollups of the sensor readings
+
+One document per device and bucket in ``sensor_rollups_<resolution>``::
+
+    {_id: {device_id, start}, device_id, start, count, samples,
+     temperature: {count, sum, min, max, sumsq}, humidity_air: {...}, ...}
+
+``count`` is the number of stored readings in the bucket and ``samples`` the
+number of ESP32 readings they fold (sum of ``sample_count``). Buckets are
+recomputed from the raw readings with ``$group`` + ``$merge`` (replace), never
+incremented, so refreshing a bucket twice, replaying the spool or merging
+partial rollups from several consumers keeps them exact. Ingestion refreshes
+the buckets touched by every written batch; ``rebuild_rollups`` (and the
+``rebuild_rollups`` management command) recomputes any time range.
+"""
+
+import math
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from mongoengine.connection import get_db
+
+from .models import SensorData, DEVICE_FIELD
+
+FIELDS = ('temperature', 'humidity_air', 'rain_forecast', 'humidity_soil')
+RESOLUTIONS = {'minute': 60, 'hour': 3600, 'day': 86400}
+EPOCH = datetime(1970, 1, 1)
+
+_indexed = set()
+
+
+def enabled_resolutions():
+    """Configured resolutions, coarsest first"""
+    names = settings.ROLLUP_SETTINGS['RESOLUTIONS']
+    return sorted((name for name in names if name in RESOLUTIONS), key=RESOLUTIONS.get, reverse=True)
+
+
+def rollup_collection(resolution):
+    collection = get_db()[f"{settings.ROLLUP_SETTINGS['COLLECTION_PREFIX']}{resolution}"]
+    if resolution not in _indexed:
+        collection.create_index([('start', 1)])
+        collection.create_index([('device_id', 1), ('start', 1)])
+        _indexed.add(resolution)
+    return collection
+
+
+def bucket_start(timestamp, resolution):
+    seconds = RESOLUTIONS[resolution]
+    offset = (timestamp - EPOCH).total_seconds()
+    return EPOCH + timedelta(seconds=offset - offset % seconds)
+
+
+def _add_field_stats(group):
+    """count/sum/min/max/sumsq accumulators of every field of the raw readings, added to a $group"""
+    for field in FIELDS:
+        value = f'${field}'
+        group[f'{field}_count'] = {'$sum': {'$cond': [{'$isNumber': value}, 1, 0]}}
+        group[f'{field}_sum'] = {'$sum': value}
+        group[f'{field}_min'] = {'$min': value}
+        group[f'{field}_max'] = {'$max': value}
+        group[f'{field}_sumsq'] = {'$sum': {'$multiply': [value, value]}}
+
+
+def _rollup_pipeline(match, resolution):
+    milliseconds = RESOLUTIONS[resolution] * 1000
+    epoch_ms = {'$toLong': '$timestamp'}
+    group = {
+        '_id': {
+            'device_id': {'$ifNull': ['$device_id', 'default']},
+            'start': {'$toDate': {'$subtract': [epoch_ms, {'$mod': [epoch_ms, milliseconds]}]}},
+        },
+        'count': {'$sum': 1},
+        'samples': {'$sum': {'$ifNull': ['$sample_count', 1]}},
+    }
+    _add_field_stats(group)
+    project = {'device_id': '$_id.device_id', 'start': '$_id.start', 'count': 1, 'samples': 1}
+    for field in FIELDS:
+        project[field] = {stat: f'${field}_{stat}' for stat in ('count', 'sum', 'min', 'max', 'sumsq')}
+    return [
+        {'$match': match},
+        {'$group': group},
+        {'$project': project},
+        {'$merge': {'into': rollup_collection(resolution).name, 'on': '_id',
+                    'whenMatched': 'replace', 'whenNotMatched': 'insert'}},
+    ]
+
+
+def refresh_rollups(keys, resolutions=None):
+    """Recompute the buckets holding the given (device_id, timestamp) readings"""
+    keys = {(device_id or 'default', timestamp) for device_id, timestamp in keys}
+    if not keys:
+        return
+    raw = SensorData._get_collection()
+    for resolution in resolutions or enabled_resolutions():
+        width = timedelta(seconds=RESOLUTIONS[resolution])
+        buckets = {(device_id, bucket_start(timestamp, resolution)) for device_id, timestamp in keys}
+        match = {'$or': [{DEVICE_FIELD: device_id, 'timestamp': {'$gte': start, '$lt': start + width}}
+                         for device_id, start in sorted(buckets)]}
+        list(raw.aggregate(_rollup_pipeline(match, resolution)))
+
+
+def rebuild_rollups(start, end, device_id=None, resolutions=None):
+    """Recompute every bucket overlapping [start, end), returns {resolution: buckets written}"""
+    raw = SensorData._get_collection()
+    written = {}
+    for resolution in resolutions or enabled_resolutions():
+        width = timedelta(seconds=RESOLUTIONS[resolution])
+        first = bucket_start(start, resolution)
+        last = bucket_start(end, resolution)
+        if last < end:
+            last += width
+        rollups = rollup_collection(resolution)
+        scope = {'start': {'$gte': first, '$lt': last}}
+        match = {'timestamp': {'$gte': first, '$lt': last}}
+        if device_id:
+            scope['device_id'] = device_id
+            match[DEVICE_FIELD] = device_id
+        # Les buckets dont toutes les lectures ont disparu ne seraient pas réécrits
+        rollups.delete_many(scope)
+        list(raw.aggregate(_rollup_pipeline(match, resolution)))
+        written[resolution] = rollups.count_documents(scope)
+    return written
+
+
+def pick_resolution(start, end, min_buckets):
+    """Coarsest enabled resolution giving at least ``min_buckets`` buckets over the range
+
+    None when the range is short enough to be read from the raw readings.
+    """
+    span = (end - start).total_seconds()
+    if not settings.ROLLUP_SETTINGS['ENABLED'] or span <= settings.ROLLUP_SETTINGS['RAW_MAX_RANGE']:
+        return None
+    for resolution in enabled_resolutions():
+        if span / RESOLUTIONS[resolution] >= min_buckets:
+            return resolution
+    return None
+
+
+def _merge_pipeline(start, end, resolution, device_id, group_id):
+    match = {'start': {'$gte': bucket_start(start, resolution), '$lt': end}}
+    if device_id:
+        match['device_id'] = device_id
+    group = {'_id': group_id, 'count': {'$sum': '$count'}, 'samples': {'$sum': '$samples'}}
+    for field in FIELDS:
+        group[f'{field}_count'] = {'$sum': f'${field}.count'}
+        group[f'{field}_sum'] = {'$sum': f'${field}.sum'}
+        group[f'{field}_min'] = {'$min': f'${field}.min'}
+        group[f'{field}_max'] = {'$max': f'${field}.max'}
+        group[f'{field}_sumsq'] = {'$sum': f'${field}.sumsq'}
+    return [{'$match': match}, {'$group': group}, {'$sort': {'_id': 1}}]
+
+
+def _reshape(row):
+    bucket = {'count': row['count'], 'samples': row['samples']}
+    for field in FIELDS:
+        bucket[field] = {stat: row[f'{field}_{stat}'] for stat in ('count', 'sum', 'min', 'max', 'sumsq')}
+    return bucket
+
+
+def rollup_series(start, end, resolution, device_id=None):
+    """Buckets of the range in chronological order, all devices merged unless ``device_id``"""
+    rows = rollup_collection(resolution).aggregate(_merge_pipeline(start, end, resolution, device_id, '$start'))
+    return [dict(_reshape(row), start=row['_id']) for row in rows]
+
+
+def rollup_summary(start, end, resolution, device_id=None):
+    """Totals of the range merged into one bucket, None when no rollup covers it"""
+    rows = list(rollup_collection(resolution).aggregate(_merge_pipeline(start, end, resolution, device_id, None)))
+    if not rows or not rows[0]['count']:
+        return None
+    return _reshape(rows[0])
+
+
+def raw_summary(timestamp_ranges, device_id=None):
+    """rollup_summary() of the raw readings matching any of the ``timestamp`` conditions, None if none
+
+    For the partial buckets at the edges of a range, which the rollups would overcount.
+    """
+    match = {'$or': [{'timestamp': condition} for condition in timestamp_ranges]}
+    if device_id:
+        match[DEVICE_FIELD] = device_id
+    group = {'_id': None, 'count': {'$sum': 1}, 'samples': {'$sum': {'$ifNull': ['$sample_count', 1]}}}
+    _add_field_stats(group)
+    rows = list(SensorData._get_collection().aggregate([{'$match': match}, {'$group': group}]))
+    if not rows:
+        return None
+    return _reshape(rows[0])
+
+
+def merge_summaries(*summaries):
+    """One summary (see rollup_summary()) totalling the given ones; None ones are skipped"""
+    summaries = [summary for summary in summaries if summary is not None]
+    if not summaries:
+        return None
+    merged = {'count': sum(summary['count'] for summary in summaries),
+              'samples': sum(summary['samples'] for summary in summaries)}
+    for field in FIELDS:
+        stats = [summary[field] for summary in summaries]
+        minimums = [value['min'] for value in stats if value['min'] is not None]
+        maximums = [value['max'] for value in stats if value['max'] is not None]
+        merged[field] = {
+            'count': sum(value['count'] for value in stats),
+            'sum': sum(value['sum'] for value in stats),
+            'min': min(minimums) if minimums else None,
+            'max': max(maximums) if maximums else None,
+            'sumsq': sum(value['sumsq'] for value in stats),
+        }
+    return merged
+
+
+def field_mean(stats):
+    return stats['sum'] / stats['count'] if stats['count'] else None
+
+
+def field_summary(stats):
+    """avg/min/max/std of one field of a rollup bucket"""
+    mean = field_mean(stats)
+    if mean is None:
+        return {'avg': None, 'min': None, 'max': None, 'std': None}
+    variance = max(0.0, stats['sumsq'] / stats['count'] - mean * mean)
+    return {'avg': mean, 'min': stats['min'], 'max': stats['max'], 'std': math.sqrt(variance)}
@@ -0,0 +1,88 @@
+"""
+Window statistics computed by MongoDB
+
+``window_statistics`` returns one small dict (reading count, newest reading
+and avg/min/max/sum per field) for any time window. Short windows run a
+single aggregation on the raw readings (``$match`` on the indexed timestamp,
+``$sort`` on the same index, ``$group``); windows long enough to be served
+from the rollups merge the rollup buckets that lie entirely inside the window
+instead, plus the raw readings of the partial buckets at its edges. Either
+way no Document is built per reading and the response size does not depend
+on the window.
+Windows covered by the in-memory hot tier are computed without MongoDB.
+"""
+
+from .models import SensorData, DEVICE_FIELD
+from datetime import timedelta
+
+from .rollups import (FIELDS, RESOLUTIONS, bucket_start, pick_resolution, rollup_summary, raw_summary,
+                      merge_summaries, field_summary)
+from .hot_tier import hot_tier
+
+
+def _window_match(start, end, device_id):
+    match = {'timestamp': {'$gte': start, '$lte': end}}
+    if device_id:
+        match[DEVICE_FIELD] = device_id
+    return match
+
+
+def _raw_statistics(start, end, device_id):
+    group = {'_id': None, 'count': {'$sum': 1}, 'latest': {'$first': '$$ROOT'}}
+    for field in FIELDS:
+        for stat in ('avg', 'min', 'max', 'sum'):
+            group[f'{field}_{stat}'] = {f'${stat}': f'${field}'}
+    pipeline = [
+        {'$match': _window_match(start, end, device_id)},
+        {'$sort': {'timestamp': -1}},
+        {'$group': group},
+    ]
+    rows = list(SensorData._get_collection().aggregate(pipeline))
+    # Fenêtre vide : aucun groupe (certains moteurs renvoient un groupe à count 0)
+    if not rows or not rows[0]['count']:
+        return None
+    row = rows[0]
+    result = {'count': row['count'], 'latest': row['latest'], 'source': 'raw'}
+    for field in FIELDS:
+        result[field] = {stat: row[f'{field}_{stat}'] for stat in ('avg', 'min', 'max', 'sum')}
+    return result
+
+
+def _rollup_statistics(start, end, device_id, resolution):
+    # Buckets entièrement dans [start, end] : [first, last) ; bords partiels lus sur les lectures brutes
+    width = timedelta(seconds=RESOLUTIONS[resolution])
+    first = bucket_start(start, resolution)
+    if first < start:
+        first += width
+    last = bucket_start(end, resolution)
+    if first >= last:
+        return None
+    summary = rollup_summary(first, last, resolution, device_id)
+    if summary is None:
+        # Rollups absents (pas encore reconstruits) : agrégation brute
+        return None
+    summary = merge_summaries(summary, raw_summary([{'$gte': start, '$lt': first}, {'$gte': last, '$lte': end}],
+                                                   device_id))
+    latest = SensorData._get_collection().find_one(_window_match(start, end, device_id), sort=[('timestamp', -1)])
+    if latest is None:
+        return None
+    result = {'count': summary['count'], 'latest': latest, 'source': f'rollup_{resolution}'}
+    for field in FIELDS:
+        result[field] = dict(field_summary(summary[field]), sum=summary[field]['sum'])
+    return result
+
+
+def window_statistics(start, end, device_id=None):
+    """Statistics of the readings in [start, end], None when the window is empty
+
+    Returns ``{'count', 'latest' (raw document), 'source', <field>: {avg, min, max, sum}}``.
+    """
+    result = hot_tier.statistics(start, end, device_id)
+    if result is not None:
+        return result
+    resolution = pick_resolution(start, end, min_buckets=24)
+    if resolution:
+        result = _rollup_statistics(start, end, device_id, resolution)
+        if result is not None:
+            return result
+    return _raw_statistics(start, end, device_id)
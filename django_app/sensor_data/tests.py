@@ -0,0 +1,826 @@
+"""
+Tests of the sensor_data read paths and exports
+
+MongoDB is replaced by mongomock (standard backend): run from the django_app
+directory with ``python manage.py test``.
+"""
+
+import io
+import asyncio
+import os
+import sys
+import csv
+import gzip
+import json
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import redirect_stdout
+from datetime import datetime, timedelta
+from unittest import mock, skipIf
+
+import mongoengine
+import mongomock
+import numpy as np
+from bson import ObjectId
+from django.conf import settings
+from django.test import SimpleTestCase
+
+from .models import API_FIELDS, SensorData
+from .features import FEATURE_COLUMNS, PyMongoArrowContext
+
+sys.path.append(os.path.join(settings.BASE_DIR.parent, 'scripts'))
+
+
+def setUpModule():
+    mongoengine.disconnect()
+    mongoengine.connect('sensor_data_tests', host='mongodb://localhost', mongo_client_class=mongomock.MongoClient)
+
+
+def tearDownModule():
+    mongoengine.disconnect()
+
+
+def reading(timestamp, device_id='field-1', **values):
+    """Raw SensorData document as written by the ingestion"""
+    document = {'device_id': device_id, 'metadata': {'device_id': device_id, 'location': 'test'},
+                'timestamp': timestamp, 'temperature': 20.0, 'humidity_air': 60.0, 'rain_forecast': 0.0,
+                'humidity_soil': 40.0, 'sample_count': 1, 'weather_stale': False}
+    document.update(values)
+    return document
+
+
+def hourly_readings(start, hours, devices=('field-1', 'field-2')):
+    return [reading(start + timedelta(hours=hour), device, humidity_soil=30.0 + hour % 7 + index / 10,
+                    rain_forecast=1.5 if hour % 5 == 0 else 0.0)
+            for hour in range(hours) for index, device in enumerate(devices)]
+
+
+class MongoTestCase(SimpleTestCase):
+    """Empty readings collection before each test"""
+
+    def setUp(self):
+        self.collection = SensorData._get_collection()
+        self.collection.delete_many({})
+
+    def insert(self, documents):
+        self.collection.insert_many(documents)
+
+
+def read_csv(path):
+    with open(path, newline='', encoding='utf-8') as csvfile:
+        return list(csv.DictReader(csvfile))
+
+
+class IncrementalExportTests(MongoTestCase):
+    """scripts/export_to_csv.py --incremental"""
+
+    def setUp(self):
+        super().setUp()
+        self.output = tempfile.mkdtemp(prefix='incremental_')
+        self.addCleanup(shutil.rmtree, self.output, ignore_errors=True)
+
+    def export(self, **kwargs):
+        from export_to_csv import export_incremental
+        with redirect_stdout(io.StringIO()):
+            return export_incremental(self.output, settle=0, **kwargs)
+
+    def exported_rows(self):
+        names = sorted(name for name in os.listdir(self.output) if name.startswith('run-'))
+        return names, [(row['timestamp'], row['humidity_soil']) for name in names
+                       for row in read_csv(os.path.join(self.output, name))]
+
+    def test_first_run_then_only_new_readings(self):
+        start = datetime(2024, 5, 1)
+        self.insert(hourly_readings(start, 10))
+        self.assertTrue(self.export())
+        names, rows = self.exported_rows()
+        self.assertEqual(names, ['run-000001.csv'])
+        self.assertEqual(len(rows), 20)
+
+        # Lecture au même horodatage que le filigrane (autre appareil) et lectures plus récentes
+        self.insert([reading(start + timedelta(hours=9), 'field-3', humidity_soil=55.0)]
+                    + hourly_readings(start + timedelta(hours=10), 3))
+        self.assertTrue(self.export())
+        names, rows = self.exported_rows()
+        self.assertEqual(names, ['run-000001.csv', 'run-000002.csv'])
+        self.assertEqual(len(rows), 27)
+        self.assertEqual(len(set(rows)), 27)
+        self.assertEqual(self.collection.count_documents({}), len(rows))
+
+        # Rien de nouveau : ni partition vide ni filigrane modifié
+        self.assertTrue(self.export())
+        self.assertEqual(self.exported_rows()[0], ['run-000001.csv', 'run-000002.csv'])
+
+    def test_run_interrupted_before_the_watermark_is_redone(self):
+        import export_to_csv
+        self.insert(hourly_readings(datetime(2024, 5, 1), 6))
+        self.assertTrue(self.export(limit=4))
+        self.insert(hourly_readings(datetime(2024, 5, 2), 2))
+        with mock.patch.object(export_to_csv, 'save_watermark', side_effect=OSError('disk full')):
+            self.assertFalse(self.export())
+        self.assertTrue(self.export())
+        names, rows = self.exported_rows()
+        self.assertEqual(names, ['run-000001.csv', 'run-000002.csv'])
+        self.assertEqual(len(rows), 16)
+        self.assertEqual(len(set(rows)), 16)
+        self.assertFalse(os.path.exists(os.path.join(self.output, export_to_csv.STAGING_DIR)))
+
+
+class DownsamplingTests(SimpleTestCase):
+    """LTTB reduction of the chart series"""
+
+    def series(self, length=5000):
+        x = list(range(length))
+        columns = {
+            'humidity_soil': [40.0 + (index % 50) / 10 for index in x],
+            'humidity_air': [60.0 - (index % 70) / 10 for index in x],
+            'temperature': [20.0 + (index % 90) / 10 for index in x],
+            'rain_forecast': [0.0] * length,
+        }
+        columns['humidity_soil'][length * 2 // 3] = 95.0
+        return x, columns
+
+    def test_lttb_keeps_ends_and_peaks(self):
+        from .downsampling import lttb_indices
+        x, columns = self.series()
+        kept = lttb_indices(x, columns['humidity_soil'], 100)
+        self.assertEqual(len(kept), 100)
+        self.assertEqual((kept[0], kept[-1]), (0, len(x) - 1))
+        self.assertIn(len(x) * 2 // 3, kept)
+        self.assertEqual(kept, sorted(kept))
+
+    def test_merged_series_stay_within_max_points(self):
+        from .downsampling import downsample_columns
+        x, columns = self.series()
+        for max_points in (1000, 100, 10, 3):
+            kept = downsample_columns(x, columns, max_points)
+            self.assertLessEqual(len(kept), max_points)
+            self.assertEqual(kept, sorted(set(kept)))
+        self.assertIn(len(x) * 2 // 3, downsample_columns(x, columns, 1000))
+
+    def test_series_that_fit_are_untouched(self):
+        from .downsampling import downsample_columns
+        x, columns = self.series(500)
+        self.assertIsNone(downsample_columns(x, columns, 500))
+
+    def test_missing_rollup_values_are_skipped(self):
+        from .downsampling import downsample_columns
+        x = list(range(1000))
+        values = [None if index % 3 == 0 else float(index % 17) for index in x]
+        kept = downsample_columns(x, {'humidity_soil': values}, 50)
+        self.assertLessEqual(len(kept), 50)
+        self.assertTrue(all(values[index] is not None for index in kept))
+
+
+class FeaturePipelineTests(SimpleTestCase):
+    """Vectorized training features (sensor_data/features.py)"""
+
+    def setUp(self):
+        self.readings = hourly_readings(datetime(2024, 5, 1), 60, devices=('field-1', 'field-2', 'field-3'))
+
+    def features(self, readings, page_size):
+        from .features import FeaturePipeline
+        pipeline = FeaturePipeline()
+        pages = [pipeline.columns(readings[start:start + page_size])
+                 for start in range(0, len(readings), page_size)]
+        return [np.concatenate([page[index] for page in pages]) for index in range(len(pages[0]))]
+
+    def assertSameColumns(self, first, second):
+        for name, left, right in zip(FEATURE_COLUMNS, first, second):
+            with self.subTest(column=name):
+                np.testing.assert_array_equal(left, right)
+
+    def test_columns_do_not_depend_on_pages(self):
+        whole = self.features(self.readings, len(self.readings))
+        for page_size in (1, 7, 50):
+            self.assertSameColumns(self.features(self.readings, page_size), whole)
+
+    def test_device_id_comes_after_the_single_device_columns(self):
+        from .features import FeaturePipeline
+        columns = FeaturePipeline().columns(self.readings)
+        self.assertEqual(len(columns), len(FEATURE_COLUMNS))
+        self.assertEqual(FEATURE_COLUMNS[:3], ['timestamp', 'temperature', 'humidity_air'])
+        self.assertEqual(FEATURE_COLUMNS[-1], 'device_id')
+        self.assertEqual(set(columns[-1]), {'field-1', 'field-2', 'field-3'})
+
+    def test_features_of_one_reading(self):
+        from .features import FeaturePipeline
+        columns = dict(zip(FEATURE_COLUMNS, FeaturePipeline().columns(self.readings)))
+        soil = {(record['device_id'], record['timestamp'].hour + 24 * (record['timestamp'].day - 1)):
+                record['humidity_soil'] for record in self.readings}
+        # field-2, 13e heure : pluie prévue aux heures multiples de 5
+        index = 13 * 3 + 1
+        self.assertEqual(columns['device_id'][index], 'field-2')
+        self.assertEqual(columns['hour_of_day'][index], 13)
+        self.assertEqual(columns['humidity_soil_mean_3h'][index],
+                         round(sum(soil['field-2', hour] for hour in (11, 12, 13)) / 3, 2))
+        self.assertEqual(columns['humidity_soil_lag_1'][index], soil['field-2', 12])
+        self.assertEqual(columns['humidity_soil_delta_1'][index],
+                         round(soil['field-2', 13] - soil['field-2', 12], 2))
+        self.assertTrue(np.isnan(columns['humidity_soil_lag_24'][index]))
+        self.assertEqual(columns['rain_sum_6h'][index], 1.5)
+        self.assertEqual(columns['hours_since_rain'][index], 3.0)
+
+    def test_primed_range_matches_the_longer_export(self):
+        from .features import FeaturePipeline
+        split = 30 * 3
+        pipeline = FeaturePipeline()
+        pipeline.prime(iter(self.readings[:split]), 40)
+        tail = pipeline.columns(self.readings[split:])
+        whole = self.features(self.readings, len(self.readings))
+        self.assertSameColumns(tail, [column[split:] for column in whole])
+
+    def test_lookback_gap_leaves_features_empty(self):
+        from .features import LOOKBACK_HOURS, FeaturePipeline
+        readings = [reading(datetime(2024, 5, 1), rain_forecast=2.0),
+                    reading(datetime(2024, 5, 1) + timedelta(hours=LOOKBACK_HOURS + 1))]
+        columns = dict(zip(FEATURE_COLUMNS, FeaturePipeline().columns(readings)))
+        self.assertTrue(np.isnan(columns['humidity_soil_lag_1'][1]))
+        self.assertTrue(np.isnan(columns['hours_since_rain'][1]))
+        self.assertEqual(columns['hours_since_rain'][0], 0.0)
+
+    @skipIf(PyMongoArrowContext is None, 'pymongoarrow absent')
+    def test_bson_batches_decode_like_cursor_dicts(self):
+        import bson
+        from .features import bson_arrays, page_arrays
+        readings = self.readings[:20] + [{key: value for key, value in reading(datetime(2024, 5, 4)).items()
+                                          if key != 'device_id'}]
+        decoded = bson_arrays(b''.join(map(bson.encode, readings)))
+        expected = page_arrays(readings)
+        self.assertEqual(list(decoded['devices']), expected['devices'])
+        for key in ('ms', 'device_codes', 'temperature', 'humidity_soil'):
+            np.testing.assert_array_equal(decoded[key], expected[key])
+
+    def test_iso_timestamps_match_isoformat(self):
+        from export_to_csv import iso_timestamps
+        timestamps = [datetime(2024, 5, 1, 10), datetime(2024, 5, 1, 10, 0, 1, 250000)]
+        column = np.array(timestamps, dtype='datetime64[ms]')
+        self.assertEqual(iso_timestamps(column), [timestamp.isoformat() for timestamp in timestamps])
+
+
+class FeatureExportTests(MongoTestCase):
+    """scripts/export_to_csv.py --features, CSV and Parquet"""
+
+    def setUp(self):
+        super().setUp()
+        self.output = tempfile.mkdtemp(prefix='features_')
+        self.addCleanup(shutil.rmtree, self.output, ignore_errors=True)
+        # mongomock n'a pas find_raw_batches : pages extraites des dicts du curseur
+        patcher = mock.patch('export_to_csv.PyMongoArrowContext', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.insert(hourly_readings(datetime(2024, 5, 1), 30))
+
+    def export(self, output, **kwargs):
+        from export_to_csv import export_training_features
+        with redirect_stdout(io.StringIO()):
+            return export_training_features(output, batch_size=7, **kwargs)
+
+    def test_csv_has_device_and_temporal_columns(self):
+        path = os.path.join(self.output, 'features.csv')
+        self.assertTrue(self.export(path))
+        rows = read_csv(path)
+        self.assertEqual(list(rows[0]), FEATURE_COLUMNS)
+        self.assertEqual(len(rows), 60)
+        self.assertEqual({row['device_id'] for row in rows}, {'field-1', 'field-2'})
+        self.assertEqual(rows[0]['timestamp'], '2024-05-01T00:00:00')
+        self.assertEqual(rows[0]['humidity_soil_lag_1'], '')
+        self.assertEqual(float(rows[2]['humidity_soil_lag_1']), float(rows[0]['humidity_soil']))
+
+    def test_parquet_partitions_give_back_the_device(self):
+        from export_to_csv import pa
+        if pa is None:
+            self.skipTest('pyarrow absent')
+        import pyarrow.dataset as ds
+        path = os.path.join(self.output, 'dataset')
+        self.assertTrue(self.export(path, file_format='parquet'))
+        self.assertTrue(os.path.exists(os.path.join(path, 'date=2024-05', 'device_id=field-2', 'part-0.parquet')))
+        table = ds.dataset(path, format='parquet', partitioning='hive').to_table()
+        self.assertEqual(table.num_rows, 60)
+        self.assertEqual(set(table['device_id'].to_pylist()), {'field-1', 'field-2'})
+
+
+class ApiCacheTests(MongoTestCase):
+    """Read API response cache (sensor_data/api_cache.py)"""
+
+    def setUp(self):
+        super().setUp()
+        from django.core.cache import caches
+        caches[settings.API_CACHE['ALIAS']].clear()
+        patcher = mock.patch.dict(settings.API_CACHE, ENABLED=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_max_points_rounded_down_to_a_bucket(self):
+        from .api_cache import int_param
+        normalize = int_param(1000, step=100)
+        self.assertEqual([normalize(value) for value in ('20', '100', '250', '999', None)], [20, 100, 200, 900, 1000])
+
+    def test_chart_never_exceeds_max_points(self):
+        now = datetime.utcnow()
+        self.insert([reading(now - timedelta(minutes=4 * index), humidity_soil=30.0 + index % 9)
+                     for index in range(300)])
+        for max_points in (20, 150):
+            data = self.client.get('/dashboard/api/chart-data/', {'hours': 24, 'max_points': max_points}).json()
+            self.assertEqual(data['status'], 'success')
+            self.assertLessEqual(data['count'], max_points)
+            self.assertEqual(data['max_points'], max_points // 100 * 100 or max_points)
+
+    def test_realtime_age_is_computed_after_the_lookup(self):
+        from . import api_cache
+        self.insert([reading(datetime.utcnow() - timedelta(minutes=5))])
+        first = self.client.get('/dashboard/api/realtime/').json()
+        self.assertEqual(first['data']['time_ago'], '5min')
+        hits = api_cache.get_stats()['endpoints']['realtime_reading']['hits']
+        with mock.patch('sensor_data.dashboard_views.get_time_ago', return_value='2h'):
+            second = self.client.get('/dashboard/api/realtime/').json()
+        self.assertEqual(api_cache.get_stats()['endpoints']['realtime_reading']['hits'], hits + 1)
+        self.assertEqual(second['data']['time_ago'], '2h')
+        self.assertEqual(second['data']['humidity_soil'], first['data']['humidity_soil'])
+
+
+class KeysetPaginationTests(MongoTestCase):
+    """SensorData.keyset_readings: (timestamp, _id) order, resumed after a key"""
+
+    def setUp(self):
+        super().setUp()
+        # Plusieurs appareils par horodatage : égalités départagées par _id
+        self.insert(hourly_readings(datetime(2024, 5, 1), 9, devices=('field-1', 'field-2', 'field-3')))
+        self.expected = [(document['timestamp'], document['_id'])
+                         for document in self.collection.find(sort=[('timestamp', 1), ('_id', 1)])]
+
+    def walk(self, page_size):
+        keys = []
+        after = None
+        while True:
+            page = list(SensorData.keyset_readings(after=after, limit=page_size, oldest_first=True))
+            keys += [(document['timestamp'], document['_id']) for document in page]
+            if len(page) < page_size:
+                return keys
+            after = keys[-1]
+
+    def test_pages_cover_every_reading_once_in_order(self):
+        for page_size in (1, 4, 27, 100):
+            self.assertEqual(self.walk(page_size), self.expected)
+
+    def test_newest_first_resumes_before_the_key(self):
+        after = self.expected[10]
+        keys = [(document['timestamp'], document['_id'])
+                for document in SensorData.keyset_readings(after=after, limit=5)]
+        self.assertEqual(keys, self.expected[5:10][::-1])
+
+    def test_timeseries_walk_is_split_into_limited_queries(self):
+        from . import models
+        collection = SensorData._get_collection()
+        with mock.patch.object(models, 'TIMESERIES', True), \
+                mock.patch.object(collection, 'find', wraps=collection.find) as find:
+            documents = list(SensorData.keyset_readings(oldest_first=True, batch_size=4))
+        self.assertEqual([(document['timestamp'], document['_id']) for document in documents], self.expected)
+        # 27 lectures par requêtes de 4 : 7 requêtes, la dernière incomplète
+        self.assertEqual(find.call_count, 7)
+
+
+class WindowStatisticsTests(MongoTestCase):
+    """Rollup statistics of a window whose edges cut through rollup buckets"""
+
+    def setUp(self):
+        super().setUp()
+        from .rollups import rollup_collection
+        self.readings = [reading(datetime(2024, 5, 1) + timedelta(minutes=30 * index), humidity_soil=float(index))
+                         for index in range(96)]
+        self.insert(self.readings)
+        # Buckets horaires tels que les écrit l'agrégation des rollups
+        self.rollups = rollup_collection('hour')
+        self.rollups.delete_many({})
+        self.addCleanup(self.rollups.delete_many, {})
+        buckets = {}
+        for document in self.readings:
+            start = document['timestamp'].replace(minute=0)
+            buckets.setdefault(start, []).append(document)
+        for start, documents in buckets.items():
+            bucket = {'_id': {'device_id': 'field-1', 'start': start}, 'device_id': 'field-1', 'start': start,
+                      'count': len(documents), 'samples': len(documents)}
+            for field in ('temperature', 'humidity_air', 'rain_forecast', 'humidity_soil'):
+                values = [document[field] for document in documents]
+                bucket[field] = {'count': len(values), 'sum': sum(values), 'min': min(values), 'max': max(values),
+                                 'sumsq': sum(value * value for value in values)}
+            self.rollups.insert_one(bucket)
+
+    def test_partial_edge_buckets_come_from_raw_readings(self):
+        from .statistics import _raw_statistics, _rollup_statistics
+        start, end = datetime(2024, 5, 1, 5, 40), datetime(2024, 5, 2, 20, 10)
+        rollup = _rollup_statistics(start, end, None, 'hour')
+        raw = _raw_statistics(start, end, None)
+        self.assertEqual(rollup['source'], 'rollup_hour')
+        self.assertEqual(rollup['count'], raw['count'])
+        for stat in ('sum', 'min', 'max'):
+            self.assertEqual(rollup['humidity_soil'][stat], raw['humidity_soil'][stat])
+        self.assertAlmostEqual(rollup['humidity_soil']['avg'], raw['humidity_soil']['avg'])
+        self.assertEqual(rollup['latest']['timestamp'], datetime(2024, 5, 2, 20))
+
+    def test_missing_rollups_fall_back_to_raw(self):
+        from .statistics import _rollup_statistics
+        self.rollups.delete_many({})
+        self.assertIsNone(_rollup_statistics(datetime(2024, 5, 1, 5, 40), datetime(2024, 5, 2, 20, 10), None, 'hour'))
+
+
+class DeviceFilterTests(MongoTestCase):
+    """Read endpoints restricted to one device with ``device_id``"""
+
+    def test_latest_readings_of_one_device(self):
+        self.insert(hourly_readings(datetime(2024, 5, 1), 5, devices=('field-1', 'field-2', 'field-3')))
+        with mock.patch.dict(settings.API_CACHE, ENABLED=False):
+            data = self.client.get('/api/readings/latest/', {'device_id': 'field-2', 'limit': 3}).json()
+            everything = self.client.get('/api/readings/latest/', {'limit': 100}).json()
+        self.assertEqual(data['count'], 3)
+        self.assertEqual({row['device_id'] for row in data['data']}, {'field-2'})
+        self.assertEqual([row['timestamp'] for row in data['data']],
+                         sorted((row['timestamp'] for row in data['data']), reverse=True))
+        self.assertEqual(everything['count'], 15)
+
+
+class TimeseriesStorageTests(MongoTestCase):
+    """Time-series backend: metaField, idempotent inserts and manage.py migrate_to_timeseries"""
+
+    def setUp(self):
+        super().setUp()
+        self.target = SensorData._get_db()['sensor_readings_ts_tests']
+        self.target.delete_many({})
+
+    def migrate(self):
+        from django.core.management import call_command
+        command = 'sensor_data.management.commands.migrate_to_timeseries'
+        output = io.StringIO()
+        # mongomock ne crée pas de collection time-series (ni Collection.options())
+        with mock.patch(f'{command}.ensure_timeseries_collection', return_value=False), \
+                mock.patch(f'{command}.is_timeseries', return_value=True):
+            call_command('migrate_to_timeseries', source=self.collection.name, target=self.target.name,
+                         batch_size=3, location='Bizerte', stdout=output)
+        return output.getvalue()
+
+    def test_migration_fills_metadata_and_resumes_without_duplicates(self):
+        start = datetime(2024, 5, 1)
+        documents = hourly_readings(start, 4)
+        del documents[0]['metadata']
+        self.insert(documents)
+        self.migrate()
+        self.assertEqual(self.target.count_documents({}), 8)
+        first = self.target.find_one({'_id': documents[0]['_id']})
+        self.assertEqual(first['metadata'], {'device_id': 'field-1', 'location': 'Bizerte'})
+
+        self.insert(hourly_readings(start + timedelta(hours=4), 2))
+        output = self.migrate()
+        self.assertIn('Reprise', output)
+        self.assertEqual(self.target.count_documents({}), 12)
+        self.assertEqual(len(self.target.distinct('_id')), 12)
+
+    def test_insert_skipping_existing_is_idempotent(self):
+        from mqtt_handler.writes import insert_readings
+        # Documents de l'ingestion : _id déjà attribué par le spool
+        documents = [dict(document, _id=ObjectId()) for document in hourly_readings(datetime(2024, 5, 1), 2)]
+        self.target.insert_many(documents[:2])
+        with mock.patch('mqtt_handler.writes.is_timeseries', return_value=True):
+            self.assertEqual(insert_readings(self.target, documents), 2)
+            self.assertEqual(insert_readings(self.target, documents), 0)
+        self.assertEqual(self.target.count_documents({}), 4)
+
+    def test_clean_fills_the_meta_field(self):
+        document = SensorData(device_id='field-7', temperature=20.0, humidity_air=60.0, rain_forecast=0.0,
+                              humidity_soil=40.0)
+        document.validate()
+        self.assertEqual(document.metadata, {'device_id': 'field-7',
+                                             'location': settings.OPENWEATHER_SETTINGS['CITY']})
+
+
+class StatisticsEndpointTests(MongoTestCase):
+    """Window statistics computed by one aggregation instead of per-reading Documents"""
+
+    def test_statistics_of_one_device(self):
+        now = datetime.utcnow().replace(microsecond=0)
+        values = [30.0 + index % 7 for index in range(20)]
+        self.insert([reading(now - timedelta(minutes=30 * index), humidity_soil=value, temperature=15.0 + index)
+                     for index, value in enumerate(values)]
+                    + [reading(now - timedelta(minutes=10), 'field-2', humidity_soil=99.0),
+                       reading(now - timedelta(hours=30), humidity_soil=1.0)])
+        with mock.patch.dict(settings.API_CACHE, ENABLED=False):
+            data = self.client.get('/api/statistics/', {'hours': 24, 'device_id': 'field-1'}).json()
+        self.assertEqual((data['status'], data['source']), ('success', 'raw'))
+        stats = data['data']
+        self.assertEqual(stats['total_readings'], 20)
+        self.assertEqual(stats['latest_reading']['timestamp'], now.isoformat())
+        self.assertEqual((stats['humidity_soil']['min'], stats['humidity_soil']['max']), (min(values), max(values)))
+        self.assertAlmostEqual(stats['humidity_soil']['avg'], sum(values) / len(values))
+        self.assertEqual(stats['temperature']['max'], 34.0)
+
+    def test_empty_window(self):
+        from .statistics import window_statistics
+        self.assertIsNone(window_statistics(datetime(2024, 5, 1), datetime(2024, 5, 1, 6)))
+
+
+class RawReadPathTests(MongoTestCase):
+    """Projected pymongo cursors used instead of one Document per reading"""
+
+    def setUp(self):
+        super().setUp()
+        self.start = datetime(2024, 5, 1)
+        self.insert(hourly_readings(self.start, 6) + [reading(self.start + timedelta(hours=2), 'field-3')])
+
+    def test_projection_matches_document_to_dict(self):
+        documents = list(SensorData.raw_readings(self.start, self.start + timedelta(hours=3), limit=5))
+        self.assertEqual(len(documents), 5)
+        self.assertTrue(all(set(document) <= set(API_FIELDS) for document in documents))
+        timestamps = [document['timestamp'] for document in documents]
+        self.assertEqual(timestamps, sorted(timestamps, reverse=True))
+        expected = [document.to_dict() for document in
+                    SensorData.get_readings_by_date_range(self.start, self.start + timedelta(hours=3))[:5]]
+        self.assertEqual(sorted(map(SensorData.raw_to_dict, documents), key=str), sorted(expected, key=str))
+
+    def test_stable_order_breaks_timestamp_ties_by_id(self):
+        documents = list(SensorData.raw_readings(fields=('timestamp', '_id'), oldest_first=True, stable=True))
+        keys = [(document['timestamp'], document['_id']) for document in documents]
+        self.assertEqual(keys, sorted(keys))
+        self.assertEqual(len(keys), 13)
+
+    def test_columns_of_one_device(self):
+        columns = SensorData.raw_columns(('timestamp', 'humidity_soil'), device_id='field-2', oldest_first=True)
+        self.assertEqual(columns['timestamp'], [self.start + timedelta(hours=hour) for hour in range(6)])
+        self.assertEqual(columns['humidity_soil'], [30.1 + hour % 7 for hour in range(6)])
+
+
+class EventStreamTests(SimpleTestCase):
+    """In-process event bus and the Server-Sent Events endpoint"""
+
+    def test_every_subscriber_gets_each_event_and_full_queues_drop_the_oldest(self):
+        from .events import EventBus, SubscriberLimitReached
+        bus = EventBus(max_subscribers=2, queue_size=2)
+        fast, slow = bus.subscribe(), bus.subscribe()
+        with self.assertRaises(SubscriberLimitReached):
+            bus.subscribe()
+        bus.publish('reading', 'a')
+        self.assertEqual(fast.get(0), (1, 'reading', 'a'))
+        bus.publish('reading', 'b')
+        bus.publish('reading', 'c')
+        self.assertEqual([event[2] for event in (slow.get(0), slow.get(0))], ['b', 'c'])
+        self.assertIsNone(slow.get(0))
+        self.assertEqual(bus.get_stats(), {'subscribers': 2, 'published': 3, 'rejected': 1, 'dropped': 1})
+        bus.unsubscribe(fast)
+        self.assertIsNotNone(bus.subscribe())
+
+    def test_async_subscriber_is_woken_by_another_thread(self):
+        from .events import EventBus
+        bus = EventBus(max_subscribers=1, queue_size=10)
+        subscription = bus.subscribe()
+
+        async def receive():
+            self.assertIsNone(await subscription.aget(0.01))
+            threading.Timer(0.05, bus.publish, ('reading', 'late')).start()
+            return await subscription.aget(5)
+
+        self.assertEqual(asyncio.run(receive()), (1, 'reading', 'late'))
+
+    def test_stream_endpoint_sends_published_readings(self):
+        from .events import EventBus
+        bus = EventBus(max_subscribers=1, queue_size=10)
+        stream = dict(settings.EVENT_STREAM, HEARTBEAT=0.01)
+        with mock.patch('sensor_data.dashboard_views.bus', bus), mock.patch.dict(settings.EVENT_STREAM, stream):
+            response = self.client.get('/dashboard/api/stream/')
+            self.assertEqual(response['Content-Type'], 'text/event-stream')
+            with self.assertLogs('django.request', 'WARNING'):
+                self.assertEqual(self.client.get('/dashboard/api/stream/').status_code, 503)
+            chunks = iter(response.streaming_content)
+            self.assertEqual(next(chunks), f"retry: {stream['RETRY_MS']}\n\n".encode())
+            self.assertEqual(next(chunks), b': heartbeat\n\n')
+            bus.publish('reading', reading(datetime(2024, 5, 1, 10), humidity_soil=42.0))
+            message = next(chunks).decode()
+            response.close()
+        self.assertTrue(message.startswith('id: 1\nevent: reading\ndata: '))
+        self.assertEqual(json.loads(message.split('data: ', 1)[1])['humidity_soil'], 42.0)
+        self.assertEqual(bus.get_stats()['subscribers'], 0)
+
+
+class ConditionalGetTests(MongoTestCase):
+    """ETag / Last-Modified validators of the read APIs"""
+
+    def setUp(self):
+        super().setUp()
+        from django.core.cache import caches
+        caches[settings.API_CACHE['ALIAS']].clear()
+        self.now = datetime.utcnow().replace(microsecond=0)
+        self.insert([reading(self.now - timedelta(minutes=10 * index)) for index in range(1, 6)])
+
+    def add_reading(self, timestamp, device_id='field-1'):
+        from .api_cache import bump_generation
+        self.insert([reading(timestamp, device_id)])
+        # Comme l'ingestion : les validateurs en cache sont invalidés
+        bump_generation()
+
+    def test_unchanged_window_is_answered_with_304(self):
+        first = self.client.get('/api/statistics/', {'hours': 24})
+        self.assertEqual(first.status_code, 200)
+        self.assertIn('no-cache', first['Cache-Control'])
+        etag = first['ETag']
+        self.assertEqual(self.client.get('/api/statistics/', {'hours': 24}, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        # Autres paramètres : autre représentation
+        self.assertNotEqual(self.client.get('/api/statistics/', {'hours': 12})['ETag'], etag)
+
+        self.add_reading(self.now)
+        changed = self.client.get('/api/statistics/', {'hours': 24}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed['ETag'], etag)
+
+    def test_realtime_revalidates_on_the_newest_reading(self):
+        first = self.client.get('/dashboard/api/realtime/')
+        last_modified = first['Last-Modified']
+        self.assertEqual(self.client.get('/dashboard/api/realtime/',
+                                         HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 304)
+        self.add_reading(self.now + timedelta(minutes=1), 'field-2')
+        self.assertEqual(self.client.get('/dashboard/api/realtime/',
+                                         HTTP_IF_NONE_MATCH=first['ETag']).status_code, 200)
+
+
+class HotTierTests(MongoTestCase):
+    """Per-device rings answering recent windows without MongoDB"""
+
+    def setUp(self):
+        super().setUp()
+        self.now = datetime.utcnow().replace(microsecond=0)
+        self.readings = [reading(self.now - timedelta(minutes=15 * index), device,
+                                 humidity_soil=30.0 + index + offset)
+                         for index in range(8) for offset, device in enumerate(('field-1', 'field-2'))]
+        self.insert(self.readings)
+
+    def tier(self, capacity=100, max_devices=10):
+        from .hot_tier import HotTier
+        tier = HotTier(hours=24, capacity=capacity, max_devices=max_devices)
+        tier.warm()
+        return tier
+
+    def test_warm_tier_matches_mongodb(self):
+        from .statistics import _raw_statistics, window_statistics
+        tier = self.tier()
+        start, end = self.now - timedelta(hours=1), self.now
+        for device_id in (None, 'field-2'):
+            memory = tier.statistics(start, end, device_id)
+            raw = _raw_statistics(start, end, device_id)
+            self.assertEqual(memory['source'], 'hot_tier')
+            self.assertEqual(memory['count'], raw['count'])
+            self.assertEqual(memory['humidity_soil'], raw['humidity_soil'])
+            self.assertEqual(memory['latest']['timestamp'], raw['latest']['timestamp'])
+        with mock.patch('sensor_data.statistics.hot_tier', tier):
+            self.assertEqual(window_statistics(start, end, 'field-1')['source'], 'hot_tier')
+        self.assertEqual(tier.latest('field-1')['humidity_soil'], 30.0)
+
+    def test_replayed_reading_replaces_its_slot_and_late_one_limits_coverage(self):
+        tier = self.tier()
+        start = self.now - timedelta(hours=1)
+        tier.add([reading(self.now, 'field-1', humidity_soil=50.0)])
+        self.assertEqual(tier.statistics(start, self.now, 'field-1')['count'], 5)
+        self.assertEqual(tier.latest('field-1')['humidity_soil'], 50.0)
+
+        # Lecture plus ancienne jamais vue (rejeu) : non stockée, la fenêtre qui la contient part en MongoDB
+        tier.add([reading(self.now - timedelta(minutes=20), 'field-1')])
+        self.assertIsNone(tier.statistics(start, self.now, 'field-1'))
+        self.assertIsNotNone(tier.statistics(self.now - timedelta(minutes=10), self.now, 'field-1'))
+        self.assertEqual(tier.get_stats()['late_readings'], 1)
+
+    def test_evicted_and_refused_readings_fall_back(self):
+        tier = self.tier(capacity=3, max_devices=1)
+        self.assertTrue(tier.get_stats()['saturated'])
+        self.assertIsNone(tier.statistics(self.now - timedelta(minutes=30), self.now))
+        self.assertIsNone(tier.statistics(self.now - timedelta(minutes=30), self.now, 'field-2'))
+        self.assertEqual(tier.statistics(self.now - timedelta(minutes=30), self.now, 'field-1')['count'], 3)
+        self.assertIsNone(tier.statistics(self.now - timedelta(minutes=45), self.now, 'field-1'))
+        self.assertIsNone(tier.columns(self.now - timedelta(days=2), self.now, 'field-1'))
+
+
+class StreamingCsvExportTests(MongoTestCase):
+    """scripts/export_to_csv.py, written batch by batch from the raw cursor"""
+
+    def setUp(self):
+        super().setUp()
+        self.output = tempfile.mkdtemp(prefix='export_')
+        self.addCleanup(shutil.rmtree, self.output, ignore_errors=True)
+        self.insert(hourly_readings(datetime(2024, 5, 1), 12))
+
+    def export(self, name, **kwargs):
+        from export_to_csv import export_sensor_data_to_csv
+        path = os.path.join(self.output, name)
+        with redirect_stdout(io.StringIO()):
+            return export_sensor_data_to_csv(path, batch_size=5, **kwargs), path
+
+    def test_rows_of_every_batch_newest_first(self):
+        ok, path = self.export('readings.csv')
+        self.assertTrue(ok)
+        rows = read_csv(path)
+        self.assertEqual(list(rows[0]), ['timestamp', 'temperature', 'humidity_air', 'rain_forecast',
+                                         'humidity_soil'])
+        self.assertEqual(len(rows), 24)
+        self.assertEqual(rows[0]['timestamp'], '2024-05-01T11:00:00')
+        self.assertEqual(rows[-1]['timestamp'], '2024-05-01T00:00:00')
+
+    def test_gzip_output_is_reproducible(self):
+        _, path = self.export('readings.csv.gz')
+        with open(path, 'rb') as first:
+            compressed = first.read()
+        with gzip.open(path, 'rt', newline='', encoding='utf-8') as csvfile:
+            self.assertEqual(len(list(csv.DictReader(csvfile))), 24)
+        # Relancé plus tard : pas d'horodatage dans l'en-tête gzip
+        with mock.patch('gzip.time.time', return_value=2e9):
+            _, again = self.export('readings.csv.gz', compress=True)
+        with open(again, 'rb') as second:
+            self.assertEqual(second.read(), compressed)
+
+    def test_single_sided_range_and_empty_export(self):
+        ok, path = self.export('recent.csv', start_date=datetime(2024, 5, 1, 9))
+        self.assertTrue(ok)
+        self.assertEqual({row['timestamp'] for row in read_csv(path)},
+                         {'2024-05-01T09:00:00', '2024-05-01T10:00:00', '2024-05-01T11:00:00'})
+        self.assertFalse(self.export('empty.csv', end_date=datetime(2024, 4, 30))[0])
+
+
+class ColumnarExportTests(MongoTestCase):
+    """scripts/export_to_csv.py --format parquet/arrow, partitioned by period and device"""
+
+    def setUp(self):
+        super().setUp()
+        from export_to_csv import pa
+        if pa is None:
+            self.skipTest('pyarrow absent')
+        self.output = tempfile.mkdtemp(prefix='columnar_')
+        self.addCleanup(shutil.rmtree, self.output, ignore_errors=True)
+        self.insert(hourly_readings(datetime(2024, 5, 1, 20), 8, devices=('field-1', 'serre/nord')))
+
+    def export(self, file_format, **kwargs):
+        from export_to_csv import export_sensor_data_to_csv
+        path = os.path.join(self.output, file_format)
+        with redirect_stdout(io.StringIO()):
+            self.assertTrue(export_sensor_data_to_csv(path, batch_size=3, file_format=file_format, **kwargs))
+        return path
+
+    def test_daily_parquet_partitions_with_native_types(self):
+        import pyarrow as pa
+        import pyarrow.dataset as ds
+        path = self.export('parquet', partition='day')
+        self.assertEqual(sorted(os.listdir(path)), ['date=2024-05-01', 'date=2024-05-02'])
+        self.assertEqual(sorted(os.listdir(os.path.join(path, 'date=2024-05-02'))),
+                         ['device_id=field-1', 'device_id=serre%2Fnord'])
+        table = ds.dataset(path, format='parquet', partitioning='hive').to_table()
+        self.assertEqual(table.num_rows, 16)
+        self.assertEqual(table.schema.field('timestamp').type, pa.timestamp('ms', tz='UTC'))
+        self.assertEqual(table.schema.field('humidity_soil').type, pa.float32())
+        first_day = ds.dataset(os.path.join(path, 'date=2024-05-01'), format='parquet').to_table()
+        self.assertEqual(first_day.num_rows, 8)
+
+    def test_arrow_files_hold_the_same_rows(self):
+        import pyarrow.dataset as ds
+        table = ds.dataset(self.export('arrow'), format='ipc', partitioning='hive').to_table()
+        self.assertEqual(table.num_rows, 16)
+        rows = sorted(zip(table['timestamp'].to_pylist(), table['humidity_soil'].to_pylist()))
+        self.assertEqual(rows[0][0].replace(tzinfo=None), datetime(2024, 5, 1, 20))
+        self.assertAlmostEqual(rows[0][1], 30.0, places=5)
+
+
+class ParallelExportTests(MongoTestCase):
+    """scripts/export_to_csv.py --workers, time slices exported independently"""
+
+    def setUp(self):
+        super().setUp()
+        self.output = tempfile.mkdtemp(prefix='parallel_')
+        self.addCleanup(shutil.rmtree, self.output, ignore_errors=True)
+        self.insert(hourly_readings(datetime(2024, 5, 30), 24 * 5))
+        # Les workers spawn ouvriraient une vraie connexion MongoDB : threads sur la base mongomock
+        patcher = mock.patch('export_to_csv.ProcessPoolExecutor',
+                             lambda max_workers, mp_context: ThreadPoolExecutor(max_workers))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_slices_cover_the_range_without_overlap(self):
+        from export_to_csv import time_slices
+        slices = time_slices(datetime(2024, 1, 30, 12), datetime(2024, 3, 2), 'month')
+        self.assertEqual([start for start, _ in slices],
+                         [datetime(2024, 1, 30, 12), datetime(2024, 2, 1), datetime(2024, 3, 1)])
+        self.assertEqual(slices[0][1], datetime(2024, 2, 1) - timedelta(milliseconds=1))
+        self.assertEqual(slices[-1][1], datetime(2024, 3, 2))
+        self.assertEqual(len(time_slices(datetime(2024, 12, 31), datetime(2025, 1, 2), 'day')), 3)
+
+    def test_merged_csv_matches_the_sequential_export(self):
+        from export_to_csv import export_parallel, export_sensor_data_to_csv
+        sequential = os.path.join(self.output, 'sequential.csv')
+        parallel = os.path.join(self.output, 'parallel.csv')
+        with redirect_stdout(io.StringIO()):
+            self.assertTrue(export_sensor_data_to_csv(sequential))
+            self.assertTrue(export_parallel(parallel, None, None, workers=3, partition='day'))
+        with open(sequential, 'rb') as expected, open(parallel, 'rb') as merged:
+            self.assertEqual(merged.read(), expected.read())
+        self.assertEqual(sorted(os.listdir(self.output)), ['parallel.csv', 'sequential.csv'])
+
+    def test_unmerged_slices_are_named_after_their_period(self):
+        from export_to_csv import export_parallel
+        directory = os.path.join(self.output, 'slices')
+        with redirect_stdout(io.StringIO()):
+            self.assertTrue(export_parallel(directory, datetime(2024, 5, 30), datetime(2024, 6, 3, 23),
+                                            workers=2, merge=False))
+        self.assertEqual(sorted(os.listdir(directory)), ['2024-05-30.csv', '2024-06-01.csv'])
+        self.assertEqual(sum(len(read_csv(os.path.join(directory, name))) for name in os.listdir(directory)), 240)
@@ -18,5 +18,9 @@ urlpatterns = [
     path('api/chart-data/', dashboard_views.api_chart_data, name='api_chart_data'),
     path('api/realtime/', dashboard_views.api_realtime_data, name='api_realtime_data'),
     path('api/statistics/', dashboard_views.api_statistics_summary, name='api_statistics_summary'),
+    path('api/stream/', dashboard_views.api_stream, name='api_stream'),
+    path('api/stream/stats/', dashboard_views.api_stream_stats, name='api_stream_stats'),
+    path('api/hot-tier/stats/', dashboard_views.api_hot_tier_stats, name='api_hot_tier_stats'),
+    path('api/cache/stats/', dashboard_views.api_cache_stats, name='api_cache_stats'),
     
 ]
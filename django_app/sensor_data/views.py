@@ -1,21 +1,31 @@
-nofrom django.http import JsonResponse
+from django.conf import settings
+from django.http import JsonResponse, StreamingHttpResponse
 from django.views.decorators.http import require_http_methods
 from datetime import datetime, timedelta
 import json
 
 from .models import SensorData
+from .pagination import InvalidCursor, encode_cursor, decode_cursor
+from .conditional import window_condition, hours_window
+from .api_cache import cache_response, int_param, text_param
+from .rollups import FIELDS
+from .statistics import window_statistics
 
 @require_http_methods(["GET"])
+@cache_response('latest_readings', limit=int_param(10), device_id=text_param)
 def get_latest_readings(request):
     """API endpoint to get latest sensor readings"""
     try:
         limit = int(request.GET.get('limit', 10))
-        readings = SensorData.get_latest_readings(limit)
+        device_id = request.GET.get('device_id')
+        # Dicts bruts projetés : pas de Document mongoengine par lecture
+        readings = [SensorData.raw_to_dict(document)
+                    for document in SensorData.raw_readings(device_id=device_id, limit=limit)]
         
         data = {
             'status': 'success',
             'count': len(readings),
-            'data': [reading.to_dict() for reading in readings]
+            'data': readings
         }
         
         return JsonResponse(data)
@@ -26,9 +36,30 @@ def get_latest_readings(request):
             'message': str(e)
         }, status=500)
 
+# Lignes NDJSON regroupées par écriture dans la réponse streamée
+NDJSON_CHUNK = 500
+
+def ndjson_lines(cursor):
+    """Serialize raw readings as NDJSON while the cursor yields them (constant memory)"""
+    lines = []
+    for document in cursor:
+        lines.append(json.dumps(SensorData.raw_to_dict(document)))
+        if len(lines) >= NDJSON_CHUNK:
+            yield '\n'.join(lines) + '\n'
+            lines = []
+    if lines:
+        yield '\n'.join(lines) + '\n'
+
 @require_http_methods(["GET"])
+@cache_response('readings_by_date', skip=lambda request: request.GET.get('format') == 'ndjson',
+                start_date=text_param, end_date=text_param, device_id=text_param, cursor=text_param,
+                page_size=int_param(settings.SENSOR_STORAGE['PAGE_SIZE']))
 def get_readings_by_date(request):
-    """API endpoint to get readings by date range"""
+    """API endpoint to get readings by date range
+    
+    Paginated by (timestamp, _id): ``page_size`` readings per page, ``next_cursor`` to pass back
+    as ``cursor`` for the next one. ``format=ndjson`` streams the whole range instead.
+    """
     try:
         # Get date parameters
         start_date_str = request.GET.get('start_date')
@@ -42,7 +73,24 @@ def get_readings_by_date(request):
             start_date = datetime.fromisoformat(start_date_str.replace('Z', '+00:00'))
             end_date = datetime.fromisoformat(end_date_str.replace('Z', '+00:00'))
         
-        readings = SensorData.get_readings_by_date_range(start_date, end_date)
+        device_id = request.GET.get('device_id')
+        token = request.GET.get('cursor')
+        after = decode_cursor(token) if token else None
+        
+        # Flux NDJSON : une lecture par ligne, écrite au fil du curseur
+        if request.GET.get('format') == 'ndjson':
+            cursor = SensorData.keyset_readings(start_date, end_date, device_id=device_id, after=after)
+            return StreamingHttpResponse(ndjson_lines(cursor), content_type='application/x-ndjson')
+        
+        storage = settings.SENSOR_STORAGE
+        page_size = int(request.GET.get('page_size', storage['PAGE_SIZE']))
+        page_size = max(1, min(page_size, storage['MAX_PAGE_SIZE']))
+        # Une lecture de plus que la page pour savoir s'il en reste, sans requête count
+        documents = list(SensorData.keyset_readings(start_date, end_date, device_id=device_id, after=after,
+                                                    limit=page_size + 1))
+        has_more = len(documents) > page_size
+        documents = documents[:page_size]
+        readings = [SensorData.raw_to_dict(document) for document in documents]
         
         data = {
             'status': 'success',
@@ -51,11 +99,19 @@ def get_readings_by_date(request):
                 'start': start_date.isoformat(),
                 'end': end_date.isoformat()
             },
-            'data': [reading.to_dict() for reading in readings]
+            'page_size': page_size,
+            'next_cursor': encode_cursor(documents[-1]) if has_more else None,
+            'data': readings
         }
         
         return JsonResponse(data)
     
+    except InvalidCursor as e:
+        return JsonResponse({
+            'status': 'error',
+            'message': str(e)
+        }, status=400)
+    
     except Exception as e:
         return JsonResponse({
             'status': 'error',
@@ -63,55 +119,41 @@ def get_readings_by_date(request):
         }, status=500)
 
 @require_http_methods(["GET"])
+@window_condition(hours_window)
+@cache_response('statistics', hours=int_param(24), device_id=text_param)
 def get_statistics(request):
-    """API endpoint to get basic statistics"""
+    """API endpoint to get basic statistics (window in hours, default 24)"""
     try:
-        # Get readings from last 24 hours
+        hours = int(request.GET.get('hours', 24))
         end_date = datetime.utcnow()
-        start_date = end_date - timedelta(days=1)
-        readings = list(SensorData.get_readings_by_date_range(start_date, end_date))
+        start_date = end_date - timedelta(hours=hours)
+        device_id = request.GET.get('device_id')
+        
+        # Une seule agrégation MongoDB (ou les rollups pour les longues fenêtres)
+        summary = window_statistics(start_date, end_date, device_id)
         
-        if not readings:
+        if not summary:
             return JsonResponse({
                 'status': 'success',
                 'message': 'No data available',
                 'data': {}
             })
         
-        # Calculate statistics
-        temperatures = [r.temperature for r in readings]
-        humidity_air = [r.humidity_air for r in readings]
-        humidity_soil = [r.humidity_soil for r in readings]
-        rain_forecasts = [r.rain_forecast for r in readings]
-        
         stats = {
-            'total_readings': len(readings),
-            'latest_reading': readings[0].to_dict(),
-            'temperature': {
-                'avg': sum(temperatures) / len(temperatures),
-                'min': min(temperatures),
-                'max': max(temperatures)
-            },
-            'humidity_air': {
-                'avg': sum(humidity_air) / len(humidity_air),
-                'min': min(humidity_air),
-                'max': max(humidity_air)
-            },
-            'humidity_soil': {
-                'avg': sum(humidity_soil) / len(humidity_soil),
-                'min': min(humidity_soil),
-                'max': max(humidity_soil)
-            },
-            'rain_forecast': {
-                'avg': sum(rain_forecasts) / len(rain_forecasts),
-                'min': min(rain_forecasts),
-                'max': max(rain_forecasts)
-            }
+            'total_readings': summary['count'],
+            'latest_reading': SensorData._from_son(summary['latest']).to_dict()
         }
+        for field in FIELDS:
+            stats[field] = {
+                'avg': summary[field]['avg'],
+                'min': summary[field]['min'],
+                'max': summary[field]['max']
+            }
         
         data = {
             'status': 'success',
-            'period': '24 hours',
+            'period': f'{hours} hours',
+            'source': summary['source'],
             'data': stats
         }
         
@@ -122,4 +164,3 @@ def get_statistics(request):
             'status': 'error',
             'message': str(e)
         }, status=500)
- 
\ No newline at end of file
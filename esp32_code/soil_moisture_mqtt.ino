@@ -26,6 +26,18 @@ const char* status_topic = "esp32/status";
 // --- Intervalle d’envoi ---
 const unsigned long READING_INTERVAL = 10000;
 
+// --- Format du payload ---
+// 0 = JSON (défaut), 1 = binaire compact v1 (10 octets, voir mqtt_handler/payload.py)
+#define USE_BINARY_PAYLOAD 0
+
+struct __attribute__((packed)) SoilPayloadV1 {
+  uint8_t magic;          // 0xA5
+  uint8_t version;        // 1
+  int16_t wifi_rssi;      // dBm
+  uint16_t humidity_soil; // centièmes de %
+  uint32_t uptime_ms;
+};
+
 // --- Objects ---
 WiFiClient espClient; // Non-TLS client
 PubSubClient client(espClient);
@@ -102,6 +114,19 @@ void connectMQTT() {
 void sendSoilData() {
   float humidity_soil = random(300, 700) / 10.0;
 
+#if USE_BINARY_PAYLOAD
+  // ESP32 little-endian : la structure est envoyée telle quelle
+  SoilPayloadV1 packet;
+  packet.magic = 0xA5;
+  packet.version = 1;
+  packet.wifi_rssi = WiFi.RSSI();
+  packet.humidity_soil = (uint16_t)(humidity_soil * 100.0 + 0.5);
+  packet.uptime_ms = millis();
+
+  client.publish(soil_topic, (const uint8_t*)&packet, sizeof(packet));
+  Serial.print("📡 Published binary payload, humidity_soil=");
+  Serial.println(humidity_soil);
+#else
   DynamicJsonDocument doc(200);
   doc["humidity_soil"] = humidity_soil;
   doc["wifi_rssi"] = WiFi.RSSI();
@@ -113,4 +138,5 @@ void sendSoilData() {
   client.publish(soil_topic, payload.c_str());
   Serial.print("📡 Published: ");
   Serial.println(payload);
+#endif
 }
\ No newline at end of file
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Taille et temps de chargement d'un export d'entraînement : CSV vs Parquet / Arrow
+
+Exporte la même fenêtre (features ML) en CSV, CSV gzip, Parquet et Arrow IPC
+dans un répertoire temporaire, puis mesure la taille sur disque et le temps
+de chargement côté entraînement (médiane) : CSV relu et converti en colonnes
+typées (horodatages, flottants), jeux de données en colonnes lus avec
+pyarrow.dataset.
+
+    python scripts/bench_export_formats.py --last-days 90 --repeat 3
+"""
+
+import os
+import sys
+import csv
+import gzip
+import time
+import shutil
+import argparse
+import tempfile
+import statistics
+from datetime import datetime, timedelta
+
+# Add Django project to path
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'django_app'))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'esp32_iot.settings')
+
+import django
+django.setup()
+
+from export_to_csv import export_training_features, pa
+
+INTEGER_COLUMNS = {'hour_of_day', 'day_of_week', 'month', 'is_rain_predicted'}
+
+
+def disk_size(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(folder, name))
+               for folder, _, names in os.walk(path) for name in names)
+
+
+def load_csv(path):
+    """Colonnes typées d'un export CSV (ce que fait un chargeur d'entraînement à chaque epoch)"""
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt', newline='', encoding='utf-8') as csvfile:
+        reader = csv.reader(csvfile)
+        header = next(reader)
+        columns = [[] for _ in header]
+        for row in reader:
+            for column, value in zip(columns, row):
+                column.append(value)
+    parsed = []
+    for name, column in zip(header, columns):
+        if name == 'timestamp':
+            parsed.append([datetime.fromisoformat(value) for value in column])
+        elif name in ('device_id', 'season'):
+            parsed.append(column)
+        elif name in INTEGER_COLUMNS:
+            parsed.append([int(value) for value in column])
+        else:
+            parsed.append([float(value) for value in column])
+    return len(parsed[0])
+
+
+def load_dataset(path, file_format):
+    import pyarrow.dataset as ds
+    return ds.dataset(path, format='parquet' if file_format == 'parquet' else 'ipc',
+                      partitioning='hive').to_table().num_rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bench des formats d'export d'entraînement")
+    parser.add_argument('--last-days', type=int, default=90, help='Fenêtre exportée (jours)')
+    parser.add_argument('--partition', choices=['day', 'month'], default='month', help='Partitions en colonnes')
+    parser.add_argument('--repeat', type=int, default=3, help='Chargements par format (médiane retenue)')
+    args = parser.parse_args()
+
+    if pa is None:
+        print("❌ pyarrow n'est pas installé (pip install pyarrow)")
+        return 1
+
+    end = datetime.utcnow()
+    start = end - timedelta(days=args.last_days)
+    workdir = tempfile.mkdtemp(prefix='bench_export_')
+    outputs = [
+        ('csv', os.path.join(workdir, 'features.csv'), 'csv'),
+        ('csv.gz', os.path.join(workdir, 'features.csv.gz'), 'csv'),
+        ('parquet', os.path.join(workdir, 'parquet'), 'parquet'),
+        ('arrow', os.path.join(workdir, 'arrow'), 'arrow'),
+    ]
+    try:
+        results = []
+        for label, path, file_format in outputs:
+            started = time.perf_counter()
+            if not export_training_features(path, start, end, file_format=file_format, partition=args.partition):
+                print(f"❌ Export {label} impossible")
+                return 1
+            export_seconds = time.perf_counter() - started
+            timings = []
+            rows = 0
+            for _ in range(args.repeat):
+                started = time.perf_counter()
+                rows = load_csv(path) if file_format == 'csv' else load_dataset(path, file_format)
+                timings.append(time.perf_counter() - started)
+            results.append((label, rows, disk_size(path), export_seconds, statistics.median(timings)))
+
+        print()
+        print(f"{'format':<10} {'lignes':>10} {'taille':>12} {'export':>10} {'chargement':>12} {'vs csv':>8}")
+        csv_size, csv_load = results[0][2], results[0][4]
+        for label, rows, size, export_seconds, load_seconds in results:
+            ratio = f"{csv_load / load_seconds:.1f}x" if load_seconds else '-'
+            print(f"{label:<10} {rows:>10} {size / 1024:>9,.0f} Ko {export_seconds:>8.2f} s "
+                  f"{load_seconds * 1000:>9.1f} ms {ratio:>8}")
+        print(f"\nTaille CSV / Parquet : {csv_size / max(results[2][2], 1):.1f}x")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""
+Calcul des features d'entraînement : ancienne boucle par ligne vs pipeline numpy
+
+Génère des lectures horaires synthétiques (plusieurs appareils, pluie
+intermittente), puis mesure (meilleur temps de N répétitions, le bruit d'une
+machine partagée ne faisant qu'allonger les temps) :
+
+- calcul des features : l'ancienne boucle Python de export_training_features
+  sur les dicts du curseur (12 colonnes de base, une ligne à la fois) contre
+  FeaturePipeline.compute sur les pages en colonnes (toutes les colonnes de
+  FEATURE_COLUMNS, avec moyennes glissantes, décalages, deltas, cumuls de
+  pluie et temps depuis la pluie) ;
+- de bout en bout depuis les lots BSON du curseur : décodage en dicts
+  (bson.decode_all) + boucle, contre décodage en colonnes par pymongoarrow
+  (bson_arrays) + calcul, et le repli sans pymongoarrow (dicts puis
+  page_arrays). Le décodage BSON, commun aux deux chemins, borne le gain
+  de bout en bout.
+
+Aucune base n'est nécessaire.
+
+    python scripts/bench_feature_pipeline.py --rows 1000000 --devices 10
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+from datetime import datetime, timedelta
+
+import bson
+
+# Add Django project to path
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'django_app'))
+
+# Module sans dépendance Django : pas de django.setup()
+from sensor_data.features import FEATURE_COLUMNS, FeaturePipeline, PyMongoArrowContext, bson_arrays, page_arrays
+
+
+def synthetic_readings(rows, devices):
+    """Raw documents in chronological order, ``devices`` readings per hour"""
+    random.seed(42)
+    start = datetime(2020, 1, 1)
+    names = [f"field-{index}" for index in range(devices)]
+    readings = []
+    for index in range(rows):
+        raining = random.random() < 0.1
+        readings.append({
+            'device_id': names[index % devices],
+            'timestamp': start + timedelta(hours=index // devices),
+            'temperature': random.uniform(-5, 35),
+            'humidity_air': random.uniform(20, 100),
+            'rain_forecast': random.uniform(0.1, 8) if raining else 0.0,
+            'humidity_soil': random.uniform(10, 60),
+        })
+    return readings
+
+
+def legacy_feature_rows(records):
+    """Boucle par ligne d'avant le pipeline (copie de référence, sans isoformat)"""
+    for record in records:
+        timestamp = record['timestamp']
+        month = timestamp.month
+        if month in [12, 1, 2]:
+            season = 'winter'
+        elif month in [3, 4, 5]:
+            season = 'spring'
+        elif month in [6, 7, 8]:
+            season = 'summer'
+        else:
+            season = 'autumn'
+        temperature = float(record['temperature'])
+        humidity_air = float(record['humidity_air'])
+        rain_forecast = float(record['rain_forecast'])
+        humidity_soil = float(record['humidity_soil'])
+        yield (
+            timestamp,
+            temperature,
+            humidity_air,
+            rain_forecast,
+            humidity_soil,
+            timestamp.hour,
+            timestamp.weekday(),
+            month,
+            round(temperature / max(humidity_air, 1), 2),
+            round(humidity_soil - humidity_air, 2),
+            1 if rain_forecast > 0 else 0,
+            season
+        )
+
+
+def pages(readings, batch_size):
+    return [readings[start:start + batch_size] for start in range(0, len(readings), batch_size)]
+
+
+def bson_batches(readings, batch_size):
+    """Raw cursor batches: documents encoded back to back, as find_raw_batches() returns them"""
+    return [b''.join(map(bson.encode, page)) for page in pages(readings, batch_size)]
+
+
+def run_legacy(pages):
+    for page in pages:
+        for _ in legacy_feature_rows(page):
+            pass
+
+
+def run_compute(pages):
+    pipeline = FeaturePipeline()
+    for page in pages:
+        pipeline.compute(page)
+
+
+def run_extraction(pages):
+    for page in pages:
+        page_arrays(page)
+
+
+def run_dicts(pages):
+    pipeline = FeaturePipeline()
+    for page in pages:
+        pipeline.compute(page_arrays(page))
+
+
+def run_legacy_bson(batches):
+    for batch in batches:
+        for _ in legacy_feature_rows(bson.decode_all(batch)):
+            pass
+
+
+def run_dicts_bson(batches):
+    pipeline = FeaturePipeline()
+    for batch in batches:
+        pipeline.compute(page_arrays(bson.decode_all(batch)))
+
+
+def run_columnar_bson(batches):
+    pipeline = FeaturePipeline()
+    for batch in batches:
+        pipeline.compute(bson_arrays(batch))
+
+
+def measure(function, pages, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function(pages)
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Bench boucle par ligne vs pipeline de features vectorisé')
+    parser.add_argument('--rows', type=int, default=1_000_000, help='Nombre de lectures')
+    parser.add_argument('--devices', type=int, default=10, help="Nombre d'appareils")
+    parser.add_argument('--batch-size', type=int, default=20_000, help='Lectures par page du pipeline')
+    parser.add_argument('--repeat', type=int, default=5, help='Répétitions (meilleur temps retenu)')
+    args = parser.parse_args()
+
+    print(f"Génération de {args.rows} lectures ({args.devices} appareils)...")
+    readings = pages(synthetic_readings(args.rows, args.devices), args.batch_size)
+    arrays = [page_arrays(page) for page in readings]
+    batches = bson_batches([record for page in readings for record in page], args.batch_size)
+
+    legacy = measure(run_legacy, readings, args.repeat)
+    lines = [
+        ('calcul des features', None, None, None),
+        ('boucle par ligne (dicts)', 12, legacy, legacy),
+        ('calcul vectorisé (colonnes)', len(FEATURE_COLUMNS), measure(run_compute, arrays, args.repeat), legacy),
+        ('  dicts -> colonnes', '', measure(run_extraction, readings, args.repeat), legacy),
+        ('  pipeline sur dicts', len(FEATURE_COLUMNS), measure(run_dicts, readings, args.repeat), legacy),
+    ]
+    legacy_bson = measure(run_legacy_bson, batches, args.repeat)
+    lines += [
+        ('de bout en bout (lots BSON)', None, None, None),
+        ('décodage dicts + boucle', 12, legacy_bson, legacy_bson),
+        ('décodage dicts + pipeline', len(FEATURE_COLUMNS), measure(run_dicts_bson, batches, args.repeat),
+         legacy_bson),
+    ]
+    if PyMongoArrowContext is not None:
+        lines.append(('pymongoarrow + pipeline', len(FEATURE_COLUMNS),
+                      measure(run_columnar_bson, batches, args.repeat), legacy_bson))
+
+    print()
+    print(f"{'chemin':<30} {'colonnes':>9} {'temps':>10} {'lectures/s':>14} {'accélération':>13}")
+    for label, columns, seconds, reference in lines:
+        if seconds is None:
+            print(f"-- {label}")
+            continue
+        print(f"{label:<30} {columns:>9} {seconds:>8.2f} s {args.rows / seconds:>14,.0f} "
+              f"{reference / seconds:>12.1f}x")
+    if PyMongoArrowContext is None:
+        print("pymongoarrow absent : décodage des lots BSON en colonnes non mesuré")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
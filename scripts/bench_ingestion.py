@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Benchmark de l'ingestion MQTT : handler paho (file + workers) contre moteur asyncio
+
+Un "broker" local en mémoire rejoue N messages ESP32 sur D appareils ; aucune
+connexion réseau n'est ouverte et les documents agrégés restent en mémoire,
+on mesure donc uniquement le coût d'ingestion par message.
+
+    python scripts/bench_ingestion.py --messages 200000 --devices 500
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import logging
+import argparse
+
+# Add Django project to path
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'django_app'))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'esp32_iot.settings')
+
+import django
+django.setup()
+
+from django.conf import settings
+
+WEATHER = {'temperature': 21.0, 'humidity_air': 60.0, 'rain_forecast': 0.0}
+
+
+class StandInMessage:
+    """Minimal stand-in for paho's MQTTMessage"""
+    __slots__ = ('topic', 'payload')
+
+    def __init__(self, topic, payload):
+        self.topic = topic
+        self.payload = payload
+
+
+class NullCollection:
+    """Collection stand-in: counts inserted documents without any I/O"""
+    def __init__(self):
+        self.inserted = 0
+
+    async def insert_many(self, documents, ordered=False):
+        self.inserted += len(documents)
+
+
+def generate_messages(count, devices):
+    """Pre-built (topic, payload) pairs as the broker would deliver them"""
+    messages = []
+    for i in range(count):
+        device = f"esp32-{i % devices:05d}"
+        payload = json.dumps({
+            'humidity_soil': round(random.uniform(30.0, 70.0), 1),
+            'wifi_rssi': random.randint(-90, -40),
+            'uptime_ms': i * 10000,
+        }).encode()
+        messages.append((f"esp32/{device}/humidity_soil", payload))
+    return messages
+
+
+def bench_paho_handler(messages):
+    from mqtt_handler.mqtt_client import MQTTHandler
+
+    # Pas de perte de message pendant le benchmark
+    settings.INGESTION_SETTINGS['BACKPRESSURE'] = 'block'
+    handler = MQTTHandler()
+    handler.weather_client.cache.put(handler.weather_client.city, WEATHER)
+    handler.workers.start()
+
+    stand_ins = [StandInMessage(topic, payload) for topic, payload in messages]
+    started, cpu_started = time.perf_counter(), time.process_time()
+    for msg in stand_ins:
+        handler.on_message(None, None, msg)
+    while handler.workers.get_stats()['processed'] + handler.workers.get_stats()['errors'] < len(messages):
+        time.sleep(0.001)
+    elapsed, cpu = time.perf_counter() - started, time.process_time() - cpu_started
+
+    handler.workers.stop()
+    return elapsed, cpu
+
+
+def bench_async_engine(messages):
+    from mqtt_handler.async_engine import AsyncIngestionEngine
+
+    engine = AsyncIngestionEngine(collection=NullCollection())
+    engine.weather.put(engine.city, WEATHER)
+
+    async def broker():
+        for message in messages:
+            yield message
+
+    started, cpu_started = time.perf_counter(), time.process_time()
+    asyncio.run(engine.consume(broker()))
+    return time.perf_counter() - started, time.process_time() - cpu_started
+
+
+def report(name, count, elapsed, cpu):
+    print(f"{name:<24} {count / elapsed:>12,.0f} msg/s  "
+          f"{elapsed * 1e6 / count:>8.2f} µs/msg  cpu {cpu:.2f}s / wall {elapsed:.2f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de l'ingestion MQTT")
+    parser.add_argument('--messages', type=int, default=100000, help='Nombre de messages rejoués')
+    parser.add_argument('--devices', type=int, default=100, help="Nombre d'appareils simulés")
+    parser.add_argument('--engine', choices=['paho', 'asyncio', 'both'], default='both')
+    args = parser.parse_args()
+
+    # Le log DEBUG par message fausserait la mesure
+    logging.getLogger('mqtt_handler').setLevel(logging.INFO)
+
+    messages = generate_messages(args.messages, args.devices)
+    print(f"{args.messages} messages, {args.devices} appareils")
+    if args.engine in ('paho', 'both'):
+        report('paho + worker pool', args.messages, *bench_paho_handler(messages))
+    if args.engine in ('asyncio', 'both'):
+        report('asyncio engine', args.messages, *bench_async_engine(messages))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark du décodage des payloads MQTT (coût par message)
+
+Compare l'ancien chemin (decode() + json.loads + float) au décodeur actuel
+pour les payloads JSON, valeur brute et binaire v1.
+
+    python scripts/bench_payload_decode.py --number 200000
+"""
+
+import os
+import sys
+import json
+import timeit
+import argparse
+
+# Add Django project to path
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'django_app'))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'esp32_iot.settings')
+
+import django
+django.setup()
+
+from mqtt_handler import payload as payload_module
+from mqtt_handler.payload import decode_payload, encode_binary_v1
+
+JSON_PAYLOAD = json.dumps({'humidity_soil': 45.3, 'wifi_rssi': -61, 'uptime_ms': 3600123}).encode()
+RAW_PAYLOAD = b'45.3'
+BINARY_PAYLOAD = encode_binary_v1(45.3, -61, 3600123)
+
+
+def legacy_decode(raw):
+    """Chemin d'origine de on_message (texte intermédiaire + json.loads)"""
+    text = raw.decode()
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError:
+        data = None
+    if isinstance(data, dict):
+        return {'humidity_soil': float(data.get('humidity_soil', data.get('humidity', 0)))}
+    return {'humidity_soil': float(text)}
+
+
+def measure(name, func, raw, number, repeat):
+    best = min(timeit.repeat(lambda: func(raw), number=number, repeat=repeat))
+    per_message_ns = best / number * 1e9
+    print(f"{name:<28} {per_message_ns:>8.0f} ns/msg  {number / best:>12,.0f} msg/s  ({len(raw)} bytes)")
+    return per_message_ns
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Microbenchmark du décodage des payloads')
+    parser.add_argument('--number', type=int, default=100000, help='Décodages par mesure')
+    parser.add_argument('--repeat', type=int, default=5, help='Nombre de mesures (meilleure retenue)')
+    args = parser.parse_args()
+
+    fast_json = 'orjson' if payload_module._json_loads is not json.loads else 'json'
+    print(f"Décodeur JSON : {fast_json}")
+    measure('legacy  json', legacy_decode, JSON_PAYLOAD, args.number, args.repeat)
+    measure(f'current json ({fast_json})', decode_payload, JSON_PAYLOAD, args.number, args.repeat)
+    measure('legacy  raw number', legacy_decode, RAW_PAYLOAD, args.number, args.repeat)
+    measure('current raw number', decode_payload, RAW_PAYLOAD, args.number, args.repeat)
+    measure('current binary v1', decode_payload, BINARY_PAYLOAD, args.number, args.repeat)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+CPU et mémoire par requête des API de lecture : Documents mongoengine vs dicts bruts projetés
+
+Pour chaque endpoint et chaque fenêtre, compare l'ancien chemin (queryset ->
+Document -> to_dict / float) à la vue actuelle (raw_readings / raw_columns).
+Mesure le temps CPU du processus (process_time, médiane) et le pic
+d'allocation Python (tracemalloc). Les rollups sont désactivés pour comparer
+les lectures brutes.
+
+    python scripts/bench_read_paths.py --repeat 5 --windows 24 168 720
+"""
+
+import os
+import sys
+import time
+import argparse
+import statistics
+import tracemalloc
+from datetime import datetime, timedelta
+
+# Add Django project to path
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'django_app'))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'esp32_iot.settings')
+
+import django
+django.setup()
+
+from django.conf import settings
+from django.http import JsonResponse
+from django.test import RequestFactory
+
+from sensor_data import views, dashboard_views
+from sensor_data.models import SensorData
+
+
+def legacy_by_date(start_date, end_date):
+    """Ancienne implémentation de get_readings_by_date"""
+    readings = SensorData.get_readings_by_date_range(start_date, end_date)
+    return JsonResponse({
+        'status': 'success',
+        'count': len(readings),
+        'date_range': {'start': start_date.isoformat(), 'end': end_date.isoformat()},
+        'data': [reading.to_dict() for reading in readings]
+    })
+
+
+def legacy_chart(start_date, end_date):
+    """Ancienne implémentation de api_chart_data"""
+    readings = SensorData.get_readings_by_date_range(start_date, end_date)
+    chart_data = {'labels': [], 'datasets': {'temperature': [], 'humidity_air': [], 'humidity_soil': [],
+                                             'rain_forecast': []}}
+    for reading in readings:
+        chart_data['labels'].append(reading.timestamp.strftime('%H:%M'))
+        chart_data['datasets']['temperature'].append(float(reading.temperature))
+        chart_data['datasets']['humidity_air'].append(float(reading.humidity_air))
+        chart_data['datasets']['humidity_soil'].append(float(reading.humidity_soil))
+        chart_data['datasets']['rain_forecast'].append(float(reading.rain_forecast))
+    return JsonResponse({'status': 'success', 'data': chart_data, 'count': len(readings)})
+
+
+def legacy_latest(limit):
+    """Ancienne implémentation de get_latest_readings"""
+    readings = SensorData.get_latest_readings(limit)
+    return JsonResponse({'status': 'success', 'count': len(readings),
+                         'data': [reading.to_dict() for reading in readings]})
+
+
+def measure(func, repeat):
+    """(CPU ms médian, wall ms médian, pic mémoire Ko) d'un appel"""
+    cpu, wall = [], []
+    for _ in range(repeat):
+        started_cpu, started_wall = time.process_time(), time.perf_counter()
+        func()
+        cpu.append((time.process_time() - started_cpu) * 1000)
+        wall.append((time.perf_counter() - started_wall) * 1000)
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return statistics.median(cpu), statistics.median(wall), peak / 1024
+
+
+def report(name, legacy, current, repeat):
+    old = measure(legacy, repeat)
+    new = measure(current, repeat)
+    print(f"{name:<22} avant : {old[0]:8.1f} ms CPU {old[1]:8.1f} ms {old[2]:9,.0f} Ko | "
+          f"après : {new[0]:8.1f} ms CPU {new[1]:8.1f} ms {new[2]:9,.0f} Ko | CPU x{old[0] / max(new[0], 0.001):.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Bench CPU/mémoire des API de lecture')
+    parser.add_argument('--windows', type=int, nargs='+', default=[24, 168, 720], help='Fenêtres (heures)')
+    parser.add_argument('--limit', type=int, default=100, help='limit de readings/latest')
+    parser.add_argument('--repeat', type=int, default=5, help='Répétitions (médiane retenue)')
+    args = parser.parse_args()
+
+    settings.ROLLUP_SETTINGS['ENABLED'] = False
+    factory = RequestFactory()
+    end_date = datetime.utcnow()
+
+    report(f"latest limit={args.limit}", lambda: legacy_latest(args.limit),
+           lambda: views.get_latest_readings(factory.get('/', {'limit': args.limit})), args.repeat)
+    for hours in args.windows:
+        start_date = end_date - timedelta(hours=hours)
+        params = {'start_date': start_date.isoformat(), 'end_date': end_date.isoformat()}
+        count = SensorData.get_readings_by_date_range(start_date, end_date).count()
+        print(f"--- {hours} h ({count} lectures)")
+        report("readings/by-date", lambda: legacy_by_date(start_date, end_date),
+               lambda: views.get_readings_by_date(factory.get('/', params)), args.repeat)
+        report("api/chart-data", lambda: legacy_chart(start_date, end_date),
+               lambda: dashboard_views.api_chart_data(factory.get('/', {'hours': hours})), args.repeat)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Débit d'ingestion en fonction du nombre de processus consommateurs
+
+Lance 1, 2, 4... MQTTHandler derrière un abonnement partagé MQTT v5
+(mqtt_handler.launcher), publie un volume fixe de messages binaires v1
+répartis sur plusieurs appareils, puis mesure le temps mis par l'ensemble des
+processus pour les traiter. À lancer contre le broker EMQX du docker-compose :
+
+    docker-compose up -d emqx mongodb
+    MQTT_BROKER_HOST=localhost python scripts/bench_shared_consumers.py --processes 1 2 4 --messages 200000
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+import threading
+import multiprocessing
+
+# Add Django project to path
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'django_app'))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'esp32_iot.settings')
+
+import django
+django.setup()
+
+from django.conf import settings
+from mqtt_handler.launcher import start_consumers, stop_consumers
+from mqtt_handler.mqtt_client import create_client
+from mqtt_handler.payload import encode_binary_v1
+
+
+def publish(messages, devices, publishers):
+    """Publie ``messages`` lectures (QoS 0) depuis ``publishers`` connexions en parallèle"""
+    mqtt_settings = settings.MQTT_SETTINGS
+
+    def worker(count, seed):
+        rng = random.Random(seed)
+        client = create_client()
+        if mqtt_settings['USERNAME'] and mqtt_settings['PASSWORD']:
+            client.username_pw_set(mqtt_settings['USERNAME'], mqtt_settings['PASSWORD'])
+        client.max_queued_messages_set(0)
+        client.connect(mqtt_settings['BROKER_HOST'], mqtt_settings['BROKER_PORT'], 60)
+        client.loop_start()
+        for _ in range(count):
+            device = rng.randrange(devices)
+            payload = encode_binary_v1(rng.uniform(20, 80), -60, 1000)
+            client.publish(f"esp32/bench-{device:05d}/humidity_soil", payload, qos=0)
+        client.loop_stop()
+        client.disconnect()
+
+    share = messages // publishers
+    threads = [threading.Thread(target=worker, args=(share + (messages % publishers if i == 0 else 0), i))
+               for i in range(publishers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def run(processes, messages, devices, publishers, timeout):
+    progress = [multiprocessing.get_context('spawn').Value('q', 0) for _ in range(processes)]
+    group = f"bench-{os.getpid()}-{processes}"
+    consumers = start_consumers(processes, group, progress)
+    try:
+        # Laisse aux processus le temps de démarrer Django et de s'abonner
+        time.sleep(5)
+        started = time.perf_counter()
+        publish(messages, devices, publishers)
+        published = time.perf_counter() - started
+        deadline = started + timeout
+        while sum(counter.value for counter in progress) < messages and time.perf_counter() < deadline:
+            time.sleep(0.05)
+        elapsed = time.perf_counter() - started
+        processed = sum(counter.value for counter in progress)
+    finally:
+        stop_consumers(consumers)
+    per_process = ', '.join(str(counter.value) for counter in progress)
+    print(f"{processes:>3} processus : {processed:>9,}/{messages:,} messages en {elapsed:6.2f}s "
+          f"({processed / elapsed:>10,.0f} msg/s, publication {published:.2f}s) [{per_process}]")
+    return processed / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Bench des consommateurs MQTT en abonnement partagé')
+    parser.add_argument('--processes', type=int, nargs='+', default=[1, 2, 4], help='Nombres de processus à mesurer')
+    parser.add_argument('--messages', type=int, default=100000, help='Messages publiés par mesure')
+    parser.add_argument('--devices', type=int, default=500, help="Nombre d'appareils simulés")
+    parser.add_argument('--publishers', type=int, default=4, help='Connexions de publication')
+    parser.add_argument('--timeout', type=float, default=300, help='Durée maximale par mesure (s)')
+    args = parser.parse_args()
+
+    results = {n: run(n, args.messages, args.devices, args.publishers, args.timeout) for n in args.processes}
+    baseline = results[args.processes[0]]
+    for n, rate in results.items():
+        print(f"{n:>3} processus : x{rate / baseline:.2f}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Compare la collection classique et la collection time-series des lectures
+
+Affiche pour chaque collection la taille stockée (données + index) et la
+latence des lectures sur 24 h et 30 jours (se terminant à la lecture la plus
+récente), pour tous les appareils et pour un seul. Remplir d'abord la
+collection time-series avec ``python manage.py migrate_to_timeseries``.
+
+    python scripts/bench_storage_backends.py --repeat 5
+"""
+
+import os
+import sys
+import time
+import argparse
+import statistics
+from datetime import timedelta
+
+# Add Django project to path
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'django_app'))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'esp32_iot.settings')
+
+import django
+django.setup()
+
+from django.conf import settings
+from mongoengine.connection import get_db
+
+WINDOWS = [('24h', timedelta(hours=24)), ('30j', timedelta(days=30))]
+
+
+def storage(db, name):
+    stats = db.command('collStats', name)
+    return stats['count'], stats.get('storageSize', 0), stats.get('totalIndexSize', 0)
+
+
+def scan(collection, query, repeat):
+    """Médiane (ms) et nombre de documents d'un find() entièrement consommé"""
+    timings = []
+    count = 0
+    for _ in range(repeat):
+        started = time.perf_counter()
+        count = sum(1 for _ in collection.find(query).sort('timestamp', -1))
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings), count
+
+
+def main():
+    storage_settings = settings.SENSOR_STORAGE
+    parser = argparse.ArgumentParser(description='Bench stockage classique vs time-series')
+    parser.add_argument('--standard', default=storage_settings['COLLECTION'], help='Collection classique')
+    parser.add_argument('--timeseries', default=storage_settings['TIMESERIES_COLLECTION'], help='Collection time-series')
+    parser.add_argument('--device', help="Appareil pour les lectures filtrées (défaut : celui de la dernière lecture)")
+    parser.add_argument('--repeat', type=int, default=5, help='Répétitions par mesure (médiane retenue)')
+    args = parser.parse_args()
+
+    db = get_db()
+    layouts = [('standard', args.standard, 'device_id'), ('timeseries', args.timeseries, 'metadata.device_id')]
+    existing = set(db.list_collection_names())
+
+    newest = db[args.standard].find_one({}, sort=[('timestamp', -1)])
+    if newest is None:
+        print(f"❌ Collection '{args.standard}' vide")
+        return 1
+    end = newest['timestamp']
+    device = args.device or newest.get('device_id', 'default')
+
+    print(f"Fin des fenêtres : {end.isoformat()} | appareil filtré : {device}")
+    print()
+    print(f"{'collection':<12} {'documents':>10} {'stockage':>12} {'index':>12}")
+    for label, name, _ in layouts:
+        if name not in existing:
+            print(f"{label:<12} (collection '{name}' absente)")
+            continue
+        count, size, index_size = storage(db, name)
+        print(f"{label:<12} {count:>10} {size / 1024:>10,.0f} Ko {index_size / 1024:>10,.0f} Ko")
+
+    print()
+    print(f"{'collection':<12} {'fenêtre':<8} {'filtre':<10} {'documents':>10} {'médiane':>10}")
+    for label, name, device_field in layouts:
+        if name not in existing:
+            continue
+        for window, delta in WINDOWS:
+            time_range = {'timestamp': {'$gte': end - delta, '$lte': end}}
+            for filter_label, query in [('tous', time_range), ('appareil', dict(time_range, **{device_field: device}))]:
+                latency, count = scan(db[name], query, args.repeat)
+                print(f"{label:<12} {window:<8} {filter_label:<10} {count:>10} {latency:>8.1f} ms")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
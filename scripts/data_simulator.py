@@ -2,13 +2,23 @@
 """
 Simulateur de données IoT pour tester le dashboard
 Génère des données réalistes avec humidité du sol autour de 40%
+
+Le mode fleet simule une flotte d'ESP32 qui publient via MQTT (chemin
+d'ingestion complet) et mesure le débit de publication et la latence
+de bout en bout jusqu'à MongoDB :
+
+    python scripts/data_simulator.py --mode fleet --devices 2000 --publish-interval 5 --duration 300
 """
 
 import os
+import re
 import sys
+import json
 import time
 import random
+import asyncio
 import requests
+from collections import defaultdict
 from datetime import datetime, timedelta
 import argparse
 
@@ -19,7 +29,14 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'esp32_iot.settings')
 import django
 django.setup()
 
+from django.conf import settings
 from sensor_data.models import SensorData
+from mqtt_handler.payload import encode_binary_v1
+
+try:
+    import aiomqtt
+except ImportError:  # mode fleet uniquement
+    aiomqtt = None
 
 class IoTDataSimulator:
     def __init__(self):
@@ -110,6 +127,18 @@ class IoTDataSimulator:
         
         return round(final_humidity, 1)
 
+    @staticmethod
+    def get_season(timestamp):
+        """Saison (hémisphère nord) d'un timestamp"""
+        month = timestamp.month
+        if month in [12, 1, 2]:
+            return 'winter'
+        elif month in [3, 4, 5]:
+            return 'spring'
+        elif month in [6, 7, 8]:
+            return 'summer'
+        return 'autumn'
+
     def create_sample_reading(self, timestamp=None, use_real_weather=True):
         """Crée une lecture de capteur simulée"""
         if timestamp is None:
@@ -125,22 +154,11 @@ class IoTDataSimulator:
                 'rain_forecast': random.choice([0.0, 0.0, 0.0, 0.5, 1.2])
             }
         
-        # Déterminer la saison
-        month = timestamp.month
-        if month in [12, 1, 2]:
-            season = 'winter'
-        elif month in [3, 4, 5]:
-            season = 'spring'
-        elif month in [6, 7, 8]:
-            season = 'summer'
-        else:
-            season = 'autumn'
-        
         # Générer l'humidité du sol
         soil_humidity = self.generate_soil_humidity(
             weather_data, 
             timestamp.hour, 
-            season
+            self.get_season(timestamp)
         )
         
         # Créer l'enregistrement
@@ -264,13 +282,245 @@ class IoTDataSimulator:
         except Exception as e:
             print(f"❌ Erreur lors de l'affichage des statistiques: {e}")
 
+class FleetSimulator:
+    """Flotte d'ESP32 virtuels publiant via MQTT, une connexion par appareil
+
+    Chaque appareil publie toutes les ``publish_interval`` secondes (± ``jitter``)
+    une humidité issue de generate_soil_humidity. Une tempête de reconnexion
+    coupe simultanément ``storm_fraction`` de la flotte, qui se reconnecte
+    aussitôt. La latence de bout en bout est mesurée en interrogeant MongoDB :
+    quand le sample_count cumulé d'un appareil augmente, les lectures publiées
+    correspondantes (dans l'ordre) sont considérées comme ingérées, à
+    ``poll_interval`` près. Les lectures étant agrégées par fenêtre, lancer le
+    handler avec une fenêtre courte (INGESTION_AGGREGATION_WINDOW=10) pour
+    mesurer autre chose que la durée de la fenêtre.
+    """
+
+    def __init__(self, simulator, devices=1000, publish_interval=10.0, jitter=0.2, payload='json', qos=0,
+                 ramp_up=10.0, storm_interval=0.0, storm_fraction=0.5, poll_interval=2.0, report_interval=5.0):
+        self.simulator = simulator
+        self.devices = devices
+        self.publish_interval = publish_interval
+        self.jitter = jitter
+        self.payload = payload
+        self.qos = qos
+        self.ramp_up = ramp_up
+        self.storm_interval = storm_interval
+        self.storm_fraction = storm_fraction
+        self.poll_interval = poll_interval
+        self.report_interval = report_interval
+
+        # Préfixe propre à l'exécution : permet de retrouver ses lectures dans MongoDB
+        self.prefix = f"fleet-{datetime.utcnow().strftime('%Y%m%d%H%M%S')}-"
+        self.weather = None
+        self.published = defaultdict(list)
+        self.landed = defaultdict(int)
+        self.latencies = []
+        self.stats = {'published': 0, 'connected': 0, 'connects': 0, 'reconnects': 0, 'errors': 0, 'storms': 0}
+        self._storm = (0, frozenset())
+        self._wake = None
+        self._stopping = False
+        self._started = None
+
+    def make_payload(self, device_id, wifi_rssi, booted_at):
+        now = datetime.utcnow()
+        humidity = self.simulator.generate_soil_humidity(self.weather, now.hour, self.simulator.get_season(now))
+        uptime_ms = int((time.time() - booted_at) * 1000)
+        if self.payload == 'binary':
+            return encode_binary_v1(humidity, wifi_rssi, uptime_ms)
+        return json.dumps({'device_id': device_id, 'humidity_soil': humidity,
+                           'wifi_rssi': wifi_rssi, 'uptime_ms': uptime_ms})
+
+    async def _wait(self, delay):
+        """Dort ``delay`` secondes, ou jusqu'à la prochaine tempête / l'arrêt"""
+        try:
+            await asyncio.wait_for(self._wake.wait(), delay)
+        except asyncio.TimeoutError:
+            pass
+
+    def _wake_all(self):
+        wake, self._wake = self._wake, asyncio.Event()
+        wake.set()
+
+    async def device(self, index):
+        device_id = f"{self.prefix}{index:05d}"
+        topic = f"esp32/{device_id}/humidity_soil"
+        wifi_rssi = random.randint(-85, -45)
+        booted_at = time.time()
+        mqtt_settings = settings.MQTT_SETTINGS
+
+        # Mise sous tension étalée sur la montée en charge
+        await self._wait(random.uniform(0, self.ramp_up))
+        generation = self._storm[0]
+        while not self._stopping:
+            try:
+                async with aiomqtt.Client(mqtt_settings['BROKER_HOST'], mqtt_settings['BROKER_PORT'],
+                                          username=mqtt_settings['USERNAME'] or None,
+                                          password=mqtt_settings['PASSWORD'] or None,
+                                          identifier=device_id, keepalive=60) as client:
+                    self.stats['connects'] += 1
+                    self.stats['connected'] += 1
+                    try:
+                        disconnected = False
+                        while not self._stopping and not disconnected:
+                            await client.publish(topic, self.make_payload(device_id, wifi_rssi, booted_at),
+                                                 qos=self.qos)
+                            self.published[device_id].append(time.time())
+                            self.stats['published'] += 1
+                            next_at = time.monotonic() + self.publish_interval * random.uniform(1 - self.jitter,
+                                                                                                1 + self.jitter)
+                            # Réveillé par une tempête : seuls les appareils visés se déconnectent
+                            while not self._stopping and time.monotonic() < next_at:
+                                await self._wait(next_at - time.monotonic())
+                                if self._storm[0] != generation:
+                                    generation, targets = self._storm
+                                    if index in targets:
+                                        disconnected = True
+                                        break
+                    finally:
+                        self.stats['connected'] -= 1
+                if not self._stopping:
+                    self.stats['reconnects'] += 1
+            except Exception:
+                self.stats['errors'] += 1
+                await self._wait(random.uniform(1, 5))
+
+    async def _storms(self):
+        while not self._stopping:
+            await asyncio.sleep(self.storm_interval)
+            targets = frozenset(random.sample(range(self.devices), int(self.devices * self.storm_fraction)))
+            self._storm = (self._storm[0] + 1, targets)
+            self.stats['storms'] += 1
+            print(f"⚡ Tempête de reconnexion : {len(targets)} appareils déconnectés")
+            self._wake_all()
+
+    def ingested(self):
+        return sum(self.landed.values())
+
+    async def poll_ingested(self):
+        """Rapproche les lectures publiées de ce qui est arrivé dans MongoDB"""
+        collection = SensorData._get_collection()
+        pipeline = [
+            {'$match': {'device_id': {'$regex': f'^{re.escape(self.prefix)}'}}},
+            {'$group': {'_id': '$device_id', 'count': {'$sum': '$sample_count'}}},
+        ]
+        rows = await asyncio.to_thread(lambda: list(collection.aggregate(pipeline)))
+        now = time.time()
+        for row in rows:
+            sent = self.published.get(row['_id'], [])
+            landed = self.landed[row['_id']]
+            count = min(row['count'], len(sent))
+            self.latencies.extend(now - published_at for published_at in sent[landed:count])
+            self.landed[row['_id']] = max(landed, count)
+
+    async def _poller(self):
+        while True:
+            try:
+                await self.poll_ingested()
+            except Exception as e:
+                print(f"⚠️  Erreur lecture MongoDB: {e}")
+            await asyncio.sleep(self.poll_interval)
+
+    @staticmethod
+    def percentile(values, p):
+        if not values:
+            return 0.0
+        return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+    def latency_summary(self):
+        latencies = sorted(self.latencies)
+        return (f"p50 {self.percentile(latencies, 50):.2f}s | p95 {self.percentile(latencies, 95):.2f}s | "
+                f"p99 {self.percentile(latencies, 99):.2f}s")
+
+    async def _reporter(self):
+        last_published, last_time = 0, time.time()
+        while True:
+            await asyncio.sleep(self.report_interval)
+            now = time.time()
+            rate = (self.stats['published'] - last_published) / (now - last_time)
+            last_published, last_time = self.stats['published'], now
+            print(f"📡 {self.stats['connected']}/{self.devices} connectés | {self.stats['published']} publiés "
+                  f"({rate:,.0f} msg/s) | {self.ingested()} ingérés | latence {self.latency_summary()}")
+
+    @staticmethod
+    def _raise_fd_limit(wanted):
+        # Une socket par appareil : la limite par défaut (1024) est vite atteinte
+        try:
+            import resource
+            soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+            if soft < wanted:
+                resource.setrlimit(resource.RLIMIT_NOFILE, (min(wanted, hard), hard))
+        except (ImportError, ValueError, OSError):
+            pass
+
+    async def run(self, duration=60.0, drain=60.0):
+        if aiomqtt is None:
+            raise RuntimeError("Le mode fleet nécessite aiomqtt (pip install aiomqtt)")
+        self._raise_fd_limit(self.devices + 256)
+        self.weather = self.simulator.get_weather_data()
+        self._wake = asyncio.Event()
+        mqtt_settings = settings.MQTT_SETTINGS
+        print(f"🚀 Flotte de {self.devices} ESP32 -> {mqtt_settings['BROKER_HOST']}:{mqtt_settings['BROKER_PORT']} "
+              f"(toutes les {self.publish_interval}s ±{self.jitter:.0%}, payload {self.payload}, QoS {self.qos})")
+        print(f"🏷️  Préfixe des appareils : {self.prefix}")
+
+        self._started = time.time()
+        devices = [asyncio.create_task(self.device(index)) for index in range(self.devices)]
+        background = [asyncio.create_task(self._poller()), asyncio.create_task(self._reporter())]
+        if self.storm_interval > 0:
+            background.append(asyncio.create_task(self._storms()))
+
+        await asyncio.sleep(duration)
+        self._stopping = True
+        self._wake_all()
+        await asyncio.gather(*devices, return_exceptions=True)
+        publish_elapsed = time.time() - self._started
+
+        # Laisse l'ingestion rattraper (fenêtres d'agrégation, lots en attente)
+        deadline = time.time() + drain
+        while time.time() < deadline and self.ingested() < self.stats['published']:
+            await asyncio.sleep(self.poll_interval)
+        for task in background:
+            task.cancel()
+        await self.poll_ingested()
+        self.print_summary(publish_elapsed)
+
+    def print_summary(self, publish_elapsed):
+        published = self.stats['published']
+        ingested = self.ingested()
+        latencies = sorted(self.latencies)
+        print()
+        print("📊 Résultats du mode fleet")
+        print("=" * 40)
+        print(f"Appareils: {self.devices} | connexions: {self.stats['connects']} | "
+              f"reconnexions: {self.stats['reconnects']} | erreurs: {self.stats['errors']} | "
+              f"tempêtes: {self.stats['storms']}")
+        print(f"Publiés: {published} en {publish_elapsed:.1f}s ({published / publish_elapsed:,.0f} msg/s)")
+        print(f"Ingérés: {ingested}/{published} ({published - ingested} manquants)")
+        if latencies:
+            print(f"Latence bout en bout: {self.latency_summary()} | max {latencies[-1]:.2f}s "
+                  f"(résolution {self.poll_interval}s)")
+
+
 def main():
     parser = argparse.ArgumentParser(description='Simulateur de données IoT ESP32')
-    parser.add_argument('--mode', choices=['historical', 'continuous', 'single', 'stats'], 
+    parser.add_argument('--mode', choices=['historical', 'continuous', 'single', 'stats', 'fleet'], 
                         default='historical', help='Mode de simulation')
     parser.add_argument('--days', type=int, default=7, help='Nombre de jours pour les données historiques')
     parser.add_argument('--readings-per-day', type=int, default=48, help='Lectures par jour')
     parser.add_argument('--interval', type=int, default=30, help='Intervalle en secondes pour le mode continu')
+    # Mode fleet
+    parser.add_argument('--devices', type=int, default=1000, help="Nombre d'ESP32 simulés (mode fleet)")
+    parser.add_argument('--publish-interval', type=float, default=10.0, help='Secondes entre deux publications par appareil')
+    parser.add_argument('--jitter', type=float, default=0.2, help="Gigue relative de l'intervalle (0.2 = ±20%%)")
+    parser.add_argument('--payload', choices=['json', 'binary'], default='json', help='Format des payloads')
+    parser.add_argument('--qos', type=int, choices=[0, 1], default=0, help='QoS MQTT des publications')
+    parser.add_argument('--ramp-up', type=float, default=10.0, help='Durée de mise sous tension de la flotte (s)')
+    parser.add_argument('--duration', type=float, default=60.0, help='Durée de publication (s)')
+    parser.add_argument('--drain', type=float, default=60.0, help="Attente maximale de l'ingestion après publication (s)")
+    parser.add_argument('--storm-interval', type=float, default=0.0, help='Secondes entre tempêtes de reconnexion (0 = aucune)')
+    parser.add_argument('--storm-fraction', type=float, default=0.5, help='Part de la flotte coupée à chaque tempête')
+    parser.add_argument('--poll-interval', type=float, default=2.0, help='Intervalle de lecture MongoDB pour la latence (s)')
     
     args = parser.parse_args()
     
@@ -290,6 +540,23 @@ def main():
             print(f"   Pluie: {reading['rain_forecast']}mm")
     elif args.mode == 'stats':
         simulator.show_statistics()
+    elif args.mode == 'fleet':
+        fleet = FleetSimulator(
+            simulator,
+            devices=args.devices,
+            publish_interval=args.publish_interval,
+            jitter=args.jitter,
+            payload=args.payload,
+            qos=args.qos,
+            ramp_up=args.ramp_up,
+            storm_interval=args.storm_interval,
+            storm_fraction=args.storm_fraction,
+            poll_interval=args.poll_interval,
+        )
+        try:
+            asyncio.run(fleet.run(args.duration, args.drain))
+        except KeyboardInterrupt:
+            print("\n🛑 Simulation arrêtée par l'utilisateur")
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -2,13 +2,62 @@
 """
 Export script to extract sensor data from MongoDB and save to CSV format
 Suitable for AI/ML model training
+
+Rows are streamed from a projected pymongo cursor and written batch by batch,
+so memory stays flat whatever the number of readings; ``--gzip`` (or a
+``.gz`` output name) compresses on the fly.
+
+``--format parquet`` / ``--format arrow`` write a columnar dataset instead:
+one zstd-compressed file per period and device, in Hive-style directories
+(``date=2024-05/device_id=field-3/part-0.parquet``), with native column types
+(UTC timestamps, float32, small integers). Each cursor page is converted to an
+Arrow record batch in one go. Requires pyarrow.
+
+``--workers N`` splits the date range into month (or day, ``--partition``)
+slices exported by a pool of N processes, each with its own MongoDB
+connection. Slices never overlap, so columnar workers write disjoint
+partitions of the same dataset; CSV slices are concatenated in order into the
+output file, or kept as one file per slice with ``--no-merge``. The files
+produced do not depend on the number of workers.
+
+``--incremental`` appends to an output directory instead: a watermark (the
+(timestamp, _id) key of the last exported reading) is kept in
+``_watermark.json`` and each run exports only the readings after it, in a new
+partition (``run-000042.csv`` or ``.../run-000042.parquet``). The run's files
+are staged, moved into place, and only then is the watermark advanced: a run
+that crashes is redone from the same watermark, so no reading is exported
+twice or skipped. Readings newer than ``--settle`` seconds are left for the
+next run, since the ingestion may still be writing them.
 """
 
+import io
 import os
 import sys
 import csv
+import gzip
+import json
+import time
+import shutil
 import argparse
+import tempfile
+import itertools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta
+from urllib.parse import quote
+
+import numpy as np
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # export en colonnes optionnel
+    pa = pq = None
 
 # Add Django project to path
 sys.path.append('/app')
@@ -17,174 +66,712 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'esp32_iot.settings')
 import django
 django.setup()
 
+from bson import ObjectId
+from django.conf import settings
 from sensor_data.models import SensorData
+from sensor_data.features import (FEATURE_COLUMNS, LOOKBACK_HOURS, FeaturePipeline, PyMongoArrowContext,
+                                  bson_arrays, page_arrays)
+
+EXPORT_FIELDS = ('timestamp', 'temperature', 'humidity_air', 'rain_forecast', 'humidity_soil')
+
+# Define CSV columns
+PLAIN_COLUMNS = [
+    'timestamp',
+    'temperature',
+    'humidity_air',
+    'rain_forecast',
+    'humidity_soil'
+]
+
+COLUMNAR_FORMATS = {'parquet': '.parquet', 'arrow': '.arrow'}
+COLUMNAR_COMPRESSION = 'zstd'
+# Lignes accumulées par partition avant d'écrire un row group / record batch
+ROW_GROUP_ROWS = 65536
+
+# Export incrémental : préfixe '_' ignoré par les lecteurs de jeux de données (pyarrow, Spark)
+WATERMARK_FILE = '_watermark.json'
+STAGING_DIR = '_staging'
+
+def read_export_rows(start_date=None, end_date=None, limit=None, batch_size=None, chronological=False):
+    """Raw projected dicts (no mongoengine Document), or None when empty
+
+    Newest first for the plain CSV export; columnar exports and features read in
+    chronological order with the device, so that partitions are completed one
+    after the other and each device's history is built forward.
+    """
+    fields = EXPORT_FIELDS + ('device_id',) if chronological else EXPORT_FIELDS
+    cursor = SensorData.raw_readings(start_date, end_date, fields=fields, limit=limit,
+                                     batch_size=batch_size, oldest_first=chronological, stable=True)
+    return non_empty(cursor)
+
+def read_rows_after(after=None, start_date=None, end_date=None, limit=None, batch_size=None):
+    """Like read_export_rows(chronological=True), in (timestamp, _id) order after the watermark ``after``
 
-def export_sensor_data_to_csv(output_file, start_date=None, end_date=None, limit=None):
+    Documents keep their _id, which gives the next watermark; ``after`` None reads from
+    ``start_date`` (first incremental run).
+    """
+    # Tri (timestamp, _id) exigé par la reprise, y compris en time-series (requêtes successives d'un lot,
+    # chacune triée en mémoire, voir keyset_readings)
+    cursor = SensorData.keyset_readings(start_date, end_date, after=after, fields=EXPORT_FIELDS + ('device_id',),
+                                        limit=limit, batch_size=batch_size, oldest_first=True)
+    return non_empty(cursor)
+
+def non_empty(cursor):
+    """The cursor's documents, or None when it is empty"""
+    first = next(cursor, None)
+    if first is None:
+        return None
+    return itertools.chain([first], cursor)
+
+def record_pages(records, batch_size=None):
+    """Lists of at most ``batch_size`` records, the unit converted and written at once"""
+    batch_size = batch_size or settings.SENSOR_STORAGE['READ_BATCH_SIZE']
+    while True:
+        page = list(itertools.islice(records, batch_size))
+        if not page:
+            break
+        yield page
+
+def read_feature_pages(start_date=None, end_date=None, limit=None, batch_size=None):
+    """Chronological columnar pages for the features export, or None when empty
+
+    With pymongoarrow, each BSON batch of the cursor is decoded straight into
+    columns, without a dict per document; otherwise the cursor dicts are
+    converted page by page with page_arrays().
+    """
+    batch_size = batch_size or settings.SENSOR_STORAGE['FEATURE_BATCH_SIZE']
+    if PyMongoArrowContext is None:
+        records = read_export_rows(start_date, end_date, limit, batch_size, chronological=True)
+        return None if records is None else map(page_arrays, record_pages(records, batch_size))
+    batches = SensorData.raw_batches(start_date, end_date, fields=EXPORT_FIELDS + ('device_id',), limit=limit,
+                                     batch_size=batch_size, oldest_first=True, stable=True)
+    return non_empty(page for page in map(bson_arrays, batches) if len(page['ms']))
+
+def open_output(output_file, compress=False):
+    """Text file for the csv module, gzip-compressed on the fly if asked or if the name ends in .gz"""
+    if compress or output_file.endswith('.gz'):
+        # mtime=0 : mêmes lignes, mêmes octets compressés d'une exécution à l'autre
+        return io.TextIOWrapper(gzip.GzipFile(output_file, 'wb', compresslevel=6, mtime=0),
+                                encoding='utf-8', newline='')
+    return open(output_file, 'w', newline='', encoding='utf-8')
+
+def peak_memory_mb():
+    """Peak resident memory of the process in MB, None where unavailable"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Ko sous Linux, octets sous macOS
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+def csv_column(column):
+    """Python values of a column, empty cells for NaN (unknown temporal features)"""
+    if not isinstance(column, np.ndarray):
+        return column
+    values = column.tolist()
+    if column.dtype.kind == 'f' and np.isnan(column).any():
+        return [None if value != value else value for value in values]
+    return values
+
+def iso_timestamps(column):
+    """ISO 8601 strings of a timestamp column, as datetime.isoformat() writes them"""
+    if not isinstance(column, np.ndarray):
+        return [timestamp.isoformat() for timestamp in column]
+    # datetime64[ms] : secondes seules, microsecondes pour les lectures avec des millisecondes (comme isoformat)
+    strings = np.datetime_as_string(column, unit='s').astype('U26')
+    fractional = np.flatnonzero(column.view(np.int64) % 1000)
+    strings[fractional] = np.datetime_as_string(column[fractional], unit='us')
+    return strings.tolist()
+
+def write_csv(output_file, fieldnames, pages, columns_func, compress=False):
+    """Write the columns of each page (timestamp first), returns (rows written, seconds)
+
+    No header line when ``fieldnames`` is None (slices of a merged export).
+    """
+    started = time.perf_counter()
+    count = 0
+    with open_output(output_file, compress) as csvfile:
+        writer = csv.writer(csvfile)
+        if fieldnames:
+            writer.writerow(fieldnames)
+        for page in pages:
+            columns = columns_func(page)
+            writer.writerows(zip(iso_timestamps(columns[0]), *map(csv_column, columns[1:])))
+            count += len(columns[0])
+    return count, time.perf_counter() - started
+
+def arrow_schema(fieldnames):
+    """Native Arrow types of the export columns (float32 unless listed)"""
+    types = {
+        'timestamp': pa.timestamp('ms', tz='UTC'),
+        'hour_of_day': pa.int8(),
+        'day_of_week': pa.int8(),
+        'month': pa.int8(),
+        'is_rain_predicted': pa.int8(),
+        'season': pa.dictionary(pa.int32(), pa.string()),
+    }
+    return pa.schema([pa.field(name, types.get(name, pa.float32())) for name in fieldnames])
+
+def arrow_column(values, field):
+    if pa.types.is_dictionary(field.type):
+        return pa.array(values, type=field.type.value_type).dictionary_encode()
+    # from_pandas : NaN -> null (caractéristiques temporelles inconnues)
+    return pa.array(values, type=field.type, from_pandas=True)
+
+class ColumnarPartitions:
+    """Files of a partitioned columnar export, one per (period, device), written by row groups"""
+
+    def __init__(self, directory, file_format, schema, part='part-0'):
+        self.directory = directory
+        self.file_format = file_format
+        self.schema = schema
+        self.part = part
+        self._pending = {}
+        self._writers = {}
+        self.files = 0
+        self.bytes = 0
+
+    def path(self, period, device):
+        folder = os.path.join(self.directory, f"date={period}", f"device_id={quote(device, safe='')}")
+        return os.path.join(folder, self.part + COLUMNAR_FORMATS[self.file_format])
+
+    def _open(self, key):
+        path = self.path(*key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if self.file_format == 'parquet':
+            writer = pq.ParquetWriter(path, self.schema, compression=COLUMNAR_COMPRESSION)
+        else:
+            options = pa.ipc.IpcWriteOptions(compression=COLUMNAR_COMPRESSION)
+            writer = pa.ipc.new_file(path, self.schema, options=options)
+        self._writers[key] = (writer, path)
+        return writer
+
+    def _flush(self, key):
+        batches, _ = self._pending.pop(key)
+        writer = self._writers[key][0] if key in self._writers else self._open(key)
+        writer.write_table(pa.Table.from_batches(batches, schema=self.schema))
+
+    def write(self, period, device, batch):
+        key = (period, device)
+        batches, rows = self._pending.get(key, ([], 0))
+        batches.append(batch)
+        self._pending[key] = (batches, rows + batch.num_rows)
+        if rows + batch.num_rows >= ROW_GROUP_ROWS:
+            self._flush(key)
+
+    def _close(self, key):
+        if key in self._pending:
+            self._flush(key)
+        writer, path = self._writers.pop(key)
+        writer.close()
+        self.files += 1
+        self.bytes += os.path.getsize(path)
+
+    def close_before(self, period):
+        """Close the partitions of the periods before ``period`` (already complete)"""
+        for key in [key for key in set(self._pending) | set(self._writers) if key[0] < period]:
+            self._close(key)
+
+    def close(self):
+        for key in list(set(self._pending) | set(self._writers)):
+            self._close(key)
+
+def column_partitions(page, partition='month'):
+    """Row indices of each (period, device) of a columnar page, and the period of its last row"""
+    periods = page['ms'].view('datetime64[ms]').astype('datetime64[D]' if partition == 'day' else 'datetime64[M]')
+    names = page['devices']
+    # Clé entière (période, appareil) de chaque lecture, regroupée par un tri stable
+    first = periods.min()
+    keys = (periods - first).astype(np.int64) * len(names) + page['device_codes']
+    order = np.argsort(keys, kind='stable')
+    groups = {}
+    for indices in np.split(order, np.flatnonzero(np.diff(keys[order])) + 1):
+        period, code = divmod(int(keys[indices[0]]), len(names))
+        groups[(str(first + period), names[code])] = indices
+    return groups, str(periods[-1])
+
+def page_partitions(page, partition='month'):
+    """Row indices of each (period, device) of a page, and the period of its last row"""
+    if isinstance(page, dict):
+        return column_partitions(page, partition)
+    period_length = 10 if partition == 'day' else 7
+    keys = [(record['timestamp'].isoformat()[:period_length], record.get('device_id') or 'default')
+            for record in page]
+    groups = {}
+    for index, key in enumerate(keys):
+        groups.setdefault(key, []).append(index)
+    return groups, keys[-1][0]
+
+def write_columnar(output_dir, file_format, fieldnames, pages, columns_func, partition='month', part='part-0'):
+    """Convert each page to a record batch and split it by partition
+
+    Pages (lists of records or columnar pages) must be in chronological order;
+    ``part`` names the file written in each partition. Returns (rows written,
+    seconds, files, bytes).
+    """
+    # device_id est une clé de partition (device_id=...) : rendue par les lecteurs Hive, pas stockée dans les fichiers
+    stored = [index for index, name in enumerate(fieldnames) if name != 'device_id']
+    schema = arrow_schema([fieldnames[index] for index in stored])
+    started = time.perf_counter()
+    count = 0
+    partitions = ColumnarPartitions(output_dir, file_format, schema, part)
+    try:
+        for page in pages:
+            columns = columns_func(page)
+            batch = pa.record_batch([arrow_column(columns[index], field) for index, field in zip(stored, schema)],
+                                    schema=schema)
+            groups, last_period = page_partitions(page, partition)
+            if len(groups) == 1:
+                partitions.write(*next(iter(groups)), batch)
+            else:
+                for (period, device), indices in groups.items():
+                    partitions.write(period, device, batch.take(pa.array(indices, type=pa.int32())))
+            # Pages chronologiques : les périodes antérieures à la dernière lecture sont terminées
+            partitions.close_before(last_period)
+            count += batch.num_rows
+    finally:
+        partitions.close()
+    return count, time.perf_counter() - started, partitions.files, partitions.bytes
+
+def write_export(output, fieldnames, pages, columns_func, file_format='csv', compress=False, partition='month'):
+    """Write ``pages`` in the requested format, returns (rows written, seconds, description of the output)"""
+    if file_format == 'csv':
+        count, elapsed = write_csv(output, fieldnames, pages, columns_func, compress)
+        return count, elapsed, output
+    count, elapsed, files, size = write_columnar(output, file_format, fieldnames, pages, columns_func, partition)
+    return count, elapsed, f"{files} {file_format} files in {output} ({size / (1024 * 1024):.1f} MB)"
+
+def report_throughput(count, elapsed):
+    rate = count / elapsed if elapsed > 0 else float('inf')
+    peak = peak_memory_mb()
+    memory = f", peak memory {peak:.0f} MB" if peak is not None else ""
+    print(f"{count} rows in {elapsed:.1f}s ({rate:,.0f} rows/s{memory})")
+
+def plain_columns(page):
+    """Columns of the plain export (same order as its header) for one page of records"""
+    return [[record['timestamp'] for record in page]] + [
+        [float(record[field]) for record in page] for field in EXPORT_FIELDS[1:]]
+
+def export_sensor_data_to_csv(output_file, start_date=None, end_date=None, limit=None, compress=False,
+                              batch_size=None, file_format='csv', partition='month'):
     """
     Export sensor data to CSV format
     
     Args:
-        output_file (str): Path to output CSV file
+        output_file (str): Path to output CSV file (directory for columnar formats)
         start_date (datetime): Start date for filtering data
         end_date (datetime): End date for filtering data
         limit (int): Maximum number of records to export
+        compress (bool): Gzip the output on the fly
+        batch_size (int): Readings fetched and written per batch
+        file_format (str): 'csv', 'parquet' or 'arrow'
+        partition (str): Period of the columnar partitions, 'day' or 'month'
     """
     try:
-        # Build query based on parameters
-        if start_date and end_date:
-            queryset = SensorData.get_readings_by_date_range(start_date, end_date)
-            print(f"Exporting data from {start_date} to {end_date}")
+        if start_date or end_date:
+            print(f"Exporting data from {start_date or 'the beginning'} to {end_date or 'now'}")
         else:
-            queryset = SensorData.objects.order_by('-timestamp')
             print("Exporting all data")
         
         if limit:
-            queryset = queryset[:limit]
             print(f"Limited to {limit} records")
         
-        # Convert queryset to list for processing
-        data_list = list(queryset)
+        # Curseur brut projeté, consommé au fil de l'écriture
+        records = read_export_rows(start_date, end_date, limit, batch_size, chronological=file_format != 'csv')
         
-        if not data_list:
+        if records is None:
             print("No data found to export")
             return False
         
-        # Define CSV columns
-        fieldnames = [
-            'timestamp',
-            'temperature',
-            'humidity_air', 
-            'rain_forecast',
-            'humidity_soil'
-        ]
+        # Colonnes produites page par page, écrites par lots
+        count, elapsed, written = write_export(output_file, PLAIN_COLUMNS, record_pages(records, batch_size),
+                                               plain_columns, file_format, compress, partition)
         
-        # Write to CSV
-        with open(output_file, 'w', newline='', encoding='utf-8') as csvfile:
-            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-            
-            # Write header
-            writer.writeheader()
-            
-            # Write data rows
-            for record in data_list:
-                row = {
-                    'timestamp': record.timestamp.isoformat(),
-                    'temperature': float(record.temperature),
-                    'humidity_air': float(record.humidity_air),
-                    'rain_forecast': float(record.rain_forecast),
-                    'humidity_soil': float(record.humidity_soil)
-                }
-                writer.writerow(row)
-        
-        print(f"Successfully exported {len(data_list)} records to {output_file}")
+        print(f"Successfully exported {count} records to {written}")
+        report_throughput(count, elapsed)
         return True
         
     except Exception as e:
         print(f"Error exporting data: {e}")
         return False
 
-def export_training_features(output_file, start_date=None, end_date=None, limit=None):
+def feature_pipeline(start_date=None, batch_size=None, after=None):
+    """FeaturePipeline primed with the LOOKBACK_HOURS of readings preceding ``start_date``
+
+    With a watermark ``after``, the horizon ends at that (timestamp, _id) key, included.
+    """
+    pipeline = FeaturePipeline()
+    history = None
+    if after is not None:
+        timestamp, object_id = after
+        history = SensorData.raw_readings(timestamp - timedelta(hours=LOOKBACK_HOURS), timestamp,
+                                          fields=EXPORT_FIELDS + ('device_id', '_id'), batch_size=batch_size,
+                                          oldest_first=True)
+        # Lectures au même horodatage que le filigrane mais après lui : elles font partie de l'export
+        history = (record for record in history
+                   if record['timestamp'] < timestamp or record['_id'] <= object_id)
+    elif start_date is not None:
+        # Historique de l'horizon : le début de la plage a les mêmes caractéristiques que dans un export complet
+        history = read_export_rows(start_date - timedelta(hours=LOOKBACK_HOURS),
+                                   start_date - timedelta(milliseconds=1), batch_size=batch_size,
+                                   chronological=True)
+    if history is not None:
+        pipeline.prime(history, batch_size or settings.SENSOR_STORAGE['FEATURE_BATCH_SIZE'])
+    return pipeline
+
+def export_training_features(output_file, start_date=None, end_date=None, limit=None, compress=False,
+                             batch_size=None, file_format='csv', partition='month'):
     """
     Export sensor data with additional calculated features for ML training
     
     Args:
-        output_file (str): Path to output CSV file
+        output_file (str): Path to output CSV file (directory for columnar formats)
         start_date (datetime): Start date for filtering data
         end_date (datetime): End date for filtering data 
         limit (int): Maximum number of records to export
+        compress (bool): Gzip the output on the fly
+        batch_size (int): Readings fetched and written per batch
+        file_format (str): 'csv', 'parquet' or 'arrow'
+        partition (str): Period of the columnar partitions, 'day' or 'month'
     """
     try:
-        # Build query
-        if start_date and end_date:
-            queryset = SensorData.get_readings_by_date_range(start_date, end_date)
-        else:
-            queryset = SensorData.objects.order_by('-timestamp')
-        
-        if limit:
-            queryset = queryset[:limit]
+        # Pages chronologiques en colonnes : chaque appareil garde son historique d'une page à l'autre
+        pages = read_feature_pages(start_date, end_date, limit, batch_size)
         
-        data_list = list(queryset)
-        
-        if not data_list:
+        if pages is None:
             print("No data found to export")
             return False
         
-        # Define enhanced CSV columns with calculated features
-        fieldnames = [
-            'timestamp',
-            'temperature',
-            'humidity_air',
-            'rain_forecast',
-            'humidity_soil',
-            'hour_of_day',
-            'day_of_week',
-            'month',
-            'temperature_humidity_air_ratio',
-            'soil_air_humidity_diff',
-            'is_rain_predicted',
-            'season'
-        ]
-        
-        with open(output_file, 'w', newline='', encoding='utf-8') as csvfile:
-            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-            writer.writeheader()
-            
-            for record in data_list:
-                # Calculate additional features
-                timestamp = record.timestamp
-                hour_of_day = timestamp.hour
-                day_of_week = timestamp.weekday()
-                month = timestamp.month
-                
-                # Determine season (Northern Hemisphere)
-                if month in [12, 1, 2]:
-                    season = 'winter'
-                elif month in [3, 4, 5]:
-                    season = 'spring'
-                elif month in [6, 7, 8]:
-                    season = 'summer'
-                else:
-                    season = 'autumn'
-                
-                # Calculate ratios and differences
-                temp_humidity_ratio = float(record.temperature) / max(float(record.humidity_air), 1)
-                soil_air_diff = float(record.humidity_soil) - float(record.humidity_air)
-                is_rain = 1 if float(record.rain_forecast) > 0 else 0
-                
-                row = {
-                    'timestamp': timestamp.isoformat(),
-                    'temperature': float(record.temperature),
-                    'humidity_air': float(record.humidity_air),
-                    'rain_forecast': float(record.rain_forecast),
-                    'humidity_soil': float(record.humidity_soil),
-                    'hour_of_day': hour_of_day,
-                    'day_of_week': day_of_week,
-                    'month': month,
-                    'temperature_humidity_air_ratio': round(temp_humidity_ratio, 2),
-                    'soil_air_humidity_diff': round(soil_air_diff, 2),
-                    'is_rain_predicted': is_rain,
-                    'season': season
-                }
-                writer.writerow(row)
+        columns_func = feature_pipeline(start_date, batch_size).compute
+        count, elapsed, written = write_export(output_file, FEATURE_COLUMNS, pages, columns_func, file_format,
+                                               compress, partition)
         
-        print(f"Successfully exported {len(data_list)} records with features to {output_file}")
+        print(f"Successfully exported {count} records with features to {written}")
+        report_throughput(count, elapsed)
         return True
         
     except Exception as e:
         print(f"Error exporting training features: {e}")
         return False
 
+def time_slices(start_date, end_date, partition='month'):
+    """Consecutive [start, end] slices aligned on day or month boundaries, covering the range exactly"""
+    slices = []
+    current = start_date
+    while current <= end_date:
+        if partition == 'day':
+            boundary = datetime(current.year, current.month, current.day) + timedelta(days=1)
+        else:
+            boundary = datetime(current.year + current.month // 12, current.month % 12 + 1, 1)
+        # Bornes incluses ($gte / $lte) : la tranche s'arrête 1 ms (précision BSON) avant la suivante
+        slices.append((current, min(boundary - timedelta(milliseconds=1), end_date)))
+        current = boundary
+    return slices
+
+def data_range():
+    """(oldest, newest) reading timestamps, None when the collection is empty"""
+    oldest = next(SensorData.raw_readings(fields=('timestamp',), limit=1, oldest_first=True), None)
+    newest = next(SensorData.raw_readings(fields=('timestamp',), limit=1), None)
+    if oldest is None or newest is None:
+        return None
+    return oldest['timestamp'], newest['timestamp']
+
+def export_slice(task):
+    """Worker: export one time slice over this process' connection, returns (rows, files, bytes)"""
+    path, features, start_date, end_date, file_format, compress, batch_size, partition, header = task
+    if features:
+        pages = read_feature_pages(start_date, end_date, None, batch_size)
+        fieldnames = FEATURE_COLUMNS
+    else:
+        records = read_export_rows(start_date, end_date, None, batch_size, chronological=file_format != 'csv')
+        pages = None if records is None else record_pages(records, batch_size)
+        fieldnames, columns_func = PLAIN_COLUMNS, plain_columns
+    if pages is None:
+        return 0, 0, 0
+    if features:
+        columns_func = feature_pipeline(start_date, batch_size).compute
+    if file_format == 'csv':
+        count, _ = write_csv(path, fieldnames if header else None, pages, columns_func, compress)
+        return count, 1, os.path.getsize(path)
+    count, _, files, size = write_columnar(path, file_format, fieldnames, pages, columns_func, partition)
+    return count, files, size
+
+def merge_csv_parts(output_file, fieldnames, parts, compress=False):
+    """Header then the slice files, byte for byte (concatenated gzip members form a valid gzip file)"""
+    with open_output(output_file, compress) as csvfile:
+        csv.writer(csvfile).writerow(fieldnames)
+    with open(output_file, 'ab') as merged:
+        for part in parts:
+            with open(part, 'rb') as source:
+                shutil.copyfileobj(source, merged, 1024 * 1024)
+
+def export_parallel(output, start_date, end_date, workers, features=False, compress=False, batch_size=None,
+                    file_format='csv', partition='month', merge=True):
+    """
+    Export [start_date, end_date] as independent time slices on a process pool
+
+    Args:
+        output (str): Output CSV file, or directory for columnar formats and unmerged CSV
+        start_date (datetime): Start of the range (oldest reading if None)
+        end_date (datetime): End of the range (newest reading if None)
+        workers (int): Number of worker processes
+        features (bool): Export the ML features instead of the plain readings
+        compress (bool): Gzip CSV output on the fly
+        batch_size (int): Readings fetched and written per batch
+        file_format (str): 'csv', 'parquet' or 'arrow'
+        partition (str): Slice (and columnar partition) period, 'day' or 'month'
+        merge (bool): Concatenate CSV slices into ``output`` instead of one file per slice
+    """
+    try:
+        if start_date is None or end_date is None:
+            bounds = data_range()
+            if bounds is None:
+                print("No data found to export")
+                return False
+            start_date, end_date = start_date or bounds[0], end_date or bounds[1]
+
+        slices = time_slices(start_date, end_date, partition)
+        print(f"Exporting data from {start_date} to {end_date} as {len(slices)} slices on {workers} workers")
+
+        started = time.perf_counter()
+        compress = file_format == 'csv' and (compress or output.endswith('.gz'))
+        parts_dir = None
+        if file_format == 'csv':
+            if merge:
+                parts_dir = tempfile.mkdtemp(prefix='.export_parts_', dir=os.path.dirname(os.path.abspath(output)))
+            else:
+                os.makedirs(output, exist_ok=True)
+            suffix = '.csv.gz' if compress else '.csv'
+            # Fichier de tranche nommé d'après sa période : résultat indépendant du nombre de workers
+            paths = [os.path.join(parts_dir or output, start.strftime('%Y-%m-%d') + suffix) for start, _ in slices]
+        else:
+            paths = [output] * len(slices)
+        tasks = [(path, features, start, end, file_format, compress, batch_size, partition, not merge)
+                 for path, (start, end) in zip(paths, slices)]
+
+        # spawn : chaque worker réimporte le script et les settings, donc ouvre sa propre connexion MongoDB
+        # (un MongoClient hérité par fork n'est pas utilisable)
+        context = multiprocessing.get_context('spawn')
+        try:
+            with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+                results = list(executor.map(export_slice, tasks))
+
+            count = sum(rows for rows, _, _ in results)
+            if count == 0:
+                print("No data found to export")
+                return False
+
+            if parts_dir:
+                fieldnames = FEATURE_COLUMNS if features else PLAIN_COLUMNS
+                # Même ordre que l'export séquentiel : chronologique avec features, sinon du plus récent au plus ancien
+                parts = [path for path, (rows, _, _) in zip(paths, results) if rows]
+                merge_csv_parts(output, fieldnames, parts if features else reversed(parts), compress)
+                written = output
+            else:
+                files = sum(files for _, files, _ in results)
+                size = sum(size for _, _, size in results)
+                written = f"{files} {file_format} files in {output} ({size / (1024 * 1024):.1f} MB)"
+        finally:
+            if parts_dir:
+                shutil.rmtree(parts_dir, ignore_errors=True)
+
+        print(f"Successfully exported {count} records to {written}")
+        report_throughput(count, time.perf_counter() - started)
+        return True
+
+    except Exception as e:
+        print(f"Error exporting data in parallel: {e}")
+        return False
+
+class LastKey:
+    """Iterator over chronological records remembering the (timestamp, _id) key of the last one read"""
+
+    def __init__(self, records):
+        self._records = records
+        self.key = None
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        record = next(self._records)
+        self.key = (record['timestamp'], record['_id'])
+        return record
+
+def default_settle():
+    """Seconds before a reading is assumed stored: aggregation window, write-behind delay and spool replay"""
+    ingestion = settings.INGESTION_SETTINGS
+    return ingestion['AGGREGATION_WINDOW'] + ingestion['BATCH_MAX_AGE'] + ingestion['SPOOL_REPLAY_INTERVAL']
+
+def load_watermark(output_dir):
+    """State of an incremental dataset (watermark, last run, settings), None before its first run"""
+    path = os.path.join(output_dir, WATERMARK_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding='utf-8') as state_file:
+        return json.load(state_file)
+
+def fsync_file(path):
+    with open(path, 'rb') as synced:
+        os.fsync(synced.fileno())
+
+def save_watermark(output_dir, state):
+    """Replace the state file atomically: after a crash it holds either the old or the new watermark"""
+    path = os.path.join(output_dir, WATERMARK_FILE)
+    temporary = path + '.tmp'
+    with open(temporary, 'w', encoding='utf-8') as state_file:
+        json.dump(state, state_file, indent=2)
+        state_file.flush()
+        os.fsync(state_file.fileno())
+    os.replace(temporary, path)
+
+def remove_run_files(output_dir, part):
+    """Delete the files of run ``part`` left by a run that crashed before advancing the watermark"""
+    shutil.rmtree(os.path.join(output_dir, STAGING_DIR), ignore_errors=True)
+    for folder, _, names in os.walk(output_dir):
+        for name in names:
+            if name.split('.', 1)[0] == part:
+                os.remove(os.path.join(folder, name))
+
+def publish_run(staging, output_dir):
+    """Move the finished files of a run from the staging directory into the dataset, synced to disk first"""
+    for folder, _, names in os.walk(staging):
+        target = os.path.join(output_dir, os.path.relpath(folder, staging))
+        os.makedirs(target, exist_ok=True)
+        for name in names:
+            path = os.path.join(folder, name)
+            fsync_file(path)
+            os.replace(path, os.path.join(target, name))
+    shutil.rmtree(staging, ignore_errors=True)
+
+def export_incremental(output_dir, start_date=None, limit=None, features=False, compress=False, batch_size=None,
+                       file_format='csv', partition='month', settle=None):
+    """
+    Export the readings stored since the previous run into a new partition of ``output_dir``
+
+    Args:
+        output_dir (str): Dataset directory, holding the watermark and one partition per run
+        start_date (datetime): Start of the first run (ignored once a watermark exists)
+        limit (int): Maximum number of records exported by this run (the next run resumes after them)
+        features (bool): Export the ML features instead of the plain readings
+        compress (bool): Gzip CSV output on the fly
+        batch_size (int): Readings fetched and written per batch
+        file_format (str): 'csv', 'parquet' or 'arrow'
+        partition (str): Period of the columnar partitions, 'day' or 'month'
+        settle (float): Seconds to leave to the ingestion; newer readings wait for the next run
+    """
+    try:
+        os.makedirs(output_dir, exist_ok=True)
+        state = load_watermark(output_dir)
+        dataset = {'features': features, 'format': file_format}
+        if state is not None and state['dataset'] != dataset:
+            print(f"Dataset {output_dir} was exported with {state['dataset']}, not {dataset}")
+            return False
+
+        run = state['run'] + 1 if state else 1
+        part = f"run-{run:06d}"
+        after = (datetime.fromisoformat(state['timestamp']), ObjectId(state['id'])) if state else None
+        cutoff = datetime.utcnow() - timedelta(seconds=default_settle() if settle is None else settle)
+        # Run précédent interrompu avant d'avancer le filigrane : il est refait depuis le même filigrane
+        remove_run_files(output_dir, part)
+
+        if after:
+            print(f"Exporting data after {after[0].isoformat()} ({after[1]}) up to {cutoff}")
+        else:
+            print(f"Exporting data from {start_date or 'the beginning'} up to {cutoff}")
+        if features:
+            batch_size = batch_size or settings.SENSOR_STORAGE['FEATURE_BATCH_SIZE']
+        records = read_rows_after(after, None if after else start_date, cutoff, limit, batch_size)
+        if records is None:
+            print("No new data to export")
+            return True
+
+        # Le filigrane vient des dicts du curseur (_id) : pages de features converties par page_arrays()
+        records = LastKey(records)
+        pages = record_pages(records, batch_size)
+        if features:
+            fieldnames, columns_func = FEATURE_COLUMNS, feature_pipeline(start_date, batch_size, after).compute
+            pages = map(page_arrays, pages)
+        else:
+            fieldnames, columns_func = PLAIN_COLUMNS, plain_columns
+        staging = os.path.join(output_dir, STAGING_DIR)
+        os.makedirs(staging)
+        if file_format == 'csv':
+            name = part + ('.csv.gz' if compress else '.csv')
+            count, elapsed = write_csv(os.path.join(staging, name), fieldnames, pages, columns_func, compress)
+            written = os.path.join(output_dir, name)
+        else:
+            count, elapsed, files, size = write_columnar(staging, file_format, fieldnames, pages, columns_func,
+                                                         partition, part)
+            written = f"{files} {file_format} files ({part}) in {output_dir} ({size / (1024 * 1024):.1f} MB)"
+
+        # Fichiers en place avant le filigrane : une panne entre les deux refait ce run, sans doublon ni trou
+        publish_run(staging, output_dir)
+        timestamp, object_id = records.key
+        save_watermark(output_dir, {
+            'dataset': dataset,
+            'run': run,
+            'timestamp': timestamp.isoformat(),
+            'id': str(object_id),
+            'rows': (state['rows'] if state else 0) + count,
+            'exported_at': datetime.utcnow().isoformat(),
+        })
+
+        print(f"Successfully exported {count} new records to {written}")
+        print(f"Watermark: {timestamp.isoformat()} ({object_id})")
+        report_throughput(count, elapsed)
+        return True
+
+    except Exception as e:
+        print(f"Error exporting data incrementally: {e}")
+        return False
+
 def main():
     parser = argparse.ArgumentParser(description='Export ESP32 IoT sensor data to CSV')
-    parser.add_argument('--output', '-o', required=True, help='Output CSV file path')
+    parser.add_argument('--output', '-o', required=True,
+                        help='Output CSV file path (output directory for parquet/arrow)')
     parser.add_argument('--start-date', help='Start date (YYYY-MM-DD)')
     parser.add_argument('--end-date', help='End date (YYYY-MM-DD)')
     parser.add_argument('--limit', '-l', type=int, help='Maximum number of records to export')
     parser.add_argument('--features', '-f', action='store_true', 
                         help='Export with additional calculated features for ML training')
     parser.add_argument('--last-days', type=int, help='Export data from last N days')
+    parser.add_argument('--gzip', '-z', action='store_true',
+                        help='Compress the output with gzip (implied by a .gz output name)')
+    parser.add_argument('--batch-size', type=int,
+                        help='Readings fetched and written per batch (default: SENSOR_READ_BATCH_SIZE)')
+    parser.add_argument('--format', choices=['csv'] + list(COLUMNAR_FORMATS), default='csv',
+                        help='csv, or a columnar dataset partitioned by period and device')
+    parser.add_argument('--partition', choices=['day', 'month'], default='month',
+                        help='Period of the columnar partitions and parallel slices (default: month)')
+    parser.add_argument('--workers', '-j', type=int, default=1,
+                        help='Export time slices on N worker processes')
+    parser.add_argument('--no-merge', action='store_true',
+                        help='Parallel CSV export: keep one file per slice in the output directory')
+    parser.add_argument('--incremental', '-i', action='store_true',
+                        help='Export only the readings after the watermark of the output directory, as a new partition')
+    parser.add_argument('--settle', type=float,
+                        help='Incremental export: leave readings newer than this many seconds to the next run '
+                             '(default: aggregation window + write-behind and spool replay delays)')
     
     args = parser.parse_args()
+
+    if args.format != 'csv':
+        if pa is None:
+            parser.error(f"--format {args.format} requires pyarrow (pip install pyarrow)")
+        if args.gzip:
+            parser.error("--gzip only applies to CSV, columnar files are compressed with zstd")
+    parallel = args.workers > 1 or args.no_merge
+    if parallel and args.limit:
+        parser.error("--limit cannot be combined with a parallel export")
+    if args.incremental:
+        if parallel:
+            parser.error("--incremental cannot be combined with a parallel export")
+        if args.end_date:
+            parser.error("--incremental exports up to now minus --settle, not up to --end-date")
+    elif args.settle is not None:
+        parser.error("--settle only applies to --incremental")
+    elif (args.format != 'csv' or args.no_merge) and os.path.isdir(args.output) and os.listdir(args.output):
+        parser.error(f"output directory {args.output} is not empty")
     
     # Handle date parameters
     start_date = None
@@ -200,10 +787,18 @@ def main():
             end_date = datetime.fromisoformat(args.end_date)
     
     # Perform export
-    if args.features:
-        success = export_training_features(args.output, start_date, end_date, args.limit)
+    if args.incremental:
+        success = export_incremental(args.output, start_date, args.limit, args.features, args.gzip,
+                                     args.batch_size, args.format, args.partition, args.settle)
+    elif parallel:
+        success = export_parallel(args.output, start_date, end_date, max(args.workers, 1), args.features,
+                                  args.gzip, args.batch_size, args.format, args.partition, not args.no_merge)
+    elif args.features:
+        success = export_training_features(args.output, start_date, end_date, args.limit, args.gzip,
+                                           args.batch_size, args.format, args.partition)
     else:
-        success = export_sensor_data_to_csv(args.output, start_date, end_date, args.limit)
+        success = export_sensor_data_to_csv(args.output, start_date, end_date, args.limit, args.gzip,
+                                            args.batch_size, args.format, args.partition)
     
     if success:
         print(f"Export completed successfully!")
@@ -213,4 +808,4 @@ def main():
         return 1
 
 if __name__ == '__main__':
-    sys.exit(main())
\ No newline at end of file
+    sys.exit(main())